@@ -147,7 +147,8 @@ class dumbbellMediated(VacancyMediated):
     """
 
     def __init__(self, pdbcontainer, mdbcontainer, jnet0data, jnet2data, cutoff, solt_solv_cut, solv_solv_cut,
-                 closestdistance, NGFmax=4, Nthermo=0, omega43_indices=None):
+                 closestdistance, NGFmax=4, Nthermo=0, omega43_indices=None, n_workers=None,
+                 rthermo=None, statedir=None):
         """
 
         :param pdbcontainer: The container object for pure dumbbells - instance of dbStates
@@ -168,6 +169,12 @@ class dumbbellMediated(VacancyMediated):
         :param NGFmax: Parameter controlling k-point density (cf - GFcalc.py from the vacancy version)
         :param Nthermo: The number of jump-nearest neighbor sites that are to be considered within the thermodynamic
         :param self.omega43_indices - list of indices of omega43 jumps to keep.
+        :param n_workers: number of worker processes the starsets group their states into stars and find the omega1
+        jumps with (see stars.StarSet) - serially if None.
+        :param rthermo: if given, only states with solute-dumbbell separations within rthermo are kept in the
+        thermodynamic shell (see stars.StarSet.generate). With Nthermo=None, the shell is the whole sphere.
+        :param statedir: if given, the complex states of the thermodynamic and kinetic shells are kept out of core, in
+        memory-mapped files in this directory (see stars.StarSet).
         """
         # All the required quantities will be extracted from the containers as we move along
         self.pdbcontainer = pdbcontainer
@@ -187,17 +194,17 @@ class dumbbellMediated(VacancyMediated):
         # self.jnet2_indexed = self.kinetic.starset.jnet2_indexed
         print("initializing thermo")
         self.thermo = stars.StarSet(pdbcontainer, mdbcontainer, (self.jnet0, self.jnet0_indexed),
-                                    (self.jnet2, self.jnet2_indexed))
+                                    (self.jnet2, self.jnet2_indexed), n_workers=n_workers, statedir=statedir)
 
         print("initializing kin")
         self.kinetic = stars.StarSet(pdbcontainer, mdbcontainer, (self.jnet0, self.jnet0_indexed),
-                                     (self.jnet2, self.jnet2_indexed))
+                                     (self.jnet2, self.jnet2_indexed), n_workers=n_workers, statedir=statedir)
 
         print("initializing NN")
         start = time.time()
         # Note - even if empty, our starsets go out to atleast the NNstar - later we'll have to keep this in mind
         self.NNstar = stars.StarSet(pdbcontainer, mdbcontainer, (self.jnet0, self.jnet0_indexed),
-                                    (self.jnet2, self.jnet2_indexed), 2)
+                                    (self.jnet2, self.jnet2_indexed), 2, n_workers=n_workers)
         print("2NN Shell initialization time: {}\n".format(time.time() - start))
         self.vkinetic = vector_stars.vectorStars()
 
@@ -206,7 +213,7 @@ class dumbbellMediated(VacancyMediated):
         # self.GFcalc_mixed = GF_dumbbells(self.mdbcontainer, self.jnet2_indexed, Nmax=4, kptwt=None)
 
         # Generate the initialized crystal and vector stars and the jumpnetworks with the kinetic shell
-        self.generate(Nthermo, cutoff, solt_solv_cut, solv_solv_cut, closestdistance)
+        self.generate(Nthermo, cutoff, solt_solv_cut, solv_solv_cut, closestdistance, rthermo)
 
     def generate_jnets(self, cutoff, solt_solv_cut, solv_solv_cut, closestdistance):
         """
@@ -247,19 +254,27 @@ class dumbbellMediated(VacancyMediated):
         # # Generate the bias expansions
         self.biases = self.vkinetic.biasexpansion(self.jnet1, self.jnet2, self.om1types, self.jnet43)
 
-    def generate(self, Nthermo, cutoff, solt_solv_cut, solv_solv_cut, closestdistance):
+    def generate(self, Nthermo, cutoff, solt_solv_cut, solv_solv_cut, closestdistance, rthermo=None):
 
-        if Nthermo == getattr(self, "Nthermo", 0): return
-        self.Nthermo = Nthermo
+        if Nthermo == getattr(self, "Nthermo", 0) and rthermo == getattr(self, "rthermo", None): return
         print("generating thermodynamic shell")
         start = time.time()
-        self.thermo.generate(Nthermo)
+        if rthermo is None and getattr(self, "rthermo", None) is None and Nthermo is not None and \
+                getattr(self, "Nthermo", 0) > 0 and Nthermo > self.Nthermo:
+            # grow the existing thermodynamic shell - the stars already present keep their indices
+            self.thermo.extend(Nthermo - self.Nthermo)
+        else:
+            self.thermo.generate(Nthermo, rthermo)
+        self.Nthermo = Nthermo
+        self.rthermo = rthermo
         print("thermodynamic shell generated: {}".format(time.time() - start))
         print("Total number of states in Thermodynamic Shell - {}, {}".format(len(self.thermo.complexStates),
                                                                               len(self.thermo.mixedstates)))
         print("generating kinetic shell")
         start = time.time()
-        self.kinetic.generate(Nthermo + 1)
+        # The kinetic shell is the thermodynamic shell with one more shell added on top of it
+        self.kinetic = self.thermo.copy()
+        self.kinetic.extend(1)
         print("Kinetic shell generated: {}".format(time.time() - start))
         print("Total number of states in Kinetic Shell - {}, {}".format(len(self.kinetic.complexStates),
                                                                         len(self.kinetic.mixedstates)))
@@ -382,10 +397,10 @@ class dumbbellMediated(VacancyMediated):
             self.eta00_solute = np.zeros((len(self.vkinetic.starset.complexStates), self.crys.dim))
             self.NlsolventBias0 = np.zeros((len(self.vkinetic.starset.complexStates), self.crys.dim))
 
-            for i, state in enumerate(self.vkinetic.starset.complexStates):
-                dbstate_ind = state.db.iorind
-                self.eta00_solvent[i, :] = self.eta00_solvent_bare[dbstate_ind, :].copy()
-                self.NlsolventBias0[i, :] = self.NlsolventVel_bare[dbstate_ind, :].copy()
+            # The dumbbell (i, or) indices of all the complex states are stored in the state table.
+            dbstate_inds = self.vkinetic.starset.complexStates.iorind
+            self.eta00_solvent[:, :] = self.eta00_solvent_bare[dbstate_inds, :]
+            self.NlsolventBias0[:, :] = self.NlsolventVel_bare[dbstate_inds, :]
 
         # For the mixed dumbbell space, translational symmetry tells us that we only need to consider the dumbbells
         # in the first unit cell only. So, we are already considering the bias out of every state we need to consider.
@@ -476,72 +491,37 @@ class dumbbellMediated(VacancyMediated):
         if len(self.vkinetic.vecpos_bare) == 0 and not eta2shift:
             return
 
+        Ncomp = len(self.vkinetic.starset.complexStates)
+        Nvstars_pure = self.vkinetic.Nvstars_pure
+        # get the representative states of the vector stars (their indices among all the states - complex states
+        # followed by mixed states), their vectors and the number of states in them
+        st0 = np.array([self.vkinetic.starset.complexIndexdict[self.vkinetic.vecpos[i][0]][0]
+                        for i in range(Nvstars_pure)] +
+                       [self.vkinetic.starset.mixedindexdict[self.vkinetic.vecpos[i][0]][0] + Ncomp
+                        for i in range(Nvstars_pure, self.vkinetic.Nvstars)], dtype=int)
+        v0 = np.array([self.vkinetic.vecvec[i][0] for i in range(self.vkinetic.Nvstars)]).reshape(-1, self.crys.dim)
+        Nvecs = np.array([len(self.vkinetic.vecpos[i]) for i in range(self.vkinetic.Nvstars)])
+
+        def delbias(jtags, vstars, delbias_solute, delbias_solvent):
+            # The jump tags give, for every initial state, the sum of eta(IS) - eta(FS) over the jumps of each type out
+            # of it - project them on to the vectors of the representative states.
+            for jt, jtag in enumerate(jtags):
+                deleta_solute = jtag.dot(self.eta0total_solute)[st0[vstars]]
+                deleta_solvent = jtag.dot(self.eta0total_solvent)[st0[vstars]]
+                delbias_solute[:, jt] += Nvecs[vstars] * np.sum(deleta_solute * v0[vstars], axis=1)
+                delbias_solvent[:, jt] += Nvecs[vstars] * np.sum(deleta_solvent * v0[vstars], axis=1)
+
+        pure, mixed = np.arange(Nvstars_pure), np.arange(Nvstars_pure, self.vkinetic.Nvstars)
         if eta2shift:
-            for i in range(self.vkinetic.Nvstars - self.vkinetic.Nvstars_pure):
-                # get the representative state(its index in mixedstates) and vector
-                v0 = self.vkinetic.vecvec[i + self.vkinetic.Nvstars_pure][0]
-                st0 = self.vkinetic.starset.mixedindexdict[self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure][0]][0]
-                # Form the projection of the eta vectors on v0
-                eta_proj_solute = np.dot(self.eta0total_solute, v0)
-                eta_proj_solvent = np.dot(self.eta0total_solvent, v0)
-
-                # Now go through the omega2 jump network tags
-                for jt, initindexdict in enumerate(self.jtags2):
-                    # see if there's an array corresponding to the initial state
-                    if not st0 in initindexdict:
-                        continue
-                    self.delbias2expansion_solute[i, jt] += len(self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure]) * \
-                                                            np.sum(np.dot(initindexdict[st0], eta_proj_solute))
-
-                    self.delbias2expansion_solvent[i, jt] += len(self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure]) * \
-                                                             np.sum(np.dot(initindexdict[st0], eta_proj_solvent))
-
-        for i in range(self.vkinetic.Nvstars_pure):
-            # get the representative state(its index in complexStates) and vector
-            v0 = self.vkinetic.vecvec[i][0]
-            st0 = self.vkinetic.starset.complexIndexdict[self.vkinetic.vecpos[i][0]][0]
-            # Index of the state in the flat list
-            eta_proj_solute = np.dot(self.eta0total_solute, v0)
-            eta_proj_solvent = np.dot(self.eta0total_solvent, v0)
-            # Now go through the omega1 jump network tags
-            for jt, initindexdict in enumerate(self.jtags1):
-                # see if there's an array corresponding to the initial state
-                if not st0 in initindexdict:
-                    # if the representative state does not occur as an initial state in any of the jumps, continue.
-                    continue
-                self.delbias1expansion_solute[i, jt] += len(self.vkinetic.vecpos[i]) * np.sum(
-                    np.dot(initindexdict[st0], eta_proj_solute))
-                self.delbias1expansion_solvent[i, jt] += len(self.vkinetic.vecpos[i]) * np.sum(
-                    np.dot(initindexdict[st0], eta_proj_solvent))
-            # Now let's build it for omega4
-            for jt, initindexdict in enumerate(self.jtags4):
-                # see if there's an array corresponding to the initial state
-                if not st0 in initindexdict:
-                    continue
-                self.delbias4expansion_solute[i, jt] += len(self.vkinetic.vecpos[i]) * np.sum(
-                    np.dot(initindexdict[st0], eta_proj_solute))
-                self.delbias4expansion_solvent[i, jt] += len(self.vkinetic.vecpos[i]) * np.sum(
-                    np.dot(initindexdict[st0], eta_proj_solvent))
-
-        for i in range(self.vkinetic.Nvstars - self.vkinetic.Nvstars_pure):
-            # get the representative state(its index in mixedstates) and vector
-            v0 = self.vkinetic.vecvec[i + self.vkinetic.Nvstars_pure][0]
-            st0 = self.vkinetic.starset.mixedindexdict[self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure][0]][0]
-            # Form the projection of the eta vectors on v0
-            eta_proj_solute = np.dot(self.eta0total_solute, v0)
-            eta_proj_solvent = np.dot(self.eta0total_solvent, v0)
-
-            # Need to update for omega3 because the solvent shift vector in the complex space is not zero.
-            # Now let's build the change expansion for omega3
-
-            for jt, initindexdict in enumerate(self.jtags3):
-                # see if there's an array corresponding to the initial state
-                if not st0 in initindexdict:
-                    continue
-                self.delbias3expansion_solute[i, jt] += len(self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure]) * \
-                                                        np.sum(np.dot(initindexdict[st0], eta_proj_solute))
-                self.delbias3expansion_solvent[i, jt] += len(self.vkinetic.vecpos[i + self.vkinetic.Nvstars_pure]) * \
-                                                         np.sum(np.dot(initindexdict[st0], eta_proj_solvent))
+            # Now go through the omega2 jump network tags
+            delbias(self.jtags2, mixed, self.delbias2expansion_solute, self.delbias2expansion_solvent)
+
+        # Now go through the omega1 and omega4 jump network tags
+        delbias(self.jtags1, pure, self.delbias1expansion_solute, self.delbias1expansion_solvent)
+        delbias(self.jtags4, pure, self.delbias4expansion_solute, self.delbias4expansion_solvent)
+
+        # Need to update for omega3 because the solvent shift vector in the complex space is not zero.
+        delbias(self.jtags3, mixed, self.delbias3expansion_solute, self.delbias3expansion_solvent)
 
     def update_bias_expansions(self, rate0list, omega0escape, rate2list, omega2escape, eta2shift=True):
         self.calc_eta(rate0list, omega0escape, rate2list, omega2escape, eta2shift=eta2shift)
@@ -852,7 +832,7 @@ class dumbbellMediated(VacancyMediated):
         om23 = np.zeros((self.vkinetic.Nvstars - Nvstars_pure, self.vkinetic.Nvstars - Nvstars_pure))
 
         # off diagonal elements of om23
-        om23[:, :] += np.dot(rate2expansion, omega2)
+        om23[:, :] += rate2expansion.dot(omega2)
 
         # Next, omega2 escape terms
         for i in range(self.vkinetic.Nvstars - Nvstars_pure):
@@ -871,15 +851,16 @@ class dumbbellMediated(VacancyMediated):
                         [star[0] for star in self.GFstarset_pure]])
 
         GF02[Nvstars_pure:, Nvstars_pure:] = GF2
-        GF02[:Nvstars_pure, :Nvstars_pure] = np.dot(self.GFexpansion_pure, GF0)
+        GF02[:Nvstars_pure, :Nvstars_pure] = self.GFexpansion_pure.dot(GF0)
 
         # make delta omega
         delta_om = np.zeros((self.vkinetic.Nvstars, self.vkinetic.Nvstars))
 
         # off-diagonals
-        delta_om[:Nvstars_pure, :Nvstars_pure] += np.dot(rate1expansion, omega1) - np.dot(rate0expansion, omega0)
-        delta_om[Nvstars_pure:, :Nvstars_pure] += np.dot(rate3expansion, omega3)
-        delta_om[:Nvstars_pure, Nvstars_pure:] += np.dot(rate4expansion, omega4)
+        # The rate expansions are sparse - contract them over the jump types with their dot.
+        delta_om[:Nvstars_pure, :Nvstars_pure] += rate1expansion.dot(omega1) - rate0expansion.dot(omega0)
+        delta_om[Nvstars_pure:, :Nvstars_pure] += rate3expansion.dot(omega3)
+        delta_om[:Nvstars_pure, Nvstars_pure:] += rate4expansion.dot(omega4)
 
         # escapes
         # omega1 and omega4 terms
@@ -1120,9 +1101,7 @@ class dumbbellMediated(VacancyMediated):
         # First, we have to generate the probability arrays and multiply them with the ratelists. This will
         # Give the probability-square-root multiplied rates in the uncorrelated terms.
         # For the complex states, weed out the origin state probabilities
-        for stateind, prob in enumerate(complex_prob):
-            if self.vkinetic.starset.complexStates[stateind].is_zero(self.vkinetic.starset.pdbcontainer):
-                complex_prob[stateind] = 0.
+        complex_prob[self.vkinetic.starset.complexStates.is_zero(self.vkinetic.starset.pdbcontainer)] = 0.
 
         pr_states = (complex_prob, mixed_prob)  # For testing
         # Next, we need the bare dumbbell probabilities for the non-local part of the solvent-solvent transport
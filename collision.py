@@ -2,6 +2,74 @@ import numpy as np
 import onsager.crystal as crystal
 from representations import *
 from test_structs import *
+from scipy.spatial import cKDTree
+import itertools
+import weakref
+
+# Spatial indices of the atom positions of every chemistry, kept for every crystal that collisions are tested in.
+_atomindexcache = weakref.WeakKeyDictionary()
+# Outcomes of the collision tests against other atoms, kept for every crystal and keyed by jump signatures.
+_collisioncache = weakref.WeakKeyDictionary()
+# The largest number of outcomes kept for a crystal - the outcomes are forgotten once there are more of them.
+maxcachedresults = 100000
+
+
+def clearcollisioncache(crys=None):
+    """
+    Forgets the outcomes of the collision tests and the spatial indices of the atoms kept for a crystal (for all
+    crystals if crys is None).
+    """
+    for cache in (_collisioncache, _atomindexcache):
+        if crys is None:
+            cache.clear()
+        else:
+            cache.pop(crys, None)
+
+
+def atomindex(crys, chem, nmax):
+    """
+    Returns a k-d tree of the cartesian positions of the atoms of a given chemistry, for all the lattice vectors
+    within -nmax to nmax along each direction, along with the lattice vectors, basis indices and positions of the
+    atoms in the tree. The trees are cached for each crystal, and made again only when a larger box is needed.
+    """
+    cache = _atomindexcache.setdefault(crys, {})
+    entry = cache.get(chem)
+    if entry is None or any(n > nc for n, nc in zip(nmax, entry[0])):
+        nbox = list(nmax) if entry is None else [max(n, nc) for n, nc in zip(nmax, entry[0])]
+        nvects = np.array(list(itertools.product(*[range(-n, n + 1) for n in nbox])), dtype=int)
+        Nbasis = len(crys.basis[chem])
+        nlist = np.repeat(nvects, Nbasis, axis=0)
+        jlist = np.tile(np.arange(Nbasis), len(nvects))
+        poslist = np.dot(nlist + np.array(crys.basis[chem])[jlist], crys.lattice.T)
+        entry = (tuple(nbox), cKDTree(poslist), nlist, jlist, poslist)
+        cache[chem] = entry
+    return entry[1:]
+
+
+def jumpsignature(crys, chem, i1, vectors, params):
+    """
+    Returns a signature of a jump geometry that is the same for all of its images under the space group.
+    params:
+        crys, chem - the crystal and the chemistry of the sites the jump takes place between.
+        i1 - the basis site the jump starts from.
+        vectors - (k x dim) array of cartesian vectors describing the jump, relative to the position of site i1.
+        params - hashable parameters the outcome of a test on the jump also depends on (e.g., cutoffs)
+    The vectors are rotated by every group operation and snapped to a grid (of spacing crys.threshold), and the
+    smallest of the resulting (site, vectors) tuples is used. Lattice translations do not change the signature.
+    If the crystal has more than one chemistry, the jump is not symmetrized, since the test against other atoms
+    distinguishes sites by their basis index only.
+    """
+    cache = _collisioncache.setdefault(crys, {})
+    gtable = cache.get(("G", chem))
+    if gtable is None:
+        Glist = list(crys.G) if crys.Nchem == 1 else [g for g in crys.G if np.allclose(g.cartrot, np.eye(crys.dim))
+                                                          and np.allclose(g.trans, 0)]
+        gtable = (np.array([g.cartrot for g in Glist]), np.array([g.indexmap[chem] for g in Glist], dtype=int))
+        cache[("G", chem)] = gtable
+    cartrots, sitemaps = gtable
+    rotvecs = np.rint(np.einsum("gij,kj->gki", cartrots, vectors) / crys.threshold).astype(np.int64)
+    rows = np.concatenate([sitemaps[:, i1:i1 + 1], rotvecs.reshape((len(cartrots), -1))], axis=1)
+    return chem, min(map(tuple, rows.tolist())), params
 
 
 def collision_self(dbcontainer, dbcontainer2, jump, cutoff12, cutoff13=None):
@@ -100,6 +168,68 @@ def collision_self(dbcontainer, dbcontainer2, jump, cutoff12, cutoff13=None):
     return (c12 or c13)
 
 
+def collision_self_batch(dbcontainer, dbcontainer2, iorind1, R1, iorind2, R2, c1, c2, cutoff12, cutoff13=None):
+    """
+    Batched version of collision_self - checks for collisions among the three atoms involved in each of an array of
+    dumbbell jumps, in a single pass. The initial and final atom positions are built the same way as collision_self
+    does for jumps between solute-dumbbell pair states, and the same rounding is applied to the closest approach.
+
+    params:
+        dbcontainer - the dumbell states container the initial dumbbells are indexed to.
+        dbcontainer2 - the container the final dumbbells are indexed to, if different (None otherwise).
+        iorind1, R1 - (N,) (i, or) indices and (N x dim) lattice vectors of the initial dumbbells.
+        iorind2, R2 - (N,) (i, or) indices and (N x dim) lattice vectors of the final dumbbells.
+        c1, c2 - (N,) arrays (or single values) of the active atom indicators of the jumps.
+        cutoff12 - minimum allowed distance between the two atoms in the initial dumbbell.
+        cutoff13 - minimum allowed distance between the two atoms in the final dumbbell.
+    Returns:
+        (N,) boolean array - True for the jumps in which atoms collide.
+    """
+    crys = dbcontainer.crys
+    if cutoff13 is None:
+        cutoff13 = cutoff12
+
+    if dbcontainer2 is None:
+        dbcontainer2 = dbcontainer
+
+    def iscolliding(a0i, a1i, a0j, a1j, cutoff):
+        """
+        Row-wise version of the iscolliding function in collision_self.
+        """
+        num = np.sum((a1i - a1j) * (a0i - a0j), axis=1)
+        den = np.sum((a1i - a1j) * (a1i - a1j), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tmin = np.round(-num / den, decimals=6)
+        dmin = (a0i + a1i * tmin[:, None]) - (a0j + a1j * tmin[:, None])
+        mindist2 = np.round(np.sum(dmin * dmin, axis=1), decimals=4)
+        # The comparisons are written as negations, so that undefined closest approaches behave the same as in the
+        # scalar version.
+        intime = np.logical_not(np.logical_or(tmin <= 0, tmin >= 1))
+        return np.logical_and(intime, np.logical_not(mindist2 >= np.round(cutoff ** 2, decimals=6)))
+
+    iorind1, iorind2 = np.asarray(iorind1, dtype=int), np.asarray(iorind2, dtype=int)
+    c1 = np.broadcast_to(np.asarray(c1, dtype=float), iorind1.shape)[:, None]
+    c2 = np.broadcast_to(np.asarray(c2, dtype=float), iorind1.shape)[:, None]
+    o1 = np.array([o for i, o in dbcontainer.iorlist]).reshape((len(dbcontainer.iorlist), crys.dim))[iorind1]
+    o2 = np.array([o for i, o in dbcontainer2.iorlist]).reshape((len(dbcontainer2.iorlist), crys.dim))[iorind2]
+    x1 = np.dot(np.asarray(R1), crys.lattice.T) + dbcontainer.iorcart[iorind1]
+    x2 = np.dot(np.asarray(R2), crys.lattice.T) + dbcontainer2.iorcart[iorind2]
+
+    # create the initial and final locations of the atoms
+    R1i = x1 + (c1 / 2.) * o1
+    R2i = x1 - (c1 / 2.) * o1
+    R3i = x2
+    R1f = x2 + (c2 / 2.) * o2
+    R2f = x1
+    R3f = x2 - (c2 / 2.) * o2
+
+    # not considering rotations(yet).
+    rotation = np.all(np.abs(R1i - R1f) <= 1e-8 + 1e-5 * np.abs(R1f), axis=1)
+    c12 = iscolliding(R1i, R1f - R1i, R2i, R2f - R2i, cutoff12)
+    c13 = iscolliding(R1i, R1f - R1i, R3i, R3f - R3i, cutoff13)
+    return np.logical_and(np.logical_not(rotation), np.logical_or(c12, c13))
+
+
 def collision_others(container, container2, jmp, closestdistance):
     """
     Takes a jump and sees if the moving atom of the dumbbell collides with any other atom.
@@ -146,34 +276,42 @@ def collision_others(container, container2, jmp, closestdistance):
     dR2 = np.dot(dR, dR)
     if np.allclose(dR, 0, atol=crys.threshold):
         return False
-    nmax = [int(np.round(np.sqrt(dx2 / crys.metric[i, i]))) + 1 for i in range(crys.dim)]
-    # print(nmax)
-    if crys.dim == 2:
-        supervect = [np.array([n0, n1]) for n0 in range(-nmax[0], nmax[0] + 1) for n1 in range(-nmax[1], nmax[1] + 1)]
-    else:
-        supervect = [np.array([n0, n1, n2]) for n0 in range(-nmax[0], nmax[0] + 1) for n1 in range(-nmax[1], nmax[1] + 1)
-                     for n2 in range(-nmax[2], nmax[2] + 1)]
-    # print(supervect)
-    # print()
+    # Symmetrically equivalent jumps give the same outcome - see if an equivalent one has been tested before.
+    signature = jumpsignature(crys, chem, i1, np.array([(c1 / 2.) * o1, dx, dR]), tuple(closest2list))
+    results = _collisioncache[crys].setdefault("results", {})
+    if signature in results:
+        return results[signature]
+    if len(results) >= maxcachedresults:
+        results.clear()
+
+    # Original position of the jumping atom and the middle of its path
+    x0 = crys.unit2cart(R1, crys.basis[chem][i1]) + (c1 / 2.) * o1
+    xmid = x0 + dx / 2.
     # now test against other atoms, treating the initial atom as the origin
+    collides = False
     for c, mindist2 in enumerate(closest2list):
-        for j, u0 in enumerate(crys.basis[c]):
-            for n in supervect:
-                # skip checking against the atom in the initial and destination site
-                if np.allclose(R1, n, atol=crys.threshold) and j == i1:
-                    continue
-                if np.allclose(R2, n, atol=crys.threshold) and j == i2:
-                    continue
-                x = crys.unit2cart(n, u0) - (crys.unit2cart(R1, crys.basis[chem][i1]) + (c1 / 2.) * o1)
-                # Get the location of the atom with respect to the original position of the jumping atom
-                x2 = np.dot(x, x)
-                x_dx = np.dot(x, dx)
-                d2 = (x2 * dx2 - x_dx ** 2) / dx2
-                # if j==1 and np.allclose(n,0,atol=1e-8):
-                #     print(d2)
-                if 0 <= x_dx <= dx2:
-                    if np.isclose(d2, mindist2) or d2 < mindist2:
-                        # print(c,n,u0)
-                        # This print statement is only for seeing outputs in the testing phase.
-                        return True
-    return False  # if no collision occurs.
+        # Only atoms within (half the jump length + closest distance) of the middle of the path can collide - the
+        # radius is padded to allow for the tolerance in the distance comparison below. All the atoms within it are
+        # tested, which does not depend on the orientation or the position of the jump.
+        radius = np.sqrt(dx2) / 2. + np.sqrt(mindist2 * (1. + 1e-5) + 1e-8) + 1e-8
+        # lattice vectors large enough for the index to hold all the atoms within the radius
+        nmax = (np.ceil(np.abs(np.dot(crys.invlatt, xmid)) + radius * np.linalg.norm(crys.invlatt, axis=1))
+                .astype(int) + 1)
+        tree, nlist, jlist, poslist = atomindex(crys, c, nmax)
+        near = np.sort(np.array(tree.query_ball_point(xmid, radius), dtype=int))
+        # skip checking against the atom in the initial and destination site
+        skip = np.logical_or(
+            np.logical_and(np.all(np.abs(nlist[near] - R1) <= crys.threshold, axis=1), jlist[near] == i1),
+            np.logical_and(np.all(np.abs(nlist[near] - R2) <= crys.threshold, axis=1), jlist[near] == i2))
+        near = near[np.logical_not(skip)]
+        # Get the location of the atoms with respect to the original position of the jumping atom
+        x = poslist[near] - x0
+        x2 = np.sum(x * x, axis=1)
+        x_dx = np.dot(x, dx)
+        d2 = (x2 * dx2 - x_dx ** 2) / dx2
+        inpath = np.logical_and(0 <= x_dx, x_dx <= dx2)
+        if np.any(np.logical_and(inpath, np.logical_or(np.isclose(d2, mindist2), d2 < mindist2))):
+            collides = True
+            break
+    results[signature] = collides
+    return collides
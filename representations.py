@@ -1,6 +1,99 @@
 import numpy as np
+import os
+import shutil
+import tempfile
+import weakref
 from collections import namedtuple
 
+# Canonical integer keys for states and jumps.
+# Every lattice vector component is stored as a signed digit of _RBITS bits, and the basis/orientation indices
+# are stacked above them. A dumbbell key is iorind * _RBASE**dim + (R digits), and a SdPair key puts the solute
+# site (and then the solute lattice vector) above the dumbbell key. This way, every state with the solute in the
+# origin unit cell (all the states in a StarSet) fits into a single int64, while states with the solute
+# elsewhere still get a unique (python) integer.
+# Equality and hashing of the state and jump objects are done with these keys.
+_RBITS = 12
+_RBASE = 1 << _RBITS
+_RHALF = _RBASE >> 1
+_IORBITS = 12
+_ISBITS = 8
+_JSHIFT = 1 << 100
+
+
+def packR(R):
+    """
+    Packs an integer lattice vector into a single integer, one signed digit per component.
+    """
+    key = 0
+    for x in (R.tolist() if isinstance(R, np.ndarray) else R):
+        x = round(x)
+        if not -_RHALF <= x < _RHALF:
+            raise ValueError("lattice vector component {} too large to pack".format(x))
+        key = key * _RBASE + x
+    return key
+
+
+def packdb(iorind, R):
+    """
+    :param iorind: (i, or) index of a dumbbell.
+    :param R: lattice vector of the dumbbell.
+    :return: canonical integer key of the dumbbell.
+    """
+    return int(iorind) * _RBASE ** len(R) + packR(R)
+
+
+def packpair(i_s, R_s, iorind, R):
+    """
+    :return: canonical integer key of the solute-dumbbell pair with the solute at (i_s, R_s) and the dumbbell at
+    (iorind, R).
+    """
+    if not (0 <= i_s < 1 << _ISBITS and 0 <= iorind < 1 << _IORBITS):
+        raise ValueError("site or (i, or) index too large to pack")
+    return (packR(R_s) * (1 << _ISBITS) + int(i_s)) * ((1 << _IORBITS) * _RBASE ** len(R)) + packdb(iorind, R)
+
+
+def packjump(key1, key2, c1, c2):
+    """
+    :return: canonical integer key of a jump, given the keys of its initial and final states and the c1, c2 indicators.
+    """
+    return ((key1 * _JSHIFT + key2) * 2 + int(c1 > 0)) * 2 + int(c2 > 0)
+
+
+def packR_array(R):
+    """
+    Vectorized version of packR - R is an (..., dim) array of lattice vectors.
+    """
+    R = np.rint(np.asarray(R)).astype(np.int64)
+    if np.any(R < -_RHALF) or np.any(R >= _RHALF):
+        raise ValueError("lattice vector components too large to pack")
+    key = np.zeros(R.shape[:-1], dtype=np.int64)
+    for d in range(R.shape[-1]):
+        key = key * _RBASE + R[..., d]
+    return key
+
+
+def packdb_array(iorind, R):
+    """
+    Vectorized version of packdb - returns an int64 array of dumbbell keys.
+    """
+    R = np.asarray(R)
+    return np.asarray(iorind, dtype=np.int64) * _RBASE ** R.shape[-1] + packR_array(R)
+
+
+def packpair_array(i_s, R_s, iorind, R):
+    """
+    Vectorized version of packpair - returns an int64 array of pair keys.
+    The keys fit into int64 when the solutes are in (or close to) the origin unit cell, which is always the case for
+    the states in a StarSet. Otherwise, the exact keys are returned as an object array of python integers.
+    """
+    R = np.asarray(R)
+    dbspan = (1 << _IORBITS) * _RBASE ** R.shape[-1]
+    Rs_keys = packR_array(R_s) * (1 << _ISBITS) + np.asarray(i_s, dtype=np.int64)
+    if np.any(np.abs(Rs_keys) >= (1 << 62) // dbspan):
+        return np.array([sk * dbspan + dk for sk, dk in zip(Rs_keys.tolist(), packdb_array(iorind, R).tolist())],
+                        dtype=object)
+    return Rs_keys * dbspan + packdb_array(iorind, R)
+
 
 # Single dumbbell state representer class.
 # 1. Format - 'i o R c' -> basis index, orientation, lattice vector, active atom indicator
@@ -10,11 +103,19 @@ from collections import namedtuple
 
 class dumbbell(namedtuple('dumbbell', 'iorind R')):
 
+    @property
+    def key(self):
+        """
+        canonical integer key of the dumbbell - computed once and cached.
+        """
+        try:
+            return self.__dict__['_key']
+        except KeyError:
+            self.__dict__['_key'] = packdb(self.iorind, self.R)
+            return self.__dict__['_key']
+
     def __eq__(self, other):
-        # zero=np.zeros(len(self.o))
-        true_class = isinstance(other, self.__class__)
-        c1 = true_class and (self.iorind == other.iorind and np.allclose(self.R, other.R, atol=1e-8))
-        return c1
+        return isinstance(other, self.__class__) and self.key == other.key
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -24,22 +125,18 @@ class dumbbell(namedtuple('dumbbell', 'iorind R')):
     #     return self.__class__(container.fliplist[self.iorind], self.R)
 
     def __hash__(self):
-        # o = np.round(self.o,6)
-        # return hash((self.i,o[0],o[1]*5,o[2],self.R[0],self.R[1],self.R[2]))
-        return hash((self.iorind,) + tuple(self.R))
+        return hash(self.key)
 
     def gop(self, container, gdumb, pure=True):
 
         # If we have a pure dumbbell, we return the result of the groupop, as well as the flip indicator
         # Otherwise, just return the new dumbbell
-        i, o = container.iorlist[self.iorind]
-        # Dealing with a pure dumbbell
-        R_new, (ch, i_new) = container.crys.g_pos(container.G_crys[gdumb], self.R, (container.chem, i))
-        if not i_new == container.iorlist[gdumb.indexmap[0][self.iorind]][0]:
-            raise ValueError("Gdumb and G not consistent")
-        newind = gdumb.indexmap[0][self.iorind]
+        # The action of the group operation on the sites and (i, or) indices is tabulated in the container
+        gind = container.gopindex(gdumb)
+        R_new = np.dot(container.gop_rot[gind], self.R) + container.gop_trans[gind, container.iorsites[self.iorind]]
+        newind = int(container.gop_iormap[gind, self.iorind])
         if pure:
-            flipind = container.gflip(gdumb, self.iorind)
+            flipind = int(container.gop_flip[gind, self.iorind])
             return self.__class__(newind, R_new), flipind
         else:
             return self.__class__(newind, R_new)
@@ -68,11 +165,20 @@ class dumbbell(namedtuple('dumbbell', 'iorind R')):
 # 6. Applying group operations should be able to return the correct results for seperated and mixed dumbbell pairs.
 
 class SdPair(namedtuple('SdPair', "i_s R_s db")):
+
+    @property
+    def key(self):
+        """
+        canonical integer key of the solute-dumbbell pair - computed once and cached.
+        """
+        try:
+            return self.__dict__['_key']
+        except KeyError:
+            self.__dict__['_key'] = packpair(self.i_s, self.R_s, self.db.iorind, self.db.R)
+            return self.__dict__['_key']
+
     def __eq__(self, other):
-        true_class = isinstance(other, self.__class__)
-        true_solute = self.i_s == other.i_s and np.allclose(self.R_s, other.R_s, atol=1e-8)
-        true_db = self.db == other.db
-        return true_class and true_solute and true_db
+        return isinstance(other, self.__class__) and self.key == other.key
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -82,13 +188,13 @@ class SdPair(namedtuple('SdPair', "i_s R_s db")):
     #     return self.__class__(self.i_s, self.R_s, self.db.flip(container))
 
     def __hash__(self):
-        return hash((self.i_s, self.R_s[0], hash(self.db)))
-        # return id(self)
+        return hash(self.key)
 
     def gop(self, container, gdumb, complex=True):  # apply group operation
         # If we have a complex, return a flip indicator as well, else, just return the new pair
-        R_s_new, (ch, i_s_new) = container.crys.g_pos(container.G_crys[gdumb], self.R_s,
-                                                      (container.chem, self.i_s))
+        gind = container.gopindex(gdumb)
+        R_s_new = np.dot(container.gop_rot[gind], self.R_s) + container.gop_trans[gind, self.i_s]
+        i_s_new = int(container.gop_sitemap[gind, self.i_s])
         if complex:
             dbnew, flip = self.db.gop(container, gdumb, pure=True)
             return self.__class__(i_s_new, R_s_new, dbnew), flip
@@ -157,6 +263,223 @@ class SdPair(namedtuple('SdPair', "i_s R_s db")):
         return connector(self.db - self.db.R, other.db - self.db.R)
 
 
+class StateTable(object):
+    """
+    Struct-of-arrays storage for a list of SdPair states.
+    The solute sites, solute lattice vectors, dumbbell (i, or) indices and dumbbell lattice vectors are kept in
+    contiguous integer arrays (i_s, R_s, iorind and R respectively), along with the canonical keys of the states.
+    SdPair objects are only created (and then cached) when they are asked for, so that the table can still be used
+    like the list of states it replaces - indexing, iterating, slicing, "in" and index().
+    For very large sets of states, the table can be kept out of core (see fromarrays) - the arrays are then
+    memory-mapped from disk, states are looked up by binary search over the sorted keys, and no SdPair objects are
+    cached.
+    """
+
+    def __init__(self, states=None, dim=3):
+        """
+        :param states: iterable of SdPair objects, in the order they are to be stored.
+        :param dim: dimensionality of the crystal - needed only if the table is empty.
+        """
+        states = [] if states is None else list(states)
+        if len(states) > 0:
+            dim = len(states[0].db.R)
+        i_s = np.array([st.i_s for st in states], dtype=int)
+        R_s = np.array([st.R_s for st in states], dtype=int).reshape((len(states), dim))
+        iorind = np.array([st.db.iorind for st in states], dtype=int)
+        R = np.array([st.db.R for st in states], dtype=int).reshape((len(states), dim))
+        self._setarrays(i_s, R_s, iorind, R)
+
+    @classmethod
+    def fromarrays(cls, i_s, R_s, iorind, R, directory=None):
+        """
+        Builds the table directly from the (i_s, R_s, iorind, R) arrays of the states.
+        :param directory: if given, the table is stored out of core, as memory-mapped .npy files in a new
+        subdirectory of this directory. The subdirectory is deleted when the table is garbage collected.
+        """
+        table = cls.__new__(cls)
+        table._setarrays(np.asarray(i_s, dtype=int), np.asarray(R_s, dtype=int),
+                         np.asarray(iorind, dtype=int), np.asarray(R, dtype=int), directory)
+        return table
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens the files of an out of core table (its path) read-only, without copying them - for other processes
+        to read the table with. The files are still deleted along with the table that made them.
+        """
+        table = cls.__new__(cls)
+
+        def load(name):
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        table.i_s, table.R_s, table.iorind, table.R, table.keys = \
+            load("i_s"), load("R_s"), load("iorind"), load("R"), load("keys")
+        table._sortedkeys, table._keyorder = load("sortedkeys"), load("keyorder")
+        table.dim = table.R.shape[1]
+        table.directory, table.path = os.path.dirname(path), path
+        table._indexdict, table._states = None, None
+        return table
+
+    def _setarrays(self, i_s, R_s, iorind, R, directory=None):
+        keys = packpair_array(i_s, R_s, iorind, R)
+        self.dim = R.shape[1]
+        self.directory = directory
+        # The index to look the states up with - the sorted keys and the rows they come from - is only built when
+        # it is first needed, since most tables (such as the images of states under group operations) never are.
+        self._sortedkeys, self._keyorder, self._indexdict = None, None, None
+        if directory is None or keys.dtype == object:
+            # Keys that do not fit into int64 cannot be memory-mapped - such tables are always kept in memory.
+            self.directory, self.path = None, None
+            self.i_s, self.R_s, self.iorind, self.R, self.keys = i_s, R_s, iorind, R, keys
+            if len(np.unique(keys)) != len(keys):
+                raise ValueError("Repeated states entered in the state table")
+            self._states = [None] * len(keys)
+            return
+        path = tempfile.mkdtemp(prefix="states", dir=directory)
+        # The files belong to this table only - they are deleted along with it.
+        self.path = path
+        weakref.finalize(self, shutil.rmtree, path, ignore_errors=True)
+
+        def tofile(name, arr):
+            out = np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+", dtype=arr.dtype,
+                                            shape=arr.shape)
+            out[...] = arr
+            out.flush()
+            return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+        self.i_s, self.R_s, self.iorind, self.R, self.keys = \
+            tofile("i_s", i_s), tofile("R_s", R_s), tofile("iorind", iorind), tofile("R", R), tofile("keys", keys)
+        keyorder = np.argsort(keys, kind="stable")
+        sortedkeys = keys[keyorder]
+        if np.any(sortedkeys[1:] == sortedkeys[:-1]):
+            raise ValueError("Repeated states entered in the state table")
+        self._sortedkeys, self._keyorder = tofile("sortedkeys", sortedkeys), tofile("keyorder", keyorder)
+        self._states = None
+
+    @property
+    def indexdict(self):
+        "Dictionary giving the row of a state from its key - only for tables kept in memory"
+        if self._indexdict is None and self.directory is None:
+            self._indexdict = {k: ind for ind, k in enumerate(self.keys.tolist())}
+        return self._indexdict
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _getstate(self, ind):
+        st = None if self._states is None else self._states[ind]
+        if st is None:
+            st = SdPair(int(self.i_s[ind]), np.array(self.R_s[ind]), dumbbell(int(self.iorind[ind]),
+                                                                             np.array(self.R[ind])))
+            st.__dict__['_key'] = int(self.keys[ind])
+            if self._states is not None:
+                self._states[ind] = st
+        return st
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self._getstate(i) for i in range(len(self))[ind]]
+        if ind < 0:
+            ind += len(self)
+        if not 0 <= ind < len(self):
+            raise IndexError("state table index out of range")
+        return self._getstate(ind)
+
+    def __iter__(self):
+        for ind in range(len(self)):
+            yield self._getstate(ind)
+
+    def __contains__(self, state):
+        return isinstance(state, SdPair) and self.getindices(np.array([state.key]))[0] >= 0
+
+    def index(self, state):
+        """
+        :return: the row of the given SdPair in the table. Raises ValueError if it is not present.
+        """
+        try:
+            ind = self.indexdict.get(state.key, -1) if self.directory is None else \
+                self.getindices(np.array([state.key]))[0]
+        except AttributeError:
+            ind = -1
+        if ind < 0:
+            raise ValueError("{} is not in the state table".format(state))
+        return ind
+
+    def getindices(self, keys):
+        """
+        Looks up the rows of the states with the given array of keys - -1 where absent.
+        """
+        keys = np.asarray(keys)
+        if self.keys.dtype == object or keys.dtype == object:
+            if self.directory is None:
+                return np.array([self.indexdict.get(k, -1) for k in keys.ravel().tolist()],
+                                dtype=int).reshape(keys.shape)
+            # Keys that do not fit into int64 cannot be in an out of core table.
+            inds = np.full(keys.size, -1, dtype=int)
+            fits = np.array([-(1 << 63) <= k < (1 << 63) for k in keys.ravel().tolist()], dtype=bool)
+            inds[fits] = self.getindices(keys.ravel()[fits].astype(np.int64))
+            return inds.reshape(keys.shape)
+        if self._sortedkeys is None:
+            self._keyorder = np.argsort(self.keys, kind="stable")
+            self._sortedkeys = self.keys[self._keyorder]
+        if len(self) == 0:
+            return np.full(keys.shape, -1, dtype=int)
+        pos = np.minimum(np.searchsorted(self._sortedkeys, keys), len(self) - 1)
+        return np.where(self._sortedkeys[pos] == keys, self._keyorder[pos], -1)
+
+    def lookup(self, i_s, R_s, iorind, R):
+        """
+        Looks up the rows of the states given as arrays of their solute and dumbbell locations - -1 where absent.
+        """
+        return self.getindices(packpair_array(i_s, R_s, iorind, R))
+
+    def is_zero(self, container):
+        """
+        Vectorized version of SdPair.is_zero for all the states in the table.
+        """
+        sites = np.array([i for i, o in container.iorlist], dtype=int)
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        return (self.i_s == sites[self.iorind]) & np.all(self.R_s == self.R, axis=1)
+
+
+class StateRows(object):
+    """
+    List-like view of some of the rows of a StateTable. Stands in for lists of SdPair objects (such as stars) made out
+    of out of core tables, so that the objects are only made when they are asked for.
+    """
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = np.asarray(rows, dtype=int)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self.table[int(row)] for row in self.rows[ind]]
+        return self.table[int(self.rows[ind])]
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.table[int(row)]
+
+    def __contains__(self, state):
+        return isinstance(state, SdPair) and self.table.getindices(np.array([state.key]))[0] in self.rows
+
+    def index(self, state):
+        if state in self:
+            return int(np.nonzero(self.rows == self.table.index(state))[0][0])
+        raise ValueError("{} is not in the list of states".format(state))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
 # Jump obects are rather simple, contain just initial and final orientations
 # dumbell/pair objects are not aware of jump objects.
 
@@ -167,17 +490,26 @@ class jump(namedtuple('jump', 'state1 state2 c1 c2')):
         if not isinstance(self.state2, self.state1.__class__):
             raise TypeError("Incompatible Initial and final states. They must be of the same type.")
 
+    @property
+    def key(self):
+        """
+        canonical integer key of the jump - computed once and cached.
+        """
+        try:
+            return self.__dict__['_key']
+        except KeyError:
+            self.__dict__['_key'] = packjump(self.state1.key, self.state2.key, self.c1, self.c2)
+            return self.__dict__['_key']
+
     def __eq__(self, other):
-        return (self.state1 == other.state1 and self.state2 == other.state2 and
-                self.c1 == other.c1 and self.c2 == other.c2)
+        return (isinstance(other, jump) and isinstance(other.state1, self.state1.__class__) and
+                self.key == other.key)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        # return hash((self.state1,self.state2,self.c1,self.c2))
-        return hash((hash(self.state1), hash(self.state2), self.c1, self.c2))
-        # return id(self)
+        return hash(self.key)
 
     def __add__(self, other):
         # Do type checking of input operands and jump states
@@ -3,10 +3,179 @@ import onsager.crystal as crystal
 # from jumpnet3 import *
 from states import *
 import itertools
-from collections import defaultdict
+import copy
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from scipy.sparse import csr_matrix
+from concurrent.futures import ProcessPoolExecutor
 from representations import *
 import time
 
+# The number of states whose images are tabulated at once when grouping the states into stars, and the number of
+# omega1 jumps whose initial and final states' images are tabulated at once
+_groupchunk = 1 << 16
+
+# The container and the complex states of the worker processes of a StarSet (set once in each worker by _initworker)
+_workerdata = {}
+
+
+def _initworker(container, table):
+    # The group operations are looked up by id in the container - the ids change when it is sent to the worker.
+    container.Gindexdict = {id(gdumb): gind for gind, gdumb in enumerate(container.Glist)}
+    _workerdata["container"] = container
+    # Out of core states are read from their files, given the path of the table.
+    _workerdata["table"] = StateTable.open(table) if isinstance(table, str) else table
+
+
+def _workercall(func, args):
+    "Calls func on the state table and the container of the worker"
+    return func(_workerdata["table"], _workerdata["container"], *args)
+
+
+def imageindices(states, container, gdumbs, table=None):
+    """
+    Finds the images of a table of states under a list of dumbbell group operations, with the solute shifted back
+    to the origin unit cell.
+    :param states: StateTable of the states to be transformed
+    :param container: pdbcontainer for complex states and mdbcontainer for mixed states
+    :param gdumbs: the group operations, from container.G
+    :param table: StateTable to find the images in - states itself if not given.
+    :return: imageinds - (len(gdumbs) x len(states)) indices of the images in table (-1 if an image is not in it)
+             flips - (len(gdumbs) x len(states)) flips of the dumbbell orientations (all ones for mixed states)
+    """
+    table = states if table is None else table
+    imageinds = np.full((len(gdumbs), len(states)), -1, dtype=int)
+    flips = np.ones((len(gdumbs), len(states)), dtype=int)
+    if len(states) == 0:
+        return imageinds, flips
+    for gind, gdumb in enumerate(gdumbs):
+        if isinstance(container, dbStates):
+            images, flips[gind] = container.gop_batch(states, gdumb)
+        else:
+            images = container.gop_batch(states, gdumb)
+        imageinds[gind] = table.getindices(packpair_array(images.i_s, images.R_s - images.R_s, images.iorind,
+                                                          images.R - images.R_s))
+    return imageinds, flips
+
+
+def _tablerows(table, rows):
+    "The states at the given rows of a StateTable, as a new (in memory) table"
+    return StateTable.fromarrays(table.i_s[rows], table.R_s[rows], table.iorind[rows], table.R[rows])
+
+
+def starchunk(table, container, rows):
+    """
+    Finds the stars of the complex states at the given (increasing) rows of a table. The star of a state is made of
+    the images of the state in it with the lowest row (its representative), in the order of container.Glist - so the
+    stars come out the same however the rows of a table are split up.
+    :return: the rows of the states in the stars whose representatives are among rows, in the order of their
+    representatives.
+    """
+    rows = np.asarray(rows, dtype=int)
+    # An index of -1 means the image is not in the table.
+    imageinds = imageindices(_tablerows(table, rows), container, container.Glist, table)[0]
+    orbitmin = np.where(imageinds >= 0, imageinds, len(table)).min(axis=0)
+    stars = []
+    for n in np.nonzero(orbitmin == rows)[0].tolist():
+        images = imageinds[:, n]
+        stars.append(list(dict.fromkeys(images[images >= 0].tolist())))
+    return stars
+
+
+def _droprotations(newlist, jumpset):
+    """
+    Removes the redundant rotations from the images newlist of an omega1 jump with no displacement - a jump is
+    discarded (from newlist and from jumpset) if the jump with both orientations reversed is in jumpset.
+    :return: the indices of the jumps kept in newlist
+    """
+    keep = []
+    for jind in range(len(newlist) - 1, -1, -1):
+        # start from the last, so that jumps discarded later on are not looked at.
+        IS_new, FS_new, c1_new, c2_new = newlist[jind]
+        if (IS_new, FS_new, -c1_new, -c2_new) in jumpset:
+            # keep the equivalent, discard the original. Also discard the original from the jumpset, or the
+            # equivalent will be removed later.
+            jumpset.remove(newlist[jind])
+        else:
+            keep.append(jind)
+    return keep[::-1]
+
+
+def orbitchunk(table, container, IS, FS, c1, c2):
+    """
+    Finds the symmetric images of a chunk of omega1 jumps, between the complex states at the rows IS and FS of a
+    table, with the dumbbell orientations c1 and c2 (arrays, one entry per jump).
+    The images of each jump are found on their own - StarSet.jumpnetwork_omega1 merges them in order. A jump that is an
+    image of an earlier jump of the chunk is skipped, unless it is a rotation (a jump with no displacement) - the
+    images of rotations may be removed as redundant, and found again later on.
+    :return: for each jump, None if it was skipped, or its images as (initial, final, c1, c2) tuples, each followed
+    by its reverse, along with the (N x dim) array of their displacements. For rotations, there is one image (and its
+    reverse) for every group operation in container.Glist, in that order. Otherwise, repeated images are left out.
+    """
+    IS, FS = np.asarray(IS, dtype=int), np.asarray(FS, dtype=int)
+    # The images of the initial and final states (and the flips of their dumbbells) under every group operation
+    rows, colmap = np.unique(np.concatenate((IS, FS)), return_inverse=True)
+    imageinds, flips = imageindices(_tablerows(table, rows), container, container.Glist, table)
+    if np.any(imageinds < 0):
+        raise ValueError("symmetrically obtained complex state not found in stateset(?)")
+    imageIS, imageFS = imageinds[:, colmap[:len(IS)]], imageinds[:, colmap[len(IS):]]
+    c1IS, c2FS = c1 * flips[:, colmap[:len(IS)]], c2 * flips[:, colmap[len(IS):]]
+    rotation = np.all(np.abs(disp_array(container, table.iorind[IS], table.R[IS], table.iorind[FS], table.R[FS]))
+                      <= container.crys.threshold, axis=1)
+    chunkset = set()
+    orbits = []
+    for n, IS_, FS_, c1_, c2_, isrot in zip(itertools.count(), IS.tolist(), FS.tolist(), c1.tolist(), c2.tolist(),
+                                            rotation.tolist()):
+        if (IS_, FS_, c1_, c2_) in chunkset:
+            orbits.append(None)
+            continue
+        found = set()
+        newlist = []
+        for IS_new, FS_new, c1_new, c2_new in zip(imageIS[:, n].tolist(), imageFS[:, n].tolist(),
+                                                  c1IS[:, n].tolist(), c2FS[:, n].tolist()):
+            if isrot or not (IS_new, FS_new, c1_new, c2_new) in found:
+                newlist.append((IS_new, FS_new, c1_new, c2_new))
+                newlist.append((FS_new, IS_new, c2_new, c1_new))
+                # we can add the negative since solute always remains at the origin
+                found.add((IS_new, FS_new, c1_new, c2_new))
+                found.add((FS_new, IS_new, c2_new, c1_new))
+        if not isrot:
+            chunkset.update(found)
+        orbits.append(newlist)
+    # The displacements of all the images at once
+    images = [jmp for newlist in orbits if newlist is not None for jmp in newlist]
+    inits, fins = [jmp[0] for jmp in images], [jmp[1] for jmp in images]
+    dx = disp_array(container, table.iorind[inits], table.R[inits], table.iorind[fins], table.R[fins]).reshape(
+        (len(images), table.dim))
+    ends = np.cumsum([0 if newlist is None else len(newlist) for newlist in orbits])
+    return [None if newlist is None else (newlist, dx[end - len(newlist):end]) for newlist, end in zip(orbits, ends)]
+
+
+class TableIndexdict(Mapping):
+    """
+    Read-only dictionary view that stands in for complexIndexdict when the complex states are kept out of core -
+    gives (index of the state in the table, index of its star) for a state, from the table and an array of the star
+    of each row.
+    """
+
+    def __init__(self, table, starinds):
+        self.table = table
+        self.starinds = starinds
+
+    def __getitem__(self, state):
+        try:
+            ind = self.table.index(state)
+        except ValueError:
+            raise KeyError(state)
+        return ind, int(self.starinds[ind])
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
+
 class StarSet(object):
     """
     class to form the crystal stars, with shells indicated by the number of jumps.
@@ -14,7 +183,8 @@ class StarSet(object):
     The minimum shell (Nshells=0) is composed of dumbbells situated atleast one jump away.
     """
 
-    def __init__(self, pdbcontainer, mdbcontainer, jnetwrk0, jnetwrk2, Nshells=None):
+    def __init__(self, pdbcontainer, mdbcontainer, jnetwrk0, jnetwrk2, Nshells=None, rcut=None, statedir=None,
+                 n_workers=None):
         """
         Parameters:
         pdbcontainer,mdbcontainer:
@@ -22,17 +192,32 @@ class StarSet(object):
         jnet0,jnet2 - jumpnetworks in pure and mixed dumbbell spaces respectively.
             Note - must send in both as pair states and indexed.
         Nshells - number of thermodynamic shells. Minimum - one jump away - corresponds to Nshells=0
+        rcut - maximum solute-dumbbell separation of the complex states (see generate). If given without Nshells, the
+        shells are built till the sphere is exhausted.
+        statedir - if given, the complex states are kept out of core, in memory-mapped files in this directory (see
+        StateTable.fromarrays). The stars are then StateRows views of the table, complexIndexdict is a TableIndexdict
+        and stateset is the table itself, so that no SdPair objects are kept for all the states.
+        The symmetric images of the states are tabulated _groupchunk states at a time when grouping them into stars,
+        and only for the initial and final states of _groupchunk omega1 jumps at a time, or of the distance-screened
+        omega4 jumps, in jumpnetwork_omega1 and jumpnetwork_omega34. Still kept in memory are the position arrays of
+        the shells while they are being grown (see _growshells).
+        n_workers - number of worker processes to group the states into stars and to find the omega1 jump orbits
+        with - serially if None (default) or 1. The chunks of states and jumps (see _groupchunk) are handed out to a
+        pool of processes that is started for each grouping of the states and each jumpnetwork_omega1 call, and shut
+        down at the end of it - the starset keeps no handle to it, and can be copied and pickled as before.
+        The chunks are put back together in order, so the stars and jumps are exactly those found serially.
 
         Index objects contained in the starset
         All the indexing are done into the following four lists
         ->pdbcontainer.iorlist, mdbcontainer.iorlist - the list of (site, orientation) tuples allowed for pure and mixed dumbbells respectively.
-        ->complexStates,mixedstates - the list SdPair objects, containing the complex and mixed dumbbells that make up the starset
+        ->complexStates,mixedstates - StateTables of the SdPair objects, containing the complex and mixed dumbbells that make up the starset
 
         --starindexed -> gives the indices to the states list of the states stored in the starset
         --complexIndex, mixedindex -> tells us which star (via it's index in the pure(or mixed)states list) a state belongs to.
         --complexIndexdict, mixedindexdict -> tell us given a pair state, what is its index in the states list and the starset, as elements of a 2-tuple.
         --complexStatesToContainer, mixedStatesToContainer -> tell us the index of the (i,o) of a dumbbell in a SdPair in pure/mixedstates in the
         respective iorlists.
+        --complexDx2 -> squared solute-dumbbell separations of the states in complexStates, in the same order.
 
         """
         # check that we have the same crystal structures for pdbcontainer and mdbcontainer
@@ -56,6 +241,8 @@ class StarSet(object):
         self.chem = pdbcontainer.chem
         self.pdbcontainer = pdbcontainer
         self.mdbcontainer = mdbcontainer
+        self.statedir = statedir
+        self.n_workers = n_workers
 
         self.jnet0 = jnetwrk0[0]
         self.jnet0_ind = jnetwrk0[1]
@@ -75,8 +262,21 @@ class StarSet(object):
                     raise TypeError("The jumpnetwork for bare dumbbells cannot have Sdpairs")
                 self.jumpindices[-1].append(count)
                 count += 1
-        if not Nshells == None:
-            self.generate(Nshells)
+
+        # The pure and mixed dumbbell group operations corresponding to each crystal group operation
+        Gpure = {g: gdumb for gdumb, g in self.pdbcontainer.G_crys.items()}
+        Gmixed = {g: gdumb for gdumb, g in self.mdbcontainer.G_crys.items()}
+        self.gdumbpairs = []
+        for g in self.crys.G:
+            gdumb_pure, gdumb_mixed = Gpure[g], Gmixed[g]
+            # Assert consistency
+            if not (np.allclose(gdumb_pure.cartrot, gdumb_mixed.cartrot) and
+                    np.allclose(gdumb_pure.trans, gdumb_mixed.trans)):
+                raise TypeError("Inconsistent group operations")
+            self.gdumbpairs.append((gdumb_pure, gdumb_mixed))
+
+        if not Nshells == None or rcut is not None:
+            self.generate(Nshells, rcut)
 
     def _sortkey(self, entry):
         # Single underscore function means that if we import this class separately in another module, through
@@ -88,6 +288,25 @@ class StarSet(object):
                                      self.crys.basis[self.chem][self.pdbcontainer.iorlist[entry.db.iorind][0]])
         return np.dot(db_pos - sol_pos, db_pos - sol_pos)
 
+    def _separations(self, i_s, R_s, iorind, R):
+        """
+        Vectorized version of _sortkey - the squared solute-dumbbell separations of the states given as arrays of
+        their solute and dumbbell locations.
+        """
+        basis = np.array(self.crys.basis[self.chem]).reshape((-1, self.crys.dim))
+        dx = np.dot(R - R_s + basis[self.pdbcontainer.iorsites[iorind]] - basis[i_s], self.crys.lattice.T)
+        return np.einsum('ij,ij->i', dx, dx)
+
+    def _sortorder(self, dx2):
+        """
+        The order that sorts the squared separations dx2 - separations that agree to within the crystal threshold
+        count as equal, and keep their original order, so that the order is not set by round-off.
+        """
+        order = np.argsort(dx2, kind='stable')
+        rank = np.zeros(len(dx2), dtype=int)
+        rank[order] = np.concatenate(([0], np.cumsum(np.diff(dx2[order]) > self.crys.threshold)))
+        return np.lexsort((np.arange(len(dx2)), rank))
+
     def genIndextoContainer(self, complexStates, mixedstates):
         pureDict = {}
         mixedDict = {}
@@ -100,109 +319,333 @@ class StarSet(object):
             mixedDict[st] = self.mdbcontainer.iorindex[db]
         return pureDict, mixedDict
 
-    def generate(self, Nshells):
-        # Return nothing if Nshells are not specified
-        if Nshells is None:
+    def generate(self, Nshells, rcut=None):
+        """
+        Builds the complex states and groups them into stars.
+        :param Nshells: the number of shells of omega0 jumps to build the states with.
+        :param rcut: if given, only states with the solute and dumbbell within a distance rcut of each other are
+        kept, and only these are moved further to build the next shell. If Nshells is None, the shells are built till
+        no new states are found within rcut.
+        The sphere is closed under symmetry, and so is the set of states built within it.
+        """
+        # Return nothing if neither Nshells nor rcut are specified
+        if Nshells is None and rcut is None:
             return
-        self.Nshells = Nshells
-        z = np.zeros(self.crys.dim, dtype=int)
-        if Nshells < 1:
+        self.rcut = rcut
+        rcut2 = None if rcut is None else rcut ** 2 + self.crys.threshold
+        if Nshells is not None and Nshells < 1:
             Nshells = 0
-        stateset = set([])
         start = time.time()
-        if Nshells >= 1:
+        iorsites = self.pdbcontainer.iorsites
+        siteorder, siteptr, jiorind1, jiorind2, jR1, jR2 = self._shelltables()[:6]
+
+        i_s = np.zeros(0, dtype=int)
+        R_s = np.zeros((0, self.crys.dim), dtype=int)
+        iorind = np.zeros(0, dtype=int)
+        R = np.zeros((0, self.crys.dim), dtype=int)
+        if Nshells is None or Nshells >= 1:
             # build the starting shell
             # Build the first shell from the jump network
             # One by one, keeping the solute at the origin unit cell, put all possible dumbbell
             # states at one jump distance away.
             # We won't put in origin states just yet.
-            for j in self.jumplist:
-                dx = disp(self.pdbcontainer, j.state1, j.state2)
-                if np.allclose(dx, np.zeros(self.crys.dim, dtype=int), atol=self.pdbcontainer.crys.threshold):
-                    continue
-                # Now go through the all the dumbbell states in the (i,or) list:
-                for idx, (i, o) in enumerate(self.pdbcontainer.iorlist):
-                    if i != self.pdbcontainer.iorlist[j.state2.iorind][0]:
-                        continue
-                    dbstate = dumbbell(idx, j.state2.R)
-                    pair = SdPair(self.pdbcontainer.iorlist[j.state1.iorind][0], j.state1.R, dbstate)
-                    stateset.add(pair)
+            moved = np.array([not np.allclose(disp(self.pdbcontainer, j.state1, j.state2), 0,
+                                              atol=self.pdbcontainer.crys.threshold) for j in self.jumplist],
+                             dtype=bool)
+            jinds, orinds = self._expand(siteptr, iorsites[jiorind2[moved]])
+            i_s = iorsites[jiorind1[moved]][jinds]
+            R_s = jR1[moved][jinds]
+            iorind = siteorder[orinds]
+            R = jR2[moved][jinds]
+            if rcut2 is not None:
+                inside = self._separations(i_s, R_s, iorind, R) <= rcut2
+                i_s, R_s, iorind, R = i_s[inside], R_s[inside], iorind[inside], R[inside]
 
             # Now, we add in the origin states
-            for ind, tup in enumerate(self.pdbcontainer.iorlist):
-                pair = SdPair(tup[0], np.zeros(self.crys.dim, dtype=int), dumbbell(ind, np.zeros(self.crys.dim, dtype=int)))
-                stateset.add(pair)
+            Nior = len(self.pdbcontainer.iorlist)
+            i_s = np.concatenate((i_s, iorsites))
+            R_s = np.concatenate((R_s, np.zeros((Nior, self.crys.dim), dtype=int)))
+            iorind = np.concatenate((iorind, np.arange(Nior)))
+            R = np.concatenate((R, np.zeros((Nior, self.crys.dim), dtype=int)))
+            uniqueinds = np.unique(packpair_array(i_s, R_s, iorind, R), return_index=True)[1]
+            i_s, R_s, iorind, R = i_s[uniqueinds], R_s[uniqueinds], iorind[uniqueinds], R[uniqueinds]
         print("built shell {}: time - {}".format(1, time.time() - start))
-        lastshell = stateset.copy()
-        # Now build the next shells:
-        for step in range(Nshells - 1):
-            start = time.time()
-            nextshell = set([])
-            for j in self.jumplist:
-                for pair in lastshell:
-                    if not np.allclose(pair.R_s, 0, atol=self.crys.threshold):
-                        raise ValueError("The solute is not at the origin in a complex state")
-                    try:
-                        pairnew = pair.addjump(j)
-                    except ArithmeticError:
-                        # If there is somehow a type error, we will get the message.
-                        continue
-                    if not (pair.i_s == pairnew.i_s and np.allclose(pairnew.R_s, pair.R_s, atol=self.crys.threshold)):
-                        raise ArithmeticError("Solute shifted by a complex jump!(?)")
-                    # Now, when we find a new dumbbell location, we have to consider all possible orientations in that location.
-                    # Let's get the dumbbell location
-                    site_db, Rdb = self.pdbcontainer.iorlist[pairnew.db.iorind][0], pairnew.db.R.copy()
-                    for idx, (site_db2, o) in enumerate(self.pdbcontainer.iorlist):
-                        if site_db2 == site_db:  # make sure we are making dumbbells at the correct site
-                            dbstateNew = dumbbell(idx, Rdb)
-                            pairnew = SdPair(pair.i_s, pair.R_s, dbstateNew)
-                            nextshell.add(pairnew)
-                            stateset.add(pairnew)
-
-            lastshell = nextshell.copy()
-            print("built shell {}: time - {}".format(step+2, time.time()-start))
-
-        self.stateset = stateset
+        (i_s, R_s, iorind, R), frontier = self._growshells((i_s, R_s, iorind, R), np.arange(len(iorind)),
+                                                           None if Nshells is None else Nshells - 1, 2, rcut2)
+        self.Nshells = Nshells if Nshells is not None else self._lastshell
+
+        # sort the states by solute-dumbbell separation, keeping the separations to sort the stars with later on.
+        dx2 = self._separations(i_s, R_s, iorind, R)
+        order = self._sortorder(dx2)
+        self.complexStates = StateTable.fromarrays(i_s[order], R_s[order], iorind[order], R[order],
+                                                   directory=self.statedir)
+        self.complexDx2 = dx2[order]
+        # For out of core states, the table itself is used to check if a state is present
+        self.stateset = set(self.complexStates) if self.statedir is None else self.complexStates
+        # Keep the keys of the states found in the last shell, to grow the starset further with extend. With a
+        # cutoff, states anywhere in the sphere may have neighbors that were left out, so all of them must be moved.
+        self._frontierkeys = packpair_array(i_s[frontier], R_s[frontier], iorind[frontier], R[frontier]) \
+            if rcut is None else None
+        self.bareStates = [dumbbell(idx, np.zeros(self.crys.dim, dtype=int))
+                           for idx in range(len(self.pdbcontainer.iorlist))]
         # group the states by symmetry - form the stars
-        self.complexStates = sorted(list(self.stateset), key=self._sortkey)
-        self.bareStates = [dumbbell(idx, z) for idx in range(len(self.pdbcontainer.iorlist))]
-        stars = []
-        self.complexIndexdict = {}
-        starindexed=[]
-        allset = set([])
+        self.stars = []
+        self.starindexed = []
+        self._groupstates(np.arange(len(self.complexStates)))
+        self._indexstars()
+        self._genmixedstars()
+
+    def extend(self, k, reorder=False):
+        """
+        Adds k more shells of states on top of an already generated starset, growing the shells from the states found
+        in the last shell only.
+        The new complex states and stars are appended after the ones already present, which keep their indices - only
+        the mixed stars are moved, to after the new complex stars. The new states and stars are sorted among
+        themselves. With reorder=True, all the states and stars are sorted again instead, so that they are in the same
+        order as in a starset generated with all the shells at once - the states and stars already present can then
+        move.
+        Nothing already present is changed in place, so a copy of a starset can be extended without affecting the
+        original.
+        If the starset was generated with a cutoff distance, the new shells are built from all the states in it and
+        are not restricted by the cutoff.
+        :return: statemap, starmap - the new indices of the complex states, and of the stars (complex and mixed) that
+        were present before. Both are None if the starset had to be generated from scratch.
+        """
+        if getattr(self, "Nshells", None) is None or self.Nshells < 1:
+            self.generate(k)
+            return None, None
+        Nold, Nstarsold = len(self.complexStates), len(self.stars)
+        if k < 1:
+            return np.arange(Nold), np.arange(Nstarsold)
+        self.Nshells += k
+        table = self.complexStates
+        frontier = np.arange(len(table)) if self._frontierkeys is None else table.getindices(self._frontierkeys)
+        (i_s, R_s, iorind, R), frontier = self._growshells((table.i_s, table.R_s, table.iorind, table.R),
+                                                           frontier, k, self.Nshells - k + 1)
+        self._frontierkeys = packpair_array(i_s[frontier], R_s[frontier], iorind[frontier], R[frontier])
+        newdx2 = self._separations(i_s[Nold:], R_s[Nold:], iorind[Nold:], R[Nold:])
+        dx2 = np.concatenate((self.complexDx2, newdx2))
+        if reorder:
+            # The states already present are sorted, and come before the new ones, so that states at the same
+            # separation keep the order in which they were found - as in generate.
+            order = self._sortorder(dx2)
+        else:
+            order = np.concatenate((np.arange(Nold), self._sortorder(newdx2) + Nold))
+        newinds = np.zeros(len(order), dtype=int)
+        newinds[order] = np.arange(len(order))
+        self.complexStates = StateTable.fromarrays(i_s[order], R_s[order], iorind[order], R[order],
+                                                   directory=self.statedir)
+        self.complexDx2 = dx2[order]
+        self.stateset = set(self.complexStates) if self.statedir is None else self.complexStates
+
+        # The stars already present hold the same states - only the new states need to be grouped into stars.
+        Nstarsold_complex = self.mixedstartindex
+        if not reorder:
+            # Out of core stars are views of the old table - they are made again on the new one, with the same rows.
+            self.stars = self.stars[:Nstarsold_complex] if self.statedir is None else \
+                [self._starstates(indlist) for indlist in self.starindexed[:Nstarsold_complex]]
+            self.starindexed = self.starindexed[:Nstarsold_complex]
+            self._groupstates(np.arange(Nold, len(order)))
+            self._indexstars(Nstarsold_complex)
+            self._genmixedstars()
+            starmap = np.concatenate((np.arange(Nstarsold_complex),
+                                      np.arange(Nstarsold - Nstarsold_complex) + self.mixedstartindex)).astype(int)
+            return np.arange(Nold), starmap
+
+        # All the stars are put in the order of their first states in complexStates, as generate would make them.
+        self.starindexed = [newinds[indlist].tolist() for indlist in self.starindexed[:Nstarsold_complex]]
+        oldreps = [indlist[0] for indlist in self.starindexed]
+        self.stars = [self._starstates(indlist) for indlist in self.starindexed]
+        self._groupstates(np.sort(newinds[Nold:]))
+        starorder = np.argsort([min(indlist) for indlist in self.starindexed], kind="stable")
+        self.stars = [self.stars[ind] for ind in starorder]
+        self.starindexed = [self.starindexed[ind] for ind in starorder]
+        self.sortstars()
+        self._indexstars()
+        self._genmixedstars()
+        # The old stars are found again from their representative states, and the mixed stars are moved up.
+        repstars = {indlist[0]: starind for starind, indlist in enumerate(self.starindexed[:self.mixedstartindex])}
+        starmap = np.concatenate(([repstars[rep] for rep in oldreps],
+                                  np.arange(Nstarsold - Nstarsold_complex) + self.mixedstartindex)).astype(int)
+        return newinds[:Nold], starmap
+
+    def copy(self):
+        """
+        Returns a copy of the starset that can be extended independently of this one. The states and stars already
+        present are shared between the two, since extend never changes them in place.
+        """
+        return copy.copy(self)
+
+    @staticmethod
+    def _expand(ptr, rows):
+        "For CSR pointers ptr, gives the row each entry of the given rows belongs to along with the entry's index"
+        counts = ptr[rows + 1] - ptr[rows]
+        rowinds = np.repeat(np.arange(len(rows)), counts)
+        entries = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + ptr[rows][rowinds]
+        return rowinds, entries
+
+    def _shelltables(self):
+        """
+        Returns the tables used to build the shells of complex states:
+        siteorder, siteptr - the (i, or) indices at each site, in CSR form - to put dumbbells in every orientation at a
+        given site.
+        jiorind1, jiorind2, jR1, jR2 - the initial and final (i, or) indices and lattice vectors of the jumps
+        jorder, jptr - the jumps grouped by their initial (i, or) index, also in CSR form.
+        """
+        iorsites = self.pdbcontainer.iorsites
+        siteorder = np.argsort(iorsites, kind="stable")
+        siteptr = np.searchsorted(iorsites[siteorder], np.arange(len(self.crys.basis[self.chem]) + 1))
+        jiorind1 = np.array([j.state1.iorind for j in self.jumplist], dtype=int)
+        jiorind2 = np.array([j.state2.iorind for j in self.jumplist], dtype=int)
+        jR1 = np.array([j.state1.R for j in self.jumplist], dtype=int).reshape((len(self.jumplist), self.crys.dim))
+        jR2 = np.array([j.state2.R for j in self.jumplist], dtype=int).reshape((len(self.jumplist), self.crys.dim))
+        jorder = np.argsort(jiorind1, kind="stable")
+        jptr = np.searchsorted(jiorind1[jorder], np.arange(len(self.pdbcontainer.iorlist) + 1))
+        return siteorder, siteptr, jiorind1, jiorind2, jR1, jR2, jorder, jptr
+
+    def _growshells(self, states, frontier, Nnew, firstshell, rcut2=None):
+        """
+        Builds Nnew more shells of complex states, only moving the states that were found in the last shell for the
+        first time.
+        :param states: the (i_s, R_s, iorind, R) arrays of the states found so far
+        :param frontier: indices into the arrays of the states found in the last shell
+        :param Nnew: the number of shells to build - if None, shells are built till no new states are found.
+        :param firstshell: the number of the first shell to be built - for printing the progress
+        :param rcut2: if given, the new states with squared solute-dumbbell separations larger than this are left out.
+        :return: the arrays with the new states appended, and the indices of the states in the new last shell
+        The number of the last shell that was built is stored in self._lastshell.
+        """
+        if Nnew is None and rcut2 is None:
+            raise ValueError("Shells can be built till no new states are found only within a cutoff distance")
+        iorsites = self.pdbcontainer.iorsites
+        siteorder, siteptr, jiorind1, jiorind2, jR1, jR2, jorder, jptr = self._shelltables()
+        i_s, R_s, iorind, R = states
+        allkeys = np.sort(packpair_array(i_s, R_s, iorind, R))
+        self._lastshell = firstshell - 1
+        for shell in itertools.count(firstshell):
+            if (Nnew is not None and shell >= firstshell + Nnew) or (Nnew is None and len(frontier) == 0):
+                break
+            start = time.time()
+            if not np.allclose(R_s[frontier], 0, atol=self.crys.threshold):
+                raise ValueError("The solute is not at the origin in a complex state")
+            # Apply every jump starting from the dumbbell's (i, or) to each state in the frontier
+            stateinds, jinds = self._expand(jptr, iorind[frontier])
+            stateinds, jinds = frontier[stateinds], jorder[jinds]
+            Rnew = R[stateinds] + jR2[jinds] - jR1[jinds]
+            # Now, when we find a new dumbbell location, we have to consider all possible orientations in that location.
+            newinds, orinds = self._expand(siteptr, iorsites[jiorind2[jinds]])
+            i_s_new, R_s_new = i_s[stateinds][newinds], R_s[stateinds][newinds]
+            iorind_new, R_new = siteorder[orinds], Rnew[newinds]
+            if rcut2 is not None:
+                inside = self._separations(i_s_new, R_s_new, iorind_new, R_new) <= rcut2
+                i_s_new, R_s_new, iorind_new, R_new = i_s_new[inside], R_s_new[inside], iorind_new[inside], \
+                                                      R_new[inside]
+            newkeys, uniqueinds = np.unique(packpair_array(i_s_new, R_s_new, iorind_new, R_new), return_index=True)
+            isnew = ~np.isin(newkeys, allkeys)
+            uniqueinds = uniqueinds[isnew]
+            frontier = np.arange(len(iorind), len(iorind) + len(uniqueinds))
+            allkeys = np.concatenate((allkeys, newkeys[isnew]))
+            i_s = np.concatenate((i_s, i_s_new[uniqueinds]))
+            R_s = np.concatenate((R_s, R_s_new[uniqueinds]))
+            iorind = np.concatenate((iorind, iorind_new[uniqueinds]))
+            R = np.concatenate((R, R_new[uniqueinds]))
+            if len(frontier) > 0:
+                self._lastshell = shell
+            print("built shell {}: time - {}".format(shell, time.time() - start))
+        return (i_s, R_s, iorind, R), frontier
+
+    def _chunksize(self, N):
+        """
+        The number of states or jumps (out of N) to tabulate the images of at once - made smaller than _groupchunk
+        with worker processes, so that every worker gets a chunk.
+        """
+        if self.n_workers is None or self.n_workers < 2:
+            return _groupchunk
+        return max(1, min(_groupchunk, -(-N // self.n_workers)))
+
+    def _mapchunks(self, func, tasks):
+        """
+        Yields (tag, func(complexStates, pdbcontainer, *args)) for each (tag, args) in tasks, in order.
+        With n_workers > 1, func is called by a pool of worker processes instead, a few chunks ahead of the one being
+        yielded. The pool is shut down once all the chunks are done. The workers are handed the complex states when
+        they start - forked workers share them with this process, and out of core states are read from their files.
+        """
+        if self.n_workers is None or self.n_workers < 2:
+            for tag, args in tasks:
+                yield tag, func(self.complexStates, self.pdbcontainer, *args)
+            return
+        table = self.complexStates
+        with ProcessPoolExecutor(max_workers=self.n_workers, initializer=_initworker,
+                                 initargs=(self.pdbcontainer, table if table.path is None else table.path)) as pool:
+            pending = deque()
+            for tag, args in tasks:
+                pending.append((tag, pool.submit(_workercall, func, args)))
+                if len(pending) > 2 * self.n_workers:
+                    tag, future = pending.popleft()
+                    yield tag, future.result()
+            while len(pending) > 0:
+                tag, future = pending.popleft()
+                yield tag, future.result()
+
+    def _starstates(self, indlist):
+        "The states of a star, given their rows in complexStates"
+        # With out of core states, the stars only keep the rows of their states in the table.
+        if self.statedir is None:
+            return [self.complexStates[ind] for ind in indlist]
+        return StateRows(self.complexStates, indlist)
+
+    def _groupstates(self, rows):
+        """
+        Groups the complex states at the given (increasing) rows of complexStates into stars, and appends the stars
+        to the complex stars already present (in the order of their first states).
+        The states must not be symmetry related to any states outside rows.
+        """
         start = time.time()
-        for state in self.stateset:
-            if state in allset:  # see if already considered before.
-                continue
-            newstar = []
-            newstar_index = []
-            for gdumb in self.pdbcontainer.G:
-                newstate = state.gop(self.pdbcontainer, gdumb)[0]
-                newstate = newstate - newstate.R_s  # Shift the solute back to the origin unit cell.
-                if newstate in self.stateset:  # Check if this state is allowed to be present.
-                    if not newstate in allset:  # Check if this state has already been considered.
-                        try:
-                            newstateind = self.complexStates.index(newstate)
-                        except:
-                            raise KeyError("Something wrong in finding index for newstate")
-                        newstar.append(newstate)
-                        newstar_index.append(newstateind)
-                        allset.add(newstate)
-            if len(newstar) == 0:
-                raise ValueError("A star must have at least one state.")
-            if not len(newstar) == len(newstar_index):
-                raise ValueError("star and index star have different lengths")
-            stars.append(newstar)
-            starindexed.append(newstar_index)
+        rows = np.asarray(rows, dtype=int)
+        # The images of the states are tabulated a chunk of states at a time, so that only a (|G| x chunk) table of
+        # them is kept in memory at once.
+        chunk = self._chunksize(len(rows))
+        tasks = ((None, (rows[k:k + chunk],)) for k in range(0, len(rows), chunk))
+        starindexed = []
+        for tag, indlists in self._mapchunks(starchunk, tasks):
+            starindexed += indlists
+        # Every state must be in exactly one star - a state whose star has states outside rows either ends up in no
+        # star, or brings them in.
+        if not np.array_equal(np.sort(np.concatenate([np.zeros(0, dtype=int)] + starindexed)), rows):
+            raise ValueError("New states are symmetry related to states already in the starset")
+        stars = [self._starstates(indlist) for indlist in starindexed]
         print("grouped states by symmetry: {}".format(time.time() - start))
-        self.stars = stars
-        self.starindexed = starindexed
-        self.sortstars()
+        self.stars = self.stars + stars
+        self.starindexed = self.starindexed + starindexed
+        self.sortstars(len(self.stars) - len(stars))
 
-        for starind, star in enumerate(self.stars):
-            for state in star:
-                self.complexIndexdict[state] = (self.complexStates.index(state), starind)
+    def _indexstars(self, startind=0):
+        """
+        Builds complexIndexdict for the complex stars. The stars before startind are taken to be indexed already in
+        complexIndexdict, which is then copied with the rest added to it.
+        """
+        table = self.complexStates
+        if self.statedir is not None:
+            starinds = np.zeros(len(table), dtype=int)
+            if startind > 0:
+                oldinds = self.complexIndexdict.starinds
+                starinds[:len(oldinds)] = oldinds
+            for starind, indlist in enumerate(self.starindexed[startind:], startind):
+                starinds[indlist] = starind
+            self.complexIndexdict = TableIndexdict(table, starinds)
+            return
+        self.complexIndexdict = {} if startind == 0 else dict(self.complexIndexdict)
+        for starind, star, indlist in zip(itertools.count(startind), self.stars[startind:],
+                                          self.starindexed[startind:]):
+            for state, stateind in zip(star, indlist):
+                self.complexIndexdict[state] = (stateind, starind)
 
+    def _genmixedstars(self):
+        """
+        Puts the mixed dumbbell stars after the complex stars, and builds the indexing for them, along with the
+        omega2 jtags and the bare dumbbell stars.
+        """
+        z = np.zeros(self.crys.dim, dtype=int)
         # Keep the indices of the origin states. May be necessary when dealing with their rates and probabilities
         # self.originstates = []
         # for starind, star in enumerate(self.stars):
@@ -212,13 +655,14 @@ class StarSet(object):
         start = time.time()
         self.mixedstartindex = len(self.stars)
         # Now add in the mixed states
-        self.mixedstates = []
+        mixedstates = []
         for idx, tup in enumerate(self.mdbcontainer.iorlist):
             db = dumbbell(idx, z)
             mdb = SdPair(tup[0], z, db)
             if not mdb.is_zero(self.mdbcontainer):
                 raise ValueError("mdb not origin state")
-            self.mixedstates.append(mdb)
+            mixedstates.append(mdb)
+        self.mixedstates = StateTable(mixedstates, dim=self.crys.dim)
 
         for l in self.mdbcontainer.symIndlist:
             # The sites and orientations are already grouped - convert them into SdPairs
@@ -242,28 +686,15 @@ class StarSet(object):
                 initindices[i].append(j)
             j2initlist.append(initindices)
 
-        self.jtags2 = []
-        for initdict in j2initlist:
-            jtagdict = {}
-            for IS, lst in initdict.items():
-                jarr = np.zeros((len(lst), len(self.complexStates) + len(self.mixedstates)), dtype=int)
-                for idx, FS in enumerate(lst):
-                    if IS == FS:
-                        # jarr[idx][IS+len(self.complexStates)]= 1
-                        continue
-                    jarr[idx][IS + len(self.complexStates)] += 1
-                    jarr[idx][FS + len(self.complexStates)] -= 1
-                jtagdict[IS] = jarr.copy()
-            self.jtags2.append(jtagdict)
+        self.jtags2 = [self._jtagmatrix(initdict, len(self.complexStates), len(self.complexStates))
+                       for initdict in j2initlist]
         print("built jtags2: {}".format(time.time() - start))
 
         start = time.time()
         for star in self.stars[self.mixedstartindex:]:
             indlist = []
             for state in star:
-                for j, st in enumerate(self.mixedstates):
-                    if st == state:
-                        indlist.append(j)
+                indlist.append(self.mixedstates.index(state))
             self.starindexed.append(indlist)
         print("built mixed indexed star: {}".format(time.time() - start))
         # self.starindexed = starindexed
@@ -305,20 +736,36 @@ class StarSet(object):
                 self.bareindexdict[state] = (ind, si)
         print("building bare, mixed index dicts : {}".format(time.time() - start))
 
-    def sortstars(self):
+    def _jtagmatrix(self, initdict, initoffset=0, finoffset=0):
+        """
+        Builds the jump tags for a single jump type, as a sparse matrix acting on quantities defined for every state
+        (the complex states followed by the mixed states).
+        :param initdict: the final state indices of the jumps of this type, keyed by the initial state index
+        :param initoffset, finoffset: offsets to add to the initial and final state indices to get their positions
+        among all the states - len(complexStates) for mixed states and 0 for complex states.
+        :return: jtag - CSR matrix such that, for any array x over all the states, (jtag @ x)[IS] is the sum of
+        x[IS] - x[FS] over all the jumps of this type out of the initial state IS.
+        """
+        Nstates = len(self.complexStates) + len(self.mixedstates)
+        IS = np.array([i for i, lst in initdict.items() for f in lst], dtype=int) + initoffset
+        FS = np.array([f for i, lst in initdict.items() for f in lst], dtype=int) + finoffset
+        jtag = csr_matrix((np.concatenate((np.ones(len(IS), dtype=int), -np.ones(len(FS), dtype=int))),
+                           (np.concatenate((IS, IS)), np.concatenate((IS, FS)))), shape=(Nstates, Nstates))
+        # jumps that end in the starting state cancel out
+        jtag.eliminate_zeros()
+        return jtag
+
+    def sortstars(self, startind=0):
         """sorts the solute-dumbbell complex crystal stars in order of increasing solute-dumbbell separation distance.
         Note that this is called before mixed dumbbell stars are added in. The mixed dumbbells being in a periodic state
         space, all the mixed dumbbell states are at the origin anyway.
+        Only the stars from index startind onwards are sorted - the ones before it are kept where they are.
         """
-        inddict = {}
-        for i, star in enumerate(self.stars):
-            inddict[i] = self._sortkey(star[0])
-        # Now sort the stars according to dx^2, i.e, sort the dictionary by value
-        sortlist = sorted(inddict.items(), key=lambda x: x[1])
-        # print(sortlist)
-        starnew = []
-        starIndexnew = []
-        for (ind, dx2) in sortlist:
+        # Sort the stars according to the dx^2 of their representative states
+        dx2 = self.complexDx2[[indlist[0] for indlist in self.starindexed[startind:]]]
+        starnew = self.stars[:startind]
+        starIndexnew = self.starindexed[:startind]
+        for ind in self._sortorder(dx2) + startind:
             starnew.append(self.stars[ind])
             starIndexnew.append(self.starindexed[ind])
 
@@ -331,93 +778,76 @@ class StarSet(object):
         initstates = []  # list of dicitionaries that store numpy arrays of the form +1 for initial state, -1 for final state
         jumptype = []
         starpair = []
-        jumpset = set([])  # set where newly produced jumps will be stored
+        jumpset = set([])  # set where newly produced jumps will be stored, as (initial, final, c1, c2) indices
         print("building omega1")
         start = time.time()
+        states = self.complexStates
+        # The complex states bucketed by the (i, or) index of their dumbbells
+        iororder = np.argsort(states.iorind, kind="stable")
+        iorptr = np.searchsorted(states.iorind[iororder], np.arange(len(self.pdbcontainer.iorlist) + 1))
+        # The (initial, final) states of every jump to consider, along with its orientations and jump type
+        ISlist, FSlist, c1list, c2list, jtlist = [], [], [], [], []
         for jt, jlist in enumerate(self.jnet0):
             for jnum, j0 in enumerate(jlist):
                 # these contain dumbell->dumbell jumps
-                for pairind, pair in enumerate(self.complexStates):
-                    try:
-                        pairnew = pair.addjump(j0)
-                    except ArithmeticError:
-                        # If anything other than ArithmeticError occurs, we'll get the message.
-                        continue
-                    if pairnew not in self.stateset:
-                        continue
-                    # convert them to pair jumps
-                    jpair = jump(pair, pairnew, j0.c1, j0.c2)
-                    if not jpair in jumpset:  # see if the jump has not already been considered
-                        newlist = []
-                        indices = []
-                        initdict = defaultdict(list)
-                        for gdumb in self.pdbcontainer.G:
-                            # The solute must be at the origin unit cell - shift it
-                            state1new, flip1 = jpair.state1.gop(self.pdbcontainer, gdumb)
-                            state2new, flip2 = jpair.state2.gop(self.pdbcontainer, gdumb)
-                            if not (state1new.i_s == state2new.i_s and np.allclose(state1new.R_s, state2new.R_s)):
-                                raise ValueError("Same gop takes solute to different locations")
-                            state1new -= state1new.R_s
-                            state2new -= state2new.R_s
-                            if (not state1new in self.stateset) or (not state2new in self.stateset):
-                                raise ValueError("symmetrically obtained complex state not found in stateset(?)")
-                            jnew = jump(state1new, state2new, jpair.c1 * flip1, jpair.c2 * flip2)
-
-                            if not jnew in jumpset:
-                                # if not (np.allclose(jnew.state1.R_s, 0., atol=self.crys.threshold) and np.allclose(
-                                #         jnew.state2.R_s, 0., atol=self.crys.threshold)):
-                                #     raise RuntimeError("Solute shifted from origin")
-                                # if not (jnew.state1.i_s == jnew.state1.i_s):
-                                #     raise RuntimeError(
-                                #         "Solute must remain in exactly the same position before and after the jump")
-                                newlist.append(jnew)
-                                newlist.append(-jnew)
-                                # we can add the negative since solute always remains at the origin
-                                jumpset.add(jnew)
-                                jumpset.add(-jnew)
-
-                        # remove redundant rotations.
-                        if np.allclose(disp(self.pdbcontainer, newlist[0].state1, newlist[0].state2), np.zeros(self.crys.dim),
-                                       atol=self.pdbcontainer.crys.threshold)\
-                                and newlist[0].state1.i_s == newlist[0].state2.i_s:
-                            for jind in range(len(newlist)-1, -1, -1):
-                                # start from the last, so we don't skip elements while removing.
-                                j = newlist[jind]
-                                j_equiv = jump(j.state1, j.state2, -j.c1, -j.c2)
-                                if j_equiv in jumpset:
-                                    newlist.remove(j)
-                                    # keep the equivalent, discard the original.
-                                    jumpset.remove(j)
-                                    # Also discard the original from the jumpset, or the equivalent will be
-                                    # removed later.
-                        if len(newlist) == 0:
-                            continue
-                        for jmp in newlist:
-                            if not (jmp.state1 in self.stateset):
-                                raise ValueError("state not found in stateset?\n{}".format(jmp.state1))
-                            if not (jmp.state2 in self.stateset):
-                                raise ValueError("state not found in stateset?\n{}".format(jmp.state2))
-                            initial = self.complexIndexdict[jmp.state1][0]
-                            final = self.complexIndexdict[jmp.state2][0]
-                            indices.append(((initial, final), disp(self.pdbcontainer, jmp.state1, jmp.state2)))
-                            initdict[initial].append(final)
-                        jumpnetwork.append(newlist)
-                        jumpindexed.append(indices)
-                        initstates.append(initdict)
-                        # initdict contains all the initial states as keys, and the values as the lists final states
-                        # from the initial states for the given jump type.
-                        jumptype.append(jt)
+                if not np.allclose(j0.state1.R, 0):
+                    raise ValueError("Initial dumbbell not at origin unit cell")
+                # Apply the jump only to the states with the same initial dumbbell, and find the final states
+                initinds = iororder[iorptr[j0.state1.iorind]:iorptr[j0.state1.iorind + 1]]
+                fininds = states.getindices(packpair_array(states.i_s[initinds], states.R_s[initinds],
+                                                           np.full(len(initinds), j0.state2.iorind),
+                                                           states.R[initinds] + j0.state2.R - j0.state1.R))
+                ISlist.append(initinds[fininds >= 0])
+                FSlist.append(fininds[fininds >= 0])
+                c1list.append(np.full(len(ISlist[-1]), j0.c1, dtype=int))
+                c2list.append(np.full(len(ISlist[-1]), j0.c2, dtype=int))
+                jtlist.append(np.full(len(ISlist[-1]), jt, dtype=int))
+        ISarr, FSarr, c1arr, c2arr, jtarr = [np.concatenate([np.zeros(0, dtype=int)] + l)
+                                             for l in (ISlist, FSlist, c1list, c2list, jtlist)]
+
+        # The images of the initial and final states are tabulated a chunk of jumps at a time.
+        chunk = self._chunksize(len(ISarr))
+        tasks = ((k, (ISarr[k:k + chunk], FSarr[k:k + chunk], c1arr[k:k + chunk], c2arr[k:k + chunk]))
+                 for k in range(0, len(ISarr), chunk))
+        for k, orbits in self._mapchunks(orbitchunk, tasks):
+            for IS, FS, c1, c2, jt, orbit in zip(ISarr[k:k + chunk].tolist(), FSarr[k:k + chunk].tolist(),
+                                                 c1arr[k:k + chunk].tolist(), c2arr[k:k + chunk].tolist(),
+                                                 jtarr[k:k + chunk].tolist(), orbits):
+                # convert them to pair jumps
+                if orbit is None or (IS, FS, c1, c2) in jumpset:  # see if the jump has not already been considered
+                    continue
+                newlist, dxlist = orbit
+                isrot = np.allclose(dxlist[0], np.zeros(self.crys.dim), atol=self.pdbcontainer.crys.threshold)
+                if not isrot:
+                    # The images of other jumps are never removed - none of them can be in jumpset.
+                    jumpset.update(newlist)
+                else:
+                    keep = []
+                    for jind in range(0, len(newlist), 2):
+                        # the images come in pairs of a jump and its reverse
+                        if not newlist[jind] in jumpset:
+                            keep += [jind, jind + 1]
+                            jumpset.add(newlist[jind])
+                            jumpset.add(newlist[jind + 1])
+                    newlist, dxlist = [newlist[jind] for jind in keep], dxlist[keep]
+                    # remove redundant rotations.
+                    keep = _droprotations(newlist, jumpset)
+                    newlist, dxlist = [newlist[jind] for jind in keep], dxlist[keep]
+                if len(newlist) == 0:
+                    continue
+                initdict = defaultdict(list)
+                for (initial, final, c1_new, c2_new) in newlist:
+                    initdict[initial].append(final)
+                jumpnetwork.append([jump(states[initial], states[final], c1_new, c2_new)
+                                    for (initial, final, c1_new, c2_new) in newlist])
+                jumpindexed.append([((initial, final), dx) for (initial, final, c1_new, c2_new), dx in
+                                    zip(newlist, dxlist)])
+                initstates.append(initdict)
+                # initdict contains all the initial states as keys, and the values as the lists final states
+                # from the initial states for the given jump type.
+                jumptype.append(jt)
         print("built omega1 : time - {}".format(time.time()-start))
-        jtags = []
-        for initdict in initstates:
-            arrdict = {}
-            for IS, lst in initdict.items():
-                jtagarr = np.zeros((len(lst), len(self.complexStates) + len(self.mixedstates)), dtype=int)
-                for jnum, FS in enumerate(lst):
-                    jtagarr[jnum][IS] += 1
-                    jtagarr[jnum][FS] -= 1
-                arrdict[IS] = jtagarr.copy()
-            jtags.append(arrdict)
+        jtags = [self._jtagmatrix(initdict) for initdict in initstates]
 
         return (jumpnetwork, jumpindexed, jtags), jumptype
 
@@ -440,122 +870,109 @@ class StarSet(object):
         alljumpset_omega43_all = set([])
         start = time.time()
         print("building omega43")
-        for p_pure in self.complexStates:
-            if p_pure.is_zero(self.pdbcontainer):  # Spectator rotating into mixed dumbbell does not make sense.
-                continue
-            for p_mixed in self.mixedstates:
-                if not p_mixed.is_zero(self.mdbcontainer):  # Specator rotating into mixed does not make sense.
-                    raise ValueError("Mixed dumbbell must be origin state")
-                if not (np.allclose(p_pure.R_s, 0, atol=self.crys.threshold)
-                        and np.allclose(p_mixed.R_s, 0, atol=self.crys.threshold)):
-                    raise RuntimeError("Solute shifted from origin - cannot happen")
-                if not (p_pure.i_s == p_mixed.i_s):
-                    # The solute must remain in exactly the same position before and after the jump
-                    continue
-                for c1 in [-1, 1]:
-                    j = jump(p_pure, p_mixed, c1, -1)
-                    dx = disp4(self.pdbcontainer, self.mdbcontainer, j.state1, j.state2)
-                    if np.dot(dx, dx) > cutoff ** 2:
-                        continue
-                    if not j in alljumpset_omega4:
-                        # check if jump already considered
-                        # if a jump is in alljumpset_omega4, it's negative will have to be in alljumpset_omega3
-                        if not collision_self(self.pdbcontainer, self.mdbcontainer, j, solv_solv_cut,
-                                              solt_solv_cut) and not collision_others(self.pdbcontainer,
-                                                                                      self.mdbcontainer, j,
-                                                                                      closestdistance):
-                            newlist = []
-                            newneglist = []
-                            newalllist = []
-                            for g in self.crys.G:
-                                for pgdumb, gval in self.pdbcontainer.G_crys.items():
-                                    if gval == g:
-                                        gdumb_pure = pgdumb
-
-                                for mgdumb, gval in self.mdbcontainer.G_crys.items():
-                                    if gval == g:
-                                        gdumb_mixed = mgdumb
-
-                                # Assert consistency
-                                if not (np.allclose(gdumb_pure.cartrot, gdumb_mixed.cartrot) and
-                                        np.allclose(gdumb_pure.cartrot, gdumb_mixed.cartrot) and
-                                        np.allclose(gdumb_pure.trans, gdumb_mixed.trans)):
-                                    raise TypeError("Inconsistent group operations")
-
-                                state1new, flip1 = j.state1.gop(self.pdbcontainer, gdumb_pure, complex=True)
-                                state2new = j.state2.gop(self.mdbcontainer, gdumb_mixed, complex=False)
-
-                                if not (np.allclose(state1new.R_s, state2new.R_s)):
-                                    raise ValueError("Same group op but different resultant solute sites")
-                                state1new -= state1new.R_s
-                                state2new -= state2new.R_s
-                                jnew = jump(state1new, state2new, j.c1*flip1, -1)
-                                if not jnew in alljumpset_omega4:
-                                    if jnew.state1.i_s == self.pdbcontainer.iorlist[jnew.state1.db.iorind][0]:
-                                        if np.allclose(jnew.state1.R_s, jnew.state1.db.R, atol=self.crys.threshold):
-                                            raise RuntimeError("Initial state mixed")
-                                    if not (jnew.state2.i_s == self.mdbcontainer.iorlist[jnew.state2.db.iorind][0]
-                                            and np.allclose(jnew.state2.R_s, jnew.state2.db.R, self.crys.threshold)):
-                                        raise RuntimeError("Final state not mixed")
-                                    newlist.append(jnew)
-                                    newneglist.append(-jnew)
-                                    newalllist.append(jnew)
-                                    newalllist.append(-jnew)
-                                    alljumpset_omega4.add(jnew)
-
-                            new4index = []
-                            new3index = []
-                            newallindex = []
-                            jinitdict3 = defaultdict(list)
-                            jinitdict4 = defaultdict(list)
-
-                            for jmp in newlist:
-                                pure_ind = self.complexIndexdict[jmp.state1][0]
-                                mixed_ind = self.mixedindexdict[jmp.state2][0]
-                                # omega4 has pure as initial, omega3 has pure as final
-                                jinitdict4[pure_ind].append(mixed_ind)
-                                jinitdict3[mixed_ind].append(pure_ind)
-                                dx = disp4(self.pdbcontainer, self.mdbcontainer, jmp.state1, jmp.state2)
-                                new4index.append(((pure_ind, mixed_ind), dx.copy()))
-                                new3index.append(((mixed_ind, pure_ind), -dx))
-                                newallindex.append(((pure_ind, mixed_ind), dx.copy()))
-                                newallindex.append(((mixed_ind, pure_ind), -dx))
-
-                            symjumplist_omega4.append(newlist)
-                            omega4inits.append(jinitdict4)
-                            symjumplist_omega4_indexed.append(new4index)
-
-                            symjumplist_omega3.append(newneglist)
-                            omega3inits.append(jinitdict3)
-                            symjumplist_omega3_indexed.append(new3index)
-
-                            symjumplist_omega43_all.append(newalllist)
-                            symjumplist_omega43_all_indexed.append(newallindex)
+        if not (np.all(self.mdbcontainer.iorsites[self.mixedstates.iorind] == self.mixedstates.i_s) and
+                np.all(self.mixedstates.R == self.mixedstates.R_s)):
+            raise RuntimeError("Final state not mixed")
+        if not (np.all(self.complexStates.R_s == 0) and np.all(self.mixedstates.R_s == 0)):
+            raise RuntimeError("Solute shifted from origin - cannot happen")
+
+        # Screen the (complex, mixed) pairs by distance first, one mixed state at a time, so that only the pairs within
+        # the cutoff are ever held in memory. The solute must remain in exactly the same position before and after the
+        # jump, and spectators rotating into mixed dumbbells do not make sense.
+        Ncomp = len(self.complexStates)
+        notzero = np.logical_not(self.complexStates.is_zero(self.pdbcontainer))
+        compinds, mixinds = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+        for mixind in range(len(self.mixedstates)):
+            dx = disp_array(self.pdbcontainer, self.complexStates.iorind, self.complexStates.R,
+                            np.full(Ncomp, self.mixedstates.iorind[mixind]),
+                            np.tile(self.mixedstates.R[mixind], (Ncomp, 1)), self.mdbcontainer)
+            keep = np.nonzero(notzero & (self.complexStates.i_s == self.mixedstates.i_s[mixind]) &
+                              (np.sum(dx * dx, axis=1) <= cutoff ** 2))[0]
+            compinds.append(keep)
+            mixinds.append(np.full(len(keep), mixind, dtype=int))
+        compinds, mixinds = np.concatenate(compinds), np.concatenate(mixinds)
+        order = np.lexsort((mixinds, compinds))
+        compinds, mixinds = compinds[order], mixinds[order]
+
+        def dispfor(pureinds, mixedinds):
+            return disp_array(self.pdbcontainer, self.complexStates.iorind[pureinds], self.complexStates.R[pureinds],
+                              self.mixedstates.iorind[mixedinds], self.mixedstates.R[mixedinds], self.mdbcontainer)
+
+        # The self-collision checks of the surviving pairs, for both values of c1, at once.
+        selfcollide = collision_self_batch(self.pdbcontainer, self.mdbcontainer,
+                                           np.repeat(self.complexStates.iorind[compinds], 2),
+                                           np.repeat(self.complexStates.R[compinds], 2, axis=0),
+                                           np.repeat(self.mixedstates.iorind[mixinds], 2),
+                                           np.repeat(self.mixedstates.R[mixinds], 2, axis=0),
+                                           np.tile([-1, 1], len(compinds)), -1, solv_solv_cut,
+                                           solt_solv_cut).reshape((len(compinds), 2))
+
+        # Get the indices of the images of the complex and mixed states, along with the flips of the complex state
+        # dumbbells, under each pair of pure and mixed dumbbell group operations. Only the complex states of the
+        # screened pairs are transformed - their images are in the columns given by puremap.
+        purerows, puremap = np.unique(compinds, return_inverse=True)
+        pureimages, pureflips = imageindices(_tablerows(self.complexStates, purerows), self.pdbcontainer,
+                                             [gdumb_pure for gdumb_pure, gdumb_mixed in self.gdumbpairs],
+                                             self.complexStates)
+        mixedimages = imageindices(self.mixedstates, self.mdbcontainer,
+                                         [gdumb_mixed for gdumb_pure, gdumb_mixed in self.gdumbpairs])[0]
+        if np.any(pureimages < 0) or np.any(mixedimages < 0):
+            raise ValueError("symmetrically obtained state not found in the starset(?)")
+
+        for pureind, purecol, mixind, collides in zip(compinds.tolist(), puremap.tolist(), mixinds.tolist(),
+                                                      selfcollide):
+            p_pure, p_mixed = self.complexStates[pureind], self.mixedstates[mixind]
+            for cind, c1 in enumerate([-1, 1]):
+                j = jump(p_pure, p_mixed, c1, -1)
+                if not (pureind, mixind, c1) in alljumpset_omega4:
+                    # check if jump already considered
+                    # if a jump is in alljumpset_omega4, it's negative will have to be in alljumpset_omega3
+                    if not collides[cind] and not collision_others(self.pdbcontainer, self.mdbcontainer, j,
+                                                                   closestdistance):
+                        newlist = []
+                        newneglist = []
+                        newalllist = []
+                        new4index = []
+                        new3index = []
+                        newallindex = []
+                        jinitdict3 = defaultdict(list)
+                        jinitdict4 = defaultdict(list)
+                        # The symmetric images of the jump, from the image tables
+                        imagedx = dispfor(pureimages[:, purecol], mixedimages[:, mixind])
+                        for pure_ind, mixed_ind, c1new, dx in zip(pureimages[:, purecol].tolist(),
+                                                                  mixedimages[:, mixind].tolist(),
+                                                                  (c1 * pureflips[:, purecol]).tolist(), imagedx):
+                            if (pure_ind, mixed_ind, c1new) in alljumpset_omega4:
+                                continue
+                            alljumpset_omega4.add((pure_ind, mixed_ind, c1new))
+                            jnew = jump(self.complexStates[pure_ind], self.mixedstates[mixed_ind], c1new, -1)
+                            newlist.append(jnew)
+                            newneglist.append(-jnew)
+                            newalllist.append(jnew)
+                            newalllist.append(-jnew)
+                            # omega4 has pure as initial, omega3 has pure as final
+                            jinitdict4[pure_ind].append(mixed_ind)
+                            jinitdict3[mixed_ind].append(pure_ind)
+                            new4index.append(((pure_ind, mixed_ind), dx.copy()))
+                            new3index.append(((mixed_ind, pure_ind), -dx))
+                            newallindex.append(((pure_ind, mixed_ind), dx.copy()))
+                            newallindex.append(((mixed_ind, pure_ind), -dx))
+
+                        symjumplist_omega4.append(newlist)
+                        omega4inits.append(jinitdict4)
+                        symjumplist_omega4_indexed.append(new4index)
+
+                        symjumplist_omega3.append(newneglist)
+                        omega3inits.append(jinitdict3)
+                        symjumplist_omega3_indexed.append(new3index)
+
+                        symjumplist_omega43_all.append(newalllist)
+                        symjumplist_omega43_all_indexed.append(newallindex)
 
         # Now build the jtags
         print("built omega43 : time {}".format(time.time()-start))
-        jtags4 = []
-        jtags3 = []
-
-        for initdict in omega4inits:
-            jarrdict = {}
-            for IS, lst in initdict.items():
-                jarr = np.zeros((len(lst), len(self.complexStates) + len(self.mixedstates)), dtype=int)
-                for idx, FS in enumerate(lst):
-                    jarr[idx][IS] += 1
-                    jarr[idx][FS + len(self.complexStates)] -= 1
-                jarrdict[IS] = jarr.copy()
-            jtags4.append(jarrdict)
-
-        for initdict in omega3inits:
-            jarrdict = {}
-            for IS, lst in initdict.items():
-                jarr = np.zeros((len(lst), len(self.complexStates) + len(self.mixedstates)), dtype=int)
-                for idx, FS in enumerate(lst):
-                    jarr[idx][IS + len(self.complexStates)] += 1
-                    jarr[idx][FS] -= 1
-                jarrdict[IS] = jarr.copy()
-            jtags3.append(jarrdict)
+        jtags4 = [self._jtagmatrix(initdict, 0, len(self.complexStates)) for initdict in omega4inits]
+        jtags3 = [self._jtagmatrix(initdict, len(self.complexStates), 0) for initdict in omega3inits]
 
         return (symjumplist_omega43_all, symjumplist_omega43_all_indexed), (
             symjumplist_omega4, symjumplist_omega4_indexed, jtags4), (
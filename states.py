@@ -1,4 +1,5 @@
 import numpy as np
+import itertools
 import onsager.crystal as crystal
 from representations import *
 from collision import *
@@ -12,25 +13,65 @@ def disp(dbcontainer, obj1, obj2):
         obj1,obj2 - the initial and final state objects of a jump
         Return - displacement when going from obj1 to obj2
     """
-    crys, chem = dbcontainer.crys, dbcontainer.chem
-
     if isinstance(obj1, dumbbell):
-        (i1, i2) = (dbcontainer.iorlist[obj1.iorind][0], dbcontainer.iorlist[obj2.iorind][0])
+        (ind1, ind2) = (obj1.iorind, obj2.iorind)
         (R1, R2) = (obj1.R, obj2.R)
     else:
-        (i1, i2) = (dbcontainer.iorlist[obj1.db.iorind][0], dbcontainer.iorlist[obj2.db.iorind][0])
+        (ind1, ind2) = (obj1.db.iorind, obj2.db.iorind)
         (R1, R2) = (obj1.db.R, obj2.db.R)
 
-    return crys.unit2cart(R2, crys.basis[chem][i2]) - crys.unit2cart(R1, crys.basis[chem][i1])
+    # The cartesian positions of the (i, or) sites are stored in the container
+    return np.dot(dbcontainer.crys.lattice, R2 - R1) + dbcontainer.iorcart[ind2] - dbcontainer.iorcart[ind1]
 
 
-def disp4(pdbcontainer, mdbcontainer, obj1, obj2):
+def disp_array(dbcontainer, iorind1, R1, iorind2, R2, dbcontainer2=None):
     """
-    Computes the transport vector for the initial and final states of an associative jump
+    Computes the transport vectors for arrays of initial and final dumbbell locations at once
+    param:
+        dbcontainer - dumbbell states container the initial dumbbells are indexed to.
+        iorind1, R1 - (N,) (i, or) indices and (N x dim) lattice vectors of the initial dumbbells
+        iorind2, R2 - (N,) (i, or) indices and (N x dim) lattice vectors of the final dumbbells
+        dbcontainer2 - container the final dumbbells are indexed to, if different (e.g., mixed dumbbells for omega4)
+        Return - (N x dim) array of displacements
+    """
+    if dbcontainer2 is None:
+        dbcontainer2 = dbcontainer
+    elif dbcontainer2.crys is not dbcontainer.crys:
+        checkcrys(dbcontainer, dbcontainer2)
+    dR = np.asarray(R2) - np.asarray(R1)
+    return np.dot(dR, dbcontainer.crys.lattice.T) + dbcontainer2.iorcart[np.asarray(iorind2, dtype=int)] - \
+           dbcontainer.iorcart[np.asarray(iorind1, dtype=int)]
+
+
+def jumpcandidates(dbcontainer, cutoff):
+    """
+    Finds all the dumbbell to dumbbell transitions within a given distance, from dumbbells in the origin unit cell.
+    The candidates over the whole box of lattice vectors and all (i, or) pairs are screened by distance at once.
     param:
         dbcontainer - dumbbell states container.
-        obj1,obj2 - the initial and final state objects of a jump - must be of Omega4 type
-        Return - displacement when going from obj1 to obj2
+        cutoff - maximum jump distance
+    Returns:
+        list of (i, f, R, dx) for each jump within the cutoff - the initial (i, or) index (at the origin), the final
+        (i, or) index and lattice vector, and the displacement. The order is the same as that of looping over the
+        lattice vectors, then the initial and then the final (i, or) indices.
+    """
+    crys = dbcontainer.crys
+    nmax = [int(np.round(np.sqrt(cutoff ** 2 / crys.metric[i, i]))) + 1 for i in range(crys.dim)]
+    Rvects = np.array(list(itertools.product(*[range(-n, n + 1) for n in nmax])), dtype=int)
+
+    Nior = len(dbcontainer.iorlist)
+    Rind, ind1, ind2 = [arr.ravel() for arr in np.meshgrid(np.arange(len(Rvects)), np.arange(Nior), np.arange(Nior),
+                                                           indexing="ij")]
+    dxarr = disp_array(dbcontainer, ind1, np.zeros((len(ind1), crys.dim), dtype=int), ind2, Rvects[Rind])
+    # Leave out the diagonal case (no transition) and the jumps outside the cutoff
+    notdiag = np.logical_or(ind1 != ind2, np.any(Rvects[Rind] != 0, axis=1))
+    keep = np.logical_and(notdiag, np.sum(dxarr * dxarr, axis=1) <= cutoff * cutoff)
+    return [(int(ind1[n]), int(ind2[n]), Rvects[Rind[n]].copy(), dxarr[n]) for n in np.nonzero(keep)[0]]
+
+
+def checkcrys(pdbcontainer, mdbcontainer):
+    """
+    Checks that the pure and mixed dumbbell containers are built on the same crystal structure.
     """
     true_crys = np.allclose(pdbcontainer.crys.lattice, mdbcontainer.crys.lattice, atol=pdbcontainer.crys.threshold)
 
@@ -49,15 +90,172 @@ def disp4(pdbcontainer, mdbcontainer, obj1, obj2):
     if not true_site_locs:
         raise TypeError("basis sites are at different locations for the two containers.")
 
-    crys, chem = pdbcontainer.crys, pdbcontainer.chem
-    (i1, i2) = (pdbcontainer.iorlist[obj1.db.iorind][0], mdbcontainer.iorlist[obj2.db.iorind][0])
+
+def disp4(pdbcontainer, mdbcontainer, obj1, obj2):
+    """
+    Computes the transport vector for the initial and final states of an associative jump
+    param:
+        dbcontainer - dumbbell states container.
+        obj1,obj2 - the initial and final state objects of a jump - must be of Omega4 type
+        Return - displacement when going from obj1 to obj2
+    """
+    # Containers made from the same crystal object need not be checked every time.
+    if pdbcontainer.crys is not mdbcontainer.crys:
+        checkcrys(pdbcontainer, mdbcontainer)
+
     (R1, R2) = (obj1.db.R, obj2.db.R)
 
-    return crys.unit2cart(R2, crys.basis[chem][i2]) - crys.unit2cart(R1, crys.basis[chem][i1])
+    return np.dot(pdbcontainer.crys.lattice, R2 - R1) + mdbcontainer.iorcart[obj2.db.iorind] - \
+           pdbcontainer.iorcart[obj1.db.iorind]
+
+
+def orkey(i, o, tol, signless=False):
+    """
+    Hashable key for a (site, orientation) pair - the orientation is snapped to a grid of spacing tol.
+    param:
+        i, o - site index and orientation vector
+        tol - tolerance to which orientations are considered equal
+        signless - if True, o and -o get the same key (for pure dumbbells)
+    Orientations lying close to a grid boundary may still get different keys for o values within tol of each other,
+    so a failed lookup with these keys must be followed by a direct comparison.
+    """
+    onint = tuple(int(x) for x in np.rint(np.asarray(o) / tol))
+    if signless:
+        for x in onint:
+            if x != 0:
+                if x < 0:
+                    onint = tuple(-y for y in onint)
+                break
+    return i, onint
+
+
+def orkey_array(sites, orientations, tol, signless=False):
+    """
+    Vectorized version of orkey - the keys of N (site, orientation) pairs as a structured (N,) array, with the site
+    and the snapped orientation components as its fields. The keys sort lexicographically, so arrays of them can be
+    searched with np.searchsorted.
+    """
+    sites = np.asarray(sites, dtype=np.int64).ravel()
+    onint = np.rint(np.asarray(orientations, dtype=float).reshape((len(sites), -1)) / tol).astype(np.int64)
+    if signless:
+        # flip the orientations whose first non-zero component is negative
+        first = onint[np.arange(len(sites)), np.argmax(onint != 0, axis=1)] if onint.shape[1] > 0 else sites * 0
+        onint[first < 0] *= -1
+    rows = np.ascontiguousarray(np.column_stack([sites, onint]))
+    return rows.view(np.dtype([("f{}".format(n), np.int64) for n in range(rows.shape[1])])).ravel()
+
+
+def orkeyindex(iorlist, tol, signless=False):
+    """
+    Sorted keys of the (i, or) pairs in an iorlist, and the indices in the iorlist they come from - for looking up
+    arrays of (i, or) pairs with lookuporkeys.
+    """
+    keys = orkey_array([i for i, o in iorlist], np.array([o for i, o in iorlist]), tol, signless)
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order
+
+
+def lookuporkeys(index, sites, orientations, tol, signless=False):
+    """
+    Looks up arrays of (site, orientation) pairs in an index made with orkeyindex (with the same tol and signless).
+    :return: (N,) array of the indices of the pairs in the iorlist - -1 where the key is not found. As with orkey,
+    a pair that is not found must still be compared directly.
+    """
+    sortedkeys, order = index
+    keys = orkey_array(sites, orientations, tol, signless)
+    if len(sortedkeys) == 0:
+        return np.full(len(keys), -1, dtype=int)
+    pos = np.minimum(np.searchsorted(sortedkeys, keys), len(sortedkeys) - 1)
+    return np.where(sortedkeys[pos] == keys, order[pos], -1)
+
+
+class GopTables(object):
+    """
+    Tabulated action of the dumbbell group operations, shared by the pure and mixed dumbbell containers - avoids
+    calling g_pos and gflip every time a group operation is applied to a state. The containers call makegoptables
+    once their iorlist, G and G_crys are made.
+    """
+
+    def makegoptables(self):
+        """
+        Precomputes the action of the dumbbell group operations on the basis sites and (i, or) indices.
+        Sets:
+            iorsites - (Niorlist,) basis site of each (i, or) index
+            iorcart - (Niorlist x dim) cartesian position of the site of each (i, or) index, for displacements
+            Glist - the dumbbell group operations, in the order in which they are iterated over in G
+            Gindexdict - dictionary that gives the location of a group operation object in Glist, keyed by its id
+            gop_rot - (NG x dim x dim) integer rotation of lattice vectors for each group operation
+            gop_trans - (NG x Nsites x dim) lattice translation picked up by each basis site under each group operation
+            gop_sitemap - (NG x Nsites) basis site each basis site is sent to by each group operation
+            gop_iormap - (NG x Niorlist) (i, or) index each (i, or) index is sent to by each group operation
+        """
+        crys, chem, iorlist = self.crys, self.chem, self.iorlist
+        self.iorsites = np.array([i for i, o in iorlist], dtype=int)
+        self.iorcart = np.array([crys.unit2cart(np.zeros(crys.dim, dtype=int), crys.basis[chem][i])
+                                 for i in self.iorsites]).reshape((len(iorlist), crys.dim))
+        Glist = list(self.G)
+        Nsites = len(crys.basis[chem])
+        rot = np.zeros((len(Glist), crys.dim, crys.dim), dtype=int)
+        trans = np.zeros((len(Glist), Nsites, crys.dim), dtype=int)
+        sitemap = np.zeros((len(Glist), Nsites), dtype=int)
+        iormap = np.zeros((len(Glist), len(iorlist)), dtype=int)
+        for gind, gdumb in enumerate(Glist):
+            g = self.G_crys[gdumb]
+            rot[gind] = np.round(g.rot).astype(int)
+            for i in range(Nsites):
+                R, (ch, i_new) = crys.g_pos(g, np.zeros(crys.dim, dtype=int), (chem, i))
+                trans[gind, i] = R
+                sitemap[gind, i] = i_new
+            iormap[gind] = gdumb.indexmap[0]
+            for idx, (i, o) in enumerate(iorlist):
+                if not sitemap[gind, i] == iorlist[iormap[gind, idx]][0]:
+                    raise ValueError("Gdumb and G not consistent")
+        self.Glist, self.Gindexdict = Glist, {id(gdumb): gind for gind, gdumb in enumerate(Glist)}
+        self.gop_rot, self.gop_trans, self.gop_sitemap, self.gop_iormap = rot, trans, sitemap, iormap
+
+    def gopindex(self, gdumb):
+        """
+        Returns the location of the dumbbell group operation gdumb in Glist (the row of the group action tables)
+        """
+        gind = self.Gindexdict.get(id(gdumb))
+        if gind is None or self.Glist[gind] is not gdumb:
+            # Not one of our own group operation objects - look it up by equality
+            gind = self.Glist.index(gdumb)
+        return gind
+
+    def gop_arrays(self, gdumb, iorind, R, i_s=None, R_s=None):
+        """
+        Applies a dumbbell group operation to arrays of dumbbell states, or of solute-dumbbell pair states, at once.
+        param:
+            gdumb - the dumbbell group operation to apply.
+            iorind, R - (N,) (i, or) indices and (N x dim) lattice vectors of the dumbbells.
+            i_s, R_s - (N,) basis sites and (N x dim) lattice vectors of the solutes, if the states are pairs.
+        Returns:
+            iorind_new, R_new - the transformed dumbbells.
+            i_s_new, R_s_new - the transformed solute locations (None if no solutes were given)
+        """
+        gind = self.gopindex(gdumb)
+        rot, trans = self.gop_rot[gind], self.gop_trans[gind]
+        iorind = np.asarray(iorind, dtype=int)
+        R_new = np.dot(np.asarray(R), rot.T) + trans[self.iorsites[iorind]]
+        iorind_new = self.gop_iormap[gind][iorind]
+        if i_s is None:
+            return iorind_new, R_new, None, None
+        i_s = np.asarray(i_s, dtype=int)
+        R_s_new = np.dot(np.asarray(R_s), rot.T) + trans[i_s]
+        return iorind_new, R_new, self.gop_sitemap[gind][i_s], R_s_new
+
+    def gop_batch(self, states, gdumb):
+        """
+        Applies a group operation to all the states in a StateTable at once.
+        Returns the transformed states as a StateTable (the batched counterpart of SdPair.gop with complex=False)
+        """
+        iorind_new, R_new, i_s_new, R_s_new = self.gop_arrays(gdumb, states.iorind, states.R, states.i_s, states.R_s)
+        return StateTable.fromarrays(i_s_new, R_s_new, iorind_new, R_new)
 
 
 # Create pure dumbbell states
-class dbStates(object):
+class dbStates(GopTables):
     """
     Class to generate all possible dumbbell configurations for given basis sites.
     Make a "supercrystal" with the states as the dumbbell configurations, capable of handling symmetry operations.
@@ -72,7 +270,18 @@ class dbStates(object):
         self.family = family
         # make the dumbbell states, change the indexmap of the grouops and store original groupops in G_crys
         self.iorlist = self.genpuresets()
+        # hash index of the (i, or) pairs (orientations up to sign) for getIndex
+        self.iorindexdict = {}
+        for idx, (i, o) in enumerate(self.iorlist):
+            self.iorindexdict.setdefault(orkey(i, o, self.crys.threshold, signless=True), idx)
+        # and the sorted keys for getIndices
+        self.iorkeyindex = orkeyindex(self.iorlist, self.crys.threshold, signless=True)
         self.G, self.G_crys, = self.makeDbGops(self.crys, self.chem, self.iorlist)
+        # Tabulate the action of the group operations on the sites and (i, or) indices, to avoid calling g_pos and
+        # gflip every time a group operation is applied to a state.
+        self.makegoptables()
+        self.gop_flip = np.array([[self.gflip(gdumb, idx) for idx in range(len(self.iorlist))]
+                                  for gdumb in self.Glist], dtype=int)
         self.symorlist, self.symIndlist = self.gensymset() # make this an indexed list
         # Store both iorlist and symorlist so that we can compare them later if needed.
         self.threshold = crys.threshold
@@ -107,6 +316,11 @@ class dbStates(object):
         def negOrInList(o, lis):
             return any(np.allclose(o + tup[1], 0, atol=1e-8) for tup in lis)
 
+        # Keys of the (i, or) pairs (up to sign) and of the orientations already in the list. Finding a key settles
+        # that a pair is present - if it is not found, we still make sure with the direct comparisons.
+        iorkeys = set([])
+        orkeys = set([])
+
         sitelist = self.crys.sitelist(self.chem)
         if not len(self.family) == len(sitelist):
             raise TypeError("Orientations must be given for every Wyckoff set. Enter [0,0,0] for Wyckoff sets that "
@@ -124,15 +338,23 @@ class dbStates(object):
                 for g in self.crys.G:
                     R, (ch, i_new) = self.crys.g_pos(g, np.zeros(self.crys.dim), (self.chem, site))
                     o_new = self.crys.g_direc(g, o)
+                    if orkey(i_new, o_new, 1e-8, signless=True) in iorkeys:
+                        continue
                     if not (inlist((i_new, o_new), iorlist) or inlist((i_new, -o_new), iorlist)):
-                        if negOrInList(o_new, iorlist):
+                        if orkey(0, -o_new, 1e-8) in orkeys or negOrInList(o_new, iorlist):
                             o_new = -o_new + 0.
                         iorlist.append((i_new, o_new))
+                        iorkeys.add(orkey(i_new, o_new, 1e-8, signless=True))
+                        orkeys.add(orkey(0, o_new, 1e-8))
         return iorlist
 
     def makeDbGops(self, crys, chem, iorlist):
         G = []
         G_crys = {}
+        # Look up the rotated (i, or) pairs (up to sign) by their keys first
+        iorkeys = {}
+        for idx, (i, o) in enumerate(iorlist):
+            iorkeys.setdefault(orkey(i, o, crys.threshold, signless=True), idx)
         for g in crys.G:
             # Will have indexmap for each groupop
             indexmap = []
@@ -140,13 +362,16 @@ class dbStates(object):
                 # Need the elements of indexmap
                 R, (ch, i_new) = crys.g_pos(g, np.zeros(self.crys.dim), (chem, i))
                 o_new = crys.g_direc(g, o)
-                count = 0
+                idx2 = iorkeys.get(orkey(i_new, o_new, crys.threshold, signless=True))
+                if idx2 is not None:
+                    indexmap.append(idx2)
+                    continue
                 for idx2, (i2, o2) in enumerate(iorlist):
                     if i2 == i_new and (np.allclose(o2, o_new, atol=crys.threshold) or
                                         np.allclose(o2, -o_new, atol=crys.threshold)):
                         indexmap.append(idx2)
                         break
-                        
+
             gdumb = crystal.GroupOp(g.rot, g.trans, g.cartrot, tuple([tuple(indexmap)]))
             G.append(gdumb)
             G_crys[gdumb] = g
@@ -189,6 +414,15 @@ class dbStates(object):
             return -1
         return 1
 
+    def gop_batch(self, states, gdumb):
+        """
+        Applies a group operation to all the complex states in a StateTable at once.
+        Returns the transformed states as a StateTable, along with the array of flip indicators for the dumbbells
+        (the batched counterpart of SdPair.gop with complex=True)
+        """
+        flip = self.gop_flip[self.gopindex(gdumb)][states.iorind]
+        return super(dbStates, self).gop_batch(states, gdumb), flip
+
     def jumpnetwork(self, cutoff, solv_solv_cut, closestdistance):
         """
         Makes a jumpnetwork of pure dumbbells within a given distance to be used for omega_0
@@ -253,56 +487,39 @@ class dbStates(object):
 
             return jlist, jindlist
 
-        nmax = [int(np.round(np.sqrt(cutoff ** 2 / crys.metric[i, i]))) + 1 for i in range(self.crys.dim)]
-
-        if self.crys.dim == 2:
-            Rvects = [np.array([n0, n1]) for n0 in range(-nmax[0], nmax[0] + 1)
-                      for n1 in range(-nmax[1], nmax[1] + 1)]
-
-        else:
-            Rvects = [np.array([n0, n1, n2]) for n0 in range(-nmax[0], nmax[0] + 1)
-                      for n1 in range(-nmax[1], nmax[1] + 1)
-                      for n2 in range(-nmax[2], nmax[2] + 1)]
-
         jumplist = []
         jumpindices = []
         jumpset = set([])
-        for R in Rvects:
-            for i, tup1 in enumerate(iorlist):
-                for f, tup2 in enumerate(iorlist):
-                    db1 = dumbbell(i, np.zeros(self.crys.dim, dtype=int))
-                    db2 = dumbbell(f, R)
-                    if db1 == db2:  # catch the diagonal case
+        # The candidate transitions are screened by distance beforehand
+        for i, f, R, dx in jumpcandidates(self, cutoff):
+            db1 = dumbbell(i, np.zeros(self.crys.dim, dtype=int))
+            db2 = dumbbell(f, R)
+            for c1 in [-1, 1]:
+                # Check if the jump is a rotation - 180 degree rotations end up in the same state
+                # they are not considered
+                if np.allclose(np.dot(dx, dx), 0., atol=crys.threshold):
+                    j = jump(db1, db2, c1, 1)
+                    j_equiv = jump(db1, db2, -c1, -1)
+                    # Also check if the equivalent rotation has been considered.
+                    if j in jumpset or j_equiv in jumpset:
+                        continue
+                    if collision_self(self, None, j, solv_solv_cut, solv_solv_cut) or\
+                            collision_others(self, None, j, closestdistance):
                         continue
-                    dx = disp(self, db1, db2)
-                    if np.dot(dx, dx) > cutoff * cutoff:
+                    jlist, jindlist = getjumps(j, jumpset, dx)
+                    jumplist.append(jlist)
+                    jumpindices.append(jindlist)
+                    continue
+                for c2 in [-1, 1]:
+                    j = jump(db1, db2, c1, c2)
+                    if j in jumpset:  # no point doing anything else if the jump has already been considered
                         continue
-                    for c1 in [-1, 1]:
-                        # Check if the jump is a rotation - 180 degree rotations end up in the same state
-                        # they are not considered
-                        if np.allclose(np.dot(dx, dx), 0., atol=crys.threshold):
-                            j = jump(db1, db2, c1, 1)
-                            j_equiv = jump(db1, db2, -c1, -1)
-                            # Also check if the equivalent rotation has been considered.
-                            if j in jumpset or j_equiv in jumpset:
-                                continue
-                            if collision_self(self, None, j, solv_solv_cut, solv_solv_cut) or\
-                                    collision_others(self, None, j, closestdistance):
-                                continue
-                            jlist, jindlist = getjumps(j, jumpset, dx)
-                            jumplist.append(jlist)
-                            jumpindices.append(jindlist)
-                            continue
-                        for c2 in [-1, 1]:
-                            j = jump(db1, db2, c1, c2)
-                            if j in jumpset:  # no point doing anything else if the jump has already been considered
-                                continue
-                            if collision_self(self, None, j, solv_solv_cut, solv_solv_cut) or\
-                                    collision_others(self, None, j, closestdistance):
-                                continue
-                            jlist, jindlist = getjumps(j, jumpset, dx)
-                            jumplist.append(jlist)
-                            jumpindices.append(jindlist)
+                    if collision_self(self, None, j, solv_solv_cut, solv_solv_cut) or\
+                            collision_others(self, None, j, closestdistance):
+                        continue
+                    jlist, jindlist = getjumps(j, jumpset, dx)
+                    jumplist.append(jlist)
+                    jumpindices.append(jindlist)
         return jumplist, jumpindices
 
     def getIndex(self, t):
@@ -312,12 +529,29 @@ class dbStates(object):
         (i, o) contained in t
         :return: idx (integer) - the index of (i, o) in the iorlist, if it exists.
         """
+        idx = self.iorindexdict.get(orkey(t[0], t[1], self.crys.threshold, signless=True))
+        if idx is not None:
+            return idx
         for idx,tup in enumerate(self.iorlist):
             if t[0]==tup[0] and (np.allclose(t[1], tup[1], atol=self.crys.threshold) or
                                  np.allclose(t[1], -tup[1], atol=self.crys.threshold)):
                 return idx
         raise ValueError("The given site orientation pair {} is not present in the container".format(t))
 
+    def getIndices(self, sites, orientations):
+        """
+        Vectorized version of getIndex
+        :param sites: (N,) array of site indices
+        :param orientations: (N x dim) array of orientations
+        :return: (N,) array of indices of the (i, o) pairs in the iorlist
+        """
+        sites, orientations = np.asarray(sites, dtype=int), np.asarray(orientations, dtype=float)
+        inds = lookuporkeys(self.iorkeyindex, sites, orientations, self.crys.threshold, signless=True)
+        # Pairs whose keys are not found are compared directly
+        for n in np.nonzero(inds < 0)[0]:
+            inds[n] = self.getIndex((sites[n], orientations[n]))
+        return inds
+
     def db2ind(self, db):
         """
         :param db: dumbbell object
@@ -330,7 +564,7 @@ class dbStates(object):
 
         return self.getIndex((i,o))
 
-class mStates(object):
+class mStates(GopTables):
 
     def __init__(self, crys, chem, family):
         if not isinstance(family, list):
@@ -341,7 +575,15 @@ class mStates(object):
         self.family = family
         # make the dumbbell states, change the indexmap of the grouops and store original groupops in G_crys
         self.iorlist = self.genmixedsets()
+        # hash index of the (i, or) pairs for getIndex
+        self.iorindexdict = {}
+        for idx, (i, o) in enumerate(self.iorlist):
+            self.iorindexdict.setdefault(orkey(i, o, 1e-8), idx)
+        # and the sorted keys for getIndices
+        self.iorkeyindex = orkeyindex(self.iorlist, 1e-8)
         self.G, self.G_crys, = self.makeDbGops(self.crys, self.chem, self.iorlist)
+        # Tabulate the action of the group operations on the sites and (i, or) indices
+        self.makegoptables()
         self.symorlist, self.symIndlist = self.gensymset()  # make this an indexed list
         # Store both iorlist and symorlist so that we can compare them later if needed.
         self.threshold = crys.threshold
@@ -376,6 +618,9 @@ class mStates(object):
             return any(tup[0] == x[0] and np.allclose(tup[1], x[1], atol=1e-8) for x in lis)
 
         sitelist = crys.sitelist(chem)
+        # Keys of the (i, or) pairs already in the list - if a key is not found, we still make sure with the direct
+        # comparisons.
+        pairkeys = set([])
         # Get the Wyckoff sets
         pairlist = []
         for i, wycksites in enumerate(sitelist):
@@ -386,13 +631,20 @@ class mStates(object):
                 for g in crys.G:
                     R, (ch, i_new) = crys.g_pos(g, np.zeros(self.crys.dim), (chem, site))
                     o_new = crys.g_direc(g, o)
+                    if orkey(i_new, o_new, 1e-8) in pairkeys:
+                        continue
                     if not inlist((i_new, o_new), pairlist):
                         pairlist.append((i_new, o_new))
+                        pairkeys.add(orkey(i_new, o_new, 1e-8))
         return pairlist
 
     def makeDbGops(self, crys, chem, iorlist):
         G = []
         G_crys = {}
+        # Look up the rotated (i, or) pairs by their keys first
+        iorkeys = {}
+        for idx, (i, o) in enumerate(iorlist):
+            iorkeys.setdefault(orkey(i, o, crys.threshold), idx)
         for g in crys.G:
             # Will have indexmap for each groupop
             indexmap = []
@@ -400,7 +652,10 @@ class mStates(object):
                 # Need the elements of indexmap
                 R, (ch, i_new) = crys.g_pos(g, np.zeros(self.crys.dim), (chem, i))
                 o_new = crys.g_direc(g, o)
-                count = 0
+                idx2 = iorkeys.get(orkey(i_new, o_new, crys.threshold))
+                if idx2 is not None:
+                    indexmap.append(idx2)
+                    continue
                 for idx2, (i2, o2) in enumerate(iorlist):
                     if i2 == i_new and np.allclose(o2, o_new, atol=crys.threshold):
                         indexmap.append(idx2)
@@ -446,69 +701,52 @@ class mStates(object):
         """
         crys, chem, mset = self.crys, self.chem, self.iorlist
 
-        nmax = [int(np.round(np.sqrt(cutoff ** 2 / crys.metric[i, i]))) + 1 for i in range(crys.dim)]
-
-        if crys.dim == 2:
-            Rvects = [np.array([n0, n1]) for n0 in range(-nmax[0], nmax[0] + 1)
-                      for n1 in range(-nmax[1], nmax[1] + 1)]
-
-        else:
-            Rvects = [np.array([n0, n1, n2]) for n0 in range(-nmax[0], nmax[0] + 1)
-                      for n1 in range(-nmax[1], nmax[1] + 1)
-                      for n2 in range(-nmax[2], nmax[2] + 1)]
-
         jumplist = []
         jumpindices = []
         jumpset = set([])
 
-        for R in Rvects:
-            for i, st1 in enumerate(mset):
-                for f, st2 in enumerate(mset):
-                    db1 = dumbbell(i, np.zeros(self.crys.dim, dtype=int))
-                    p1 = SdPair(st1[0], np.zeros(self.crys.dim, dtype=int), db1)
-                    db2 = dumbbell(f, R)
-                    p2 = SdPair(st2[0], R, db2)
-                    if p1 == p2:  # Get the diagonal case
-                        continue
-                    dx = disp(self, db1, db2)
-                    if np.dot(dx, dx) > cutoff ** 2:
-                        continue
-                    j = jump(p1, p2, 1, 1)  # since only solute moves, both indicators are +1
-                    if j in jumpset:
-                        continue
-                    if not (collision_self(self, None, j, solt_solv_cut, solt_solv_cut) or
-                            collision_others(self, None, j, closestdistance)):
-                        jlist = []
-                        jindlist = []
-                        for gdumb in self.G:
-                            p1new = p1.gop(self, gdumb, complex=False)
-                            p2new = p2.gop(self, gdumb, complex=False) - p1new.R_s
-                            p1new -= p1new.R_s
-
-                            jnew = jump(p1new, p2new, j.c1, j.c2)
-                            # Place some sanity checks for safety, also helpful for tests
-                            if not np.allclose(jnew.state1.R_s, np.zeros(self.crys.dim), atol=self.crys.threshold):
-                                raise ValueError("The initial state is not at the origin unit cell")
-                            if not np.allclose(jnew.state1.db.R, np.zeros(self.crys.dim), atol=self.crys.threshold):
-                                raise ValueError("The solute is not at the same site as the dumbbell in mixed dumbbell")
-                            if not np.allclose(jnew.state2.db.R, jnew.state2.R_s, atol=self.crys.threshold):
-                                raise ValueError("The solute is not at the same site as the dumbbell in mixed dumbbell")
-
-                            if not jnew in jumpset:
-                                dx = disp(self, jnew.state1, jnew.state2)
-                                # create the negative jump
-                                p1neg = SdPair(p2new.i_s, p1new.R_s, dumbbell(p2new.db.iorind, p1new.db.R))
-                                p2neg = SdPair(p1new.i_s, -p2new.R_s, dumbbell(p1new.db.iorind, -p2new.db.R))
-                                jnewneg = jump(p1neg, p2neg, 1, 1)
-                                # add both the jump and its negative
-                                jlist.append(jnew)
-                                jlist.append(jnewneg)
-                                jindlist.append(((jnew.state1.db.iorind, jnew.state2.db.iorind), dx))
-                                jindlist.append(((jnew.state2.db.iorind, jnew.state1.db.iorind), -dx))
-                                jumpset.add(jnew)
-                                jumpset.add(jnewneg)
-                        jumplist.append(jlist)
-                        jumpindices.append(jindlist)
+        # The candidate transitions are screened by distance beforehand
+        for i, f, R, dx in jumpcandidates(self, cutoff):
+            db1 = dumbbell(i, np.zeros(self.crys.dim, dtype=int))
+            p1 = SdPair(mset[i][0], np.zeros(self.crys.dim, dtype=int), db1)
+            db2 = dumbbell(f, R)
+            p2 = SdPair(mset[f][0], R, db2)
+            j = jump(p1, p2, 1, 1)  # since only solute moves, both indicators are +1
+            if j in jumpset:
+                continue
+            if not (collision_self(self, None, j, solt_solv_cut, solt_solv_cut) or
+                    collision_others(self, None, j, closestdistance)):
+                jlist = []
+                jindlist = []
+                for gdumb in self.G:
+                    p1new = p1.gop(self, gdumb, complex=False)
+                    p2new = p2.gop(self, gdumb, complex=False) - p1new.R_s
+                    p1new -= p1new.R_s
+
+                    jnew = jump(p1new, p2new, j.c1, j.c2)
+                    # Place some sanity checks for safety, also helpful for tests
+                    if not np.allclose(jnew.state1.R_s, np.zeros(self.crys.dim), atol=self.crys.threshold):
+                        raise ValueError("The initial state is not at the origin unit cell")
+                    if not np.allclose(jnew.state1.db.R, np.zeros(self.crys.dim), atol=self.crys.threshold):
+                        raise ValueError("The solute is not at the same site as the dumbbell in mixed dumbbell")
+                    if not np.allclose(jnew.state2.db.R, jnew.state2.R_s, atol=self.crys.threshold):
+                        raise ValueError("The solute is not at the same site as the dumbbell in mixed dumbbell")
+
+                    if not jnew in jumpset:
+                        dx = disp(self, jnew.state1, jnew.state2)
+                        # create the negative jump
+                        p1neg = SdPair(p2new.i_s, p1new.R_s, dumbbell(p2new.db.iorind, p1new.db.R))
+                        p2neg = SdPair(p1new.i_s, -p2new.R_s, dumbbell(p1new.db.iorind, -p2new.db.R))
+                        jnewneg = jump(p1neg, p2neg, 1, 1)
+                        # add both the jump and its negative
+                        jlist.append(jnew)
+                        jlist.append(jnewneg)
+                        jindlist.append(((jnew.state1.db.iorind, jnew.state2.db.iorind), dx))
+                        jindlist.append(((jnew.state2.db.iorind, jnew.state1.db.iorind), -dx))
+                        jumpset.add(jnew)
+                        jumpset.add(jnewneg)
+                jumplist.append(jlist)
+                jumpindices.append(jindlist)
         return jumplist, jumpindices
 
     def getIndex(self, t):
@@ -516,11 +754,28 @@ class mStates(object):
         :param t = (i, o) - (site, orientation) tuple
         :return: idx (integer) - the index of (i, o) in the iorlist, if it exists.
         """
+        idx = self.iorindexdict.get(orkey(t[0], t[1], 1e-8))
+        if idx is not None:
+            return idx
         for idx,tup in enumerate(self.iorlist):
             if t[0]==tup[0] and np.allclose(t[1], tup[1], atol = 1e-8):
                 return idx
         raise ValueError("The given site orientation pair {} is not present in the container".format(t))
 
+    def getIndices(self, sites, orientations):
+        """
+        Vectorized version of getIndex
+        :param sites: (N,) array of site indices
+        :param orientations: (N x dim) array of orientations
+        :return: (N,) array of indices of the (i, o) pairs in the iorlist
+        """
+        sites, orientations = np.asarray(sites, dtype=int), np.asarray(orientations, dtype=float)
+        inds = lookuporkeys(self.iorkeyindex, sites, orientations, 1e-8)
+        # Pairs whose keys are not found are compared directly
+        for n in np.nonzero(inds < 0)[0]:
+            inds[n] = self.getIndex((sites[n], orientations[n]))
+        return inds
+
     def db2ind(self, db):
         """
         :param db: dumbbell object
@@ -5,7 +5,10 @@ from test_structs import *
 from states import *
 # from gensets import *
 import unittest
+import tempfile
+import pickle
 import collections
+from unittest import mock
 
 
 class test_StarSet(unittest.TestCase):
@@ -274,16 +277,20 @@ class test_StarSet(unittest.TestCase):
                     self.assertTrue(isinstance(jmp.state1, dumbbell), msg="\n{}".format(struct))
             ##TEST omega_1
             (omega1_network, omega1_indexed, omega1tag), om1types = crys_stars.jumpnetwork_omega1()
-            for jlist, initdict in zip(omega1_indexed, omega1tag):
-                for IS, jtag in initdict.items():
-                    # go through the rows of the jtag:
-                    for row in range(len(jtag)):
-                        self.assertTrue(jtag[row][IS] == 1)
-                        for column in range(len(crys_stars.complexStates) + len(crys_stars.mixedstates)):
-                            if jtag[row][column] == -1:
-                                self.assertTrue(any(i == IS and j == column for (i, j), dx in jlist))
-                                # If any is true, then that means only one is true, since a jump b/w two states is
-                                # present only once.
+            Ncomp, Nstates = len(crys_stars.complexStates), len(crys_stars.complexStates) + len(crys_stars.mixedstates)
+
+            def checktags(jnet_indexed, jtags, initoffset, finoffset):
+                # (jtag @ x)[IS] must be the sum of x[IS] - x[FS] over all the jumps out of IS
+                self.assertEqual(len(jnet_indexed), len(jtags))
+                for jlist, jtag in zip(jnet_indexed, jtags):
+                    self.assertEqual(jtag.shape, (Nstates, Nstates))
+                    jtag_test = np.zeros((Nstates, Nstates), dtype=int)
+                    for (i, j), dx in jlist:
+                        jtag_test[i + initoffset, i + initoffset] += 1
+                        jtag_test[i + initoffset, j + finoffset] -= 1
+                    self.assertTrue(np.array_equal(jtag.toarray(), jtag_test), msg="{}".format(struct))
+
+            checktags(omega1_indexed, omega1tag, 0, 0)
 
             rotset = set([])  # Here we will store the rotational jumps in the network
             rotInd = []
@@ -432,26 +439,8 @@ class test_StarSet(unittest.TestCase):
                     self.assertTrue(jmp.state1 == crys_stars.mixedstates[indjmp[0][0]], msg="{}".format(struct))
                     self.assertTrue(jmp.state2 == crys_stars.complexStates[indjmp[0][1]])
             # testing the tags
-            # First, omega4
-            for jlist, initdict in zip(omega4_network_indexed, omega4tag):
-                for IS, jtag in initdict.items():
-                    # go through the rows of the jtag:
-                    for row in range(len(jtag)):
-                        self.assertTrue(jtag[row][IS] == 1)
-                        for column in range(len(crys_stars.complexStates) + len(crys_stars.mixedstates)):
-                            if jtag[row][column] == -1:
-                                self.assertTrue(
-                                    any(i == IS and j == column - len(crys_stars.complexStates) for (i, j), dx in
-                                        jlist))
-            # Next, omega3
-            for jlist, initdict in zip(omega3_network_indexed, omega3tag):
-                for IS, jtag in initdict.items():
-                    # go through the rows of the jtag:
-                    for row in range(len(jtag)):
-                        self.assertTrue(jtag[row][IS + len(crys_stars.complexStates)] == 1)
-                        for column in range(len(crys_stars.complexStates) + len(crys_stars.mixedstates)):
-                            if jtag[row][column] == -1:
-                                self.assertTrue(any(i == IS and j == column for (i, j), dx in jlist))
+            checktags(omega4_network_indexed, omega4tag, 0, Ncomp)
+            checktags(omega3_network_indexed, omega3tag, Ncomp, 0)
             # Next, omega2 to mixedstates
             jnet2, jnet2stateindex = crys_stars.jnet2, crys_stars.jnet2_ind
             for i in range(len(jnet2)):
@@ -464,20 +453,19 @@ class test_StarSet(unittest.TestCase):
                     self.assertEqual(FS, jpair.state2 - jpair.state2.R_s,
                                      msg="\n{} not equal to {}".format(FS, jpair.state2))
 
-            for jlist, initdict in zip(jnet2stateindex, crys_stars.jtags2):
-                for IS, jtag in initdict.items():
-                    # go through the rows of the jtag:
-                    for row in range(len(jtag)):
-                        # The column corresponding to the intial state must have 1.
-                        self.assertTrue(jtag[row][IS + len(crys_stars.complexStates)] == 1 or jtag[row][
-                            IS + len(crys_stars.complexStates)] == 0,
-                                        msg="{}".format(jtag[row][IS + len(crys_stars.complexStates)]))
-                        # the zero appears when the intial and final states are the same (but just translated in the lattice) so that they have the same periodic eta vector
-                        for column in range(len(crys_stars.complexStates) + len(crys_stars.mixedstates)):
-                            if jtag[row][column] == -1:
-                                self.assertTrue(
-                                    any(i == IS and j == column - len(crys_stars.complexStates) for (i, j), dx in
-                                        jlist))
+            # jumps between translated copies of the same mixed state have the same periodic eta vector at both ends
+            # and cancel out of the tags.
+            checktags(jnet2stateindex, crys_stars.jtags2, Ncomp, Ncomp)
+
+    def test_gdumbpairs(self):
+        # every crystal group operation must appear exactly once, paired with its pure and mixed dumbbell versions
+        self.assertEqual(len(self.crys_stars.gdumbpairs), len(self.crys_stars.crys.G))
+        glist = []
+        for gdumb_pure, gdumb_mixed in self.crys_stars.gdumbpairs:
+            g = self.pdbcontainer.G_crys[gdumb_pure]
+            self.assertEqual(g, self.mdbcontainer.G_crys[gdumb_mixed])
+            glist.append(g)
+        self.assertEqual(set(glist), set(self.crys_stars.crys.G))
 
     def test_om1types(self):
         """
@@ -531,3 +519,189 @@ class test_StarSet(unittest.TestCase):
             dx_list.append(dx)
         self.assertTrue(np.allclose(np.array(dx_list), np.array(sorted(dx_list))),
                         msg="\n{}\n{}".format(dx_list, sorted(dx_list)))
+
+        # the stored separations must be those of the complex states, and in increasing order
+        self.assertEqual(len(crys_stars.complexDx2), len(crys_stars.complexStates))
+        for st, dx2 in zip(crys_stars.complexStates, crys_stars.complexDx2):
+            self.assertAlmostEqual(crys_stars._sortkey(st), dx2)
+        self.assertTrue(np.all(np.diff(crys_stars.complexDx2) > -crys_stars.crys.threshold))
+
+    def test_extend(self):
+        # extending a starset by one shell must give the same states and stars as generating it directly, with the
+        # states and stars already present keeping their indices
+        pdbcontainer = dbStates(tet2, 0, [[np.array([1., 1., 0.]) * 0.1], [np.array([1., 1., 1.]) * 0.1]])
+        mdbcontainer = mStates(tet2, 0, [[np.array([1., 1., 0.]) * 0.1], [np.array([1., 1., 1.]) * 0.1]])
+        jset0 = pdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        jset2 = mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        crys_stars = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 1)
+        crys_stars2 = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 2)
+        extended = crys_stars.copy()
+        statemap, starmap = extended.extend(1)
+
+        self.assertEqual(extended.Nshells, 2)
+        self.assertEqual(extended.stateset, crys_stars2.stateset)
+        self.assertEqual(set(extended.complexStates), set(crys_stars2.complexStates))
+        self.assertEqual(extended.mixedstartindex, crys_stars2.mixedstartindex)
+        self.assertEqual(set(map(frozenset, extended.stars[:extended.mixedstartindex])),
+                         set(map(frozenset, crys_stars2.stars[:crys_stars2.mixedstartindex])))
+        self.assertEqual(extended.stars[extended.mixedstartindex:], crys_stars2.stars[crys_stars2.mixedstartindex:])
+
+        # the states and complex stars already present keep their indices, and only the mixed stars move
+        Nstates, Nstars = len(crys_stars.complexStates), crys_stars.mixedstartindex
+        self.assertEqual(list(extended.complexStates)[:Nstates], list(crys_stars.complexStates))
+        self.assertEqual(extended.stars[:Nstars], crys_stars.stars[:Nstars])
+        self.assertEqual(extended.starindexed[:Nstars], crys_stars.starindexed[:Nstars])
+        for state, inds in crys_stars.complexIndexdict.items():
+            self.assertEqual(extended.complexIndexdict[state], inds)
+        self.assertTrue(np.allclose(extended.complexDx2[:Nstates], crys_stars.complexDx2))
+        self.assertTrue(np.array_equal(statemap, np.arange(Nstates)))
+        for starind, star in enumerate(crys_stars.stars):
+            self.assertEqual(extended.stars[starmap[starind]], star)
+
+        # the indexing of the new states and the mixed states must be consistent
+        for starind, (star, indlist) in enumerate(zip(extended.stars, extended.starindexed)):
+            for state, stateind in zip(star, indlist):
+                if starind < extended.mixedstartindex:
+                    self.assertEqual(extended.complexStates[stateind], state)
+                    self.assertEqual(extended.complexIndexdict[state], (stateind, starind))
+                else:
+                    self.assertEqual(extended.mixedstates[stateind], state)
+                    self.assertEqual(extended.mixedindexdict[state], (stateind, starind))
+
+        # with reorder, the states and stars are in the same order as when generated directly, and the maps give the
+        # new indices of the states and stars that were already present
+        reordered = crys_stars.copy()
+        statemap, starmap = reordered.extend(1, reorder=True)
+        self.assertEqual(list(reordered.complexStates), list(crys_stars2.complexStates))
+        self.assertEqual(reordered.stars, crys_stars2.stars)
+        self.assertEqual(reordered.starindexed, crys_stars2.starindexed)
+        self.assertEqual(reordered.complexIndexdict, crys_stars2.complexIndexdict)
+        self.assertTrue(np.allclose(reordered.complexDx2, crys_stars2.complexDx2))
+        self.assertEqual(len(statemap), len(crys_stars.complexStates))
+        self.assertEqual(len(starmap), len(crys_stars.stars))
+        for stateind, state in enumerate(crys_stars.complexStates):
+            self.assertEqual(reordered.complexStates[statemap[stateind]], state)
+        for starind, star in enumerate(crys_stars.stars):
+            self.assertEqual(reordered.stars[starmap[starind]], star)
+
+        # the original starset is left as it was
+        self.assertEqual(crys_stars.Nshells, 1)
+        self.assertEqual(len(crys_stars.stars), crys_stars.mixedstartindex + len(mdbcontainer.symIndlist))
+
+    def test_workers(self):
+        # grouping the states and finding the omega1 jumps with worker processes must give exactly the same starset
+        pdbcontainer = dbStates(tet2, 0, [[np.array([1., 1., 0.]) * 0.1], [np.array([1., 1., 1.]) * 0.1]])
+        mdbcontainer = mStates(tet2, 0, [[np.array([1., 1., 0.]) * 0.1], [np.array([1., 1., 1.]) * 0.1]])
+        jset0 = pdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        jset2 = mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        crys_stars = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 1).copy()
+        crys_stars.extend(1)
+        (jnet1, jnet1_indexed, jtags1), jtype = crys_stars.jumpnetwork_omega1()
+        for statedir in [None, tempdir.name]:
+            with mock.patch("stars._groupchunk", 7):
+                crys_stars_par = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 1, statedir=statedir,
+                                         n_workers=2).copy()
+                crys_stars_par.extend(1)
+                (jnet1_par, jnet1_indexed_par, jtags1_par), jtype_par = crys_stars_par.jumpnetwork_omega1()
+
+            self.assertEqual(list(crys_stars_par.complexStates), list(crys_stars.complexStates))
+            self.assertEqual(crys_stars_par.stars, crys_stars.stars)
+            self.assertEqual(crys_stars_par.starindexed, crys_stars.starindexed)
+            self.assertEqual(jnet1_par, jnet1)
+            self.assertEqual(jtype_par, jtype)
+            for jlist, jlist_par in zip(jnet1_indexed, jnet1_indexed_par):
+                self.assertEqual([ij for ij, dx in jlist_par], [ij for ij, dx in jlist])
+                self.assertTrue(np.allclose([dx for ij, dx in jlist_par], [dx for ij, dx in jlist]))
+
+        # no worker processes are kept in the starset, so that it can be pickled along with a calculator
+        crys_stars_par = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 1, n_workers=2)
+        crys_stars_pickled = pickle.loads(pickle.dumps(crys_stars_par))
+        self.assertEqual(crys_stars_pickled.n_workers, 2)
+        self.assertEqual(list(crys_stars_pickled.complexStates), list(crys_stars_par.complexStates))
+        self.assertEqual(crys_stars_pickled.stars, crys_stars_par.stars)
+        crys_stars_pickled.extend(1)
+        self.assertEqual(crys_stars_pickled.stars, crys_stars.stars)
+
+    def test_rcut(self):
+        # a cutoff larger than all the separations must not change the starset
+        jset0 = self.pdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        jset2 = self.mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        crys_stars = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 2, rcut=10.)
+        self.assertEqual(set(crys_stars.complexStates), set(self.crys_stars.complexStates))
+
+        # with a smaller cutoff, we must get exactly the states within it that can be reached by jumps that stay
+        # inside it, grouped into complete stars.
+        crys_stars_big = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 4)
+        rcut = np.sqrt(self.crys_stars.complexDx2.max()) * 0.8
+        crys_stars = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, rcut=rcut)
+        inside = set(st for st, dx2 in zip(crys_stars_big.complexStates, crys_stars_big.complexDx2)
+                     if dx2 <= rcut ** 2 + self.crys_stars.crys.threshold)
+        self.assertTrue(set(crys_stars.complexStates) <= inside)
+        for st in crys_stars.complexStates:
+            for j in crys_stars.jumplist:
+                try:
+                    stnew = st.addjump(j)
+                except ArithmeticError:
+                    continue
+                if stnew in inside:
+                    self.assertTrue(stnew in crys_stars.stateset)
+        self.assertEqual(sum(len(star) for star in crys_stars.stars[:crys_stars.mixedstartindex]),
+                         len(crys_stars.complexStates))
+        for star in crys_stars.stars[:crys_stars.mixedstartindex]:
+            for g in crys_stars.pdbcontainer.G:
+                stnew = star[0].gop(crys_stars.pdbcontainer, g)[0]
+                stnew = stnew - stnew.R_s
+                self.assertTrue(stnew in star)
+
+        # extending the starset grows it by a full jump shell beyond the sphere
+        crys_stars_ext = crys_stars.copy()
+        crys_stars_ext.extend(1)
+        for st in crys_stars.complexStates:
+            for j in crys_stars.jumplist:
+                try:
+                    stnew = st.addjump(j)
+                except ArithmeticError:
+                    continue
+                self.assertTrue(stnew in crys_stars_ext.stateset)
+
+    def test_statedir(self):
+        # a starset with the complex states kept out of core must be the same as the one kept in memory
+        jset0 = self.pdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        jset2 = self.mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        crys_stars = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 1, statedir=tempdir.name)
+        crys_stars_mem = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 1)
+        for starset in [crys_stars, crys_stars_mem]:
+            starset.extend(1)
+        self.assertEqual(list(crys_stars.complexStates), list(crys_stars_mem.complexStates))
+        self.assertEqual(crys_stars.stars, crys_stars_mem.stars)
+        self.assertEqual(crys_stars.starindexed, crys_stars_mem.starindexed)
+        self.assertEqual(len(crys_stars.complexIndexdict), len(crys_stars_mem.complexIndexdict))
+        for state, inds in crys_stars_mem.complexIndexdict.items():
+            self.assertEqual(crys_stars.complexIndexdict[state], inds)
+            self.assertTrue(state in crys_stars.stateset)
+        self.assertEqual(crys_stars.jumpnetwork_omega1()[0][0], crys_stars_mem.jumpnetwork_omega1()[0][0])
+
+    def test_chunks(self):
+        # tabulating the images of a few states or jumps at a time must give exactly the same stars and jumps
+        jset0 = self.pdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        jset2 = self.mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+        crys_stars = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 2)
+        (jnet1, jnet1_indexed, jtags1), jtype = crys_stars.jumpnetwork_omega1()
+        omega43, omega4, omega3 = crys_stars.jumpnetwork_omega34(0.35, 0.01, 0.01, 0.01)
+        with mock.patch("stars._groupchunk", 7):
+            crys_stars_chunk = StarSet(self.pdbcontainer, self.mdbcontainer, jset0, jset2, 2)
+            (jnet1_chunk, jnet1_indexed_chunk, jtags1_chunk), jtype_chunk = crys_stars_chunk.jumpnetwork_omega1()
+            omega43_chunk, omega4_chunk, omega3_chunk = crys_stars_chunk.jumpnetwork_omega34(0.35, 0.01, 0.01, 0.01)
+
+        self.assertEqual(crys_stars_chunk.stars, crys_stars.stars)
+        self.assertEqual(crys_stars_chunk.starindexed, crys_stars.starindexed)
+        self.assertEqual(jnet1_chunk, jnet1)
+        self.assertEqual(jtype_chunk, jtype)
+        for jlist, jlist_chunk in zip(jnet1_indexed, jnet1_indexed_chunk):
+            self.assertEqual([ij for ij, dx in jlist_chunk], [ij for ij, dx in jlist])
+        self.assertEqual(omega4_chunk[0], omega4[0])
+        self.assertEqual(omega3_chunk[0], omega3[0])
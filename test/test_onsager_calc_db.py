@@ -1434,4 +1434,30 @@ class test_2d(test_dumbbell_mediated):
         self.W1list = np.random.rand(len(self.onsagercalculator.jnet1))
         self.W2list = np.random.rand(len(self.onsagercalculator.jnet0))
         self.W3list = np.random.rand(len(self.onsagercalculator.jnet3))
-        self.W4list = np.random.rand(len(self.onsagercalculator.jnet4))
\ No newline at end of file
+        self.W4list = np.random.rand(len(self.onsagercalculator.jnet4))
+
+class test_empty_thermo(unittest.TestCase):
+    def test_Nthermo0(self):
+        # a calculator made with the default Nthermo=0 must still have a kinetic shell, and grow it when generated
+        latt = np.array([[0.5, 0.5, 0.], [0., 0.5, 0.5], [0.5, 0., 0.5]]) * 0.55
+        DC_Si = Crystal(latt, [[np.array([0., 0., 0.]), np.array([0.25, 0.25, 0.25])]], ["Si"])
+        family = [[np.array([1., 0., 0.]) * 0.126]]
+        pdbcontainer = dbStates(DC_Si, 0, family)
+        mdbcontainer = mStates(DC_Si, 0, family)
+        jset0, jset2 = pdbcontainer.jumpnetwork(0.3, 0.01, 0.01), mdbcontainer.jumpnetwork(0.3, 0.01, 0.01)
+
+        onsagercalculator = dumbbellMediated(pdbcontainer, mdbcontainer, jset0, jset2, 0.3, 0.01, 0.01, 0.01,
+                                             NGFmax=4)
+        self.assertIsInstance(onsagercalculator.kinetic, StarSet)
+        self.assertEqual(onsagercalculator.kinetic.mdbcontainer, mdbcontainer)
+
+        onsagercalculator.generate(1, 0.3, 0.01, 0.01, 0.01)
+        # the kinetic shell holds the same states as one generated directly, with the thermodynamic ones first
+        kinetic = StarSet(pdbcontainer, mdbcontainer, jset0, jset2, 2)
+        Nstates = len(onsagercalculator.thermo.complexStates)
+        self.assertEqual(set(onsagercalculator.kinetic.complexStates), set(kinetic.complexStates))
+        self.assertEqual(list(onsagercalculator.kinetic.complexStates)[:Nstates],
+                         list(onsagercalculator.thermo.complexStates))
+        self.assertEqual(onsagercalculator.kinetic.stars[:onsagercalculator.thermo.mixedstartindex],
+                         onsagercalculator.thermo.stars[:onsagercalculator.thermo.mixedstartindex])
+        self.assertTrue(onsagercalculator.vkinetic.starset is onsagercalculator.kinetic)
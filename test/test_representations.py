@@ -0,0 +1,138 @@
+import numpy as np
+from representations import *
+import itertools
+import tempfile
+import os
+import gc
+import unittest
+
+
+class test_keys(unittest.TestCase):
+
+    def test_state_keys(self):
+        # equal states must have equal keys and hashes, different states different keys
+        Rlist = [np.array(R) for R in itertools.product([-2, 0, 1], repeat=3)]
+        dbkeys = set([])
+        pairkeys = set([])
+        for iorind, R in itertools.product(range(3), Rlist):
+            db = dumbbell(iorind, R)
+            db2 = dumbbell(iorind, R.astype(float))
+            self.assertEqual(db, db2)
+            self.assertEqual(hash(db), hash(db2))
+            dbkeys.add(db.key)
+            for i_s, R_s in itertools.product(range(2), Rlist[:3]):
+                pair = SdPair(i_s, R_s, db)
+                pairkeys.add(pair.key)
+                self.assertEqual(pair, SdPair(i_s, R_s.copy(), dumbbell(iorind, R.copy())))
+                self.assertNotEqual(pair, SdPair(i_s, R_s + np.array([1, 0, 0]), db))
+        self.assertEqual(len(dbkeys), 3 * len(Rlist))
+        self.assertEqual(len(pairkeys), 3 * len(Rlist) * 2 * 3)
+
+        # a dumbbell and a pair must never be equal, even if their keys coincide
+        db = dumbbell(0, np.zeros(3, dtype=int))
+        pair = SdPair(0, np.zeros(3, dtype=int), db)
+        self.assertEqual(db.key, pair.key)
+        self.assertNotEqual(db, pair)
+        self.assertNotEqual(jump(db, db + np.array([1, 0, 0]), 1, 1),
+                            jump(pair, pair + np.array([1, 0, 0]), 1, 1))
+
+    def test_array_keys(self):
+        # the vectorized keys must be the same as the ones of the objects
+        i_s = np.array([0, 1, 1, 0])
+        R_s = np.zeros((4, 3), dtype=int)
+        iorind = np.array([0, 5, 2, 7])
+        R = np.array([[0, 0, 0], [1, -1, 2], [-3, 0, 1], [0, 0, -1]])
+        dbkeys = packdb_array(iorind, R)
+        pairkeys = packpair_array(i_s, R_s, iorind, R)
+        for n in range(4):
+            db = dumbbell(iorind[n], R[n])
+            self.assertEqual(dbkeys[n], db.key)
+            self.assertEqual(pairkeys[n], SdPair(i_s[n], R_s[n], db).key)
+
+        # solutes far from the origin do not fit into int64 keys, but must still get the exact keys
+        R_s = np.array([[5, -3, 1], [0, 0, 0], [-2, 0, 0], [0, 0, 1]])
+        pairkeys = packpair_array(i_s, R_s, iorind, R)
+        for n in range(4):
+            self.assertEqual(pairkeys[n], SdPair(i_s[n], R_s[n], dumbbell(iorind[n], R[n])).key)
+
+    def test_jump_keys(self):
+        db1 = dumbbell(0, np.zeros(3, dtype=int))
+        db2 = dumbbell(1, np.array([1, 0, 0]))
+        jumps = [jump(db1, db2, c1, c2) for c1, c2 in itertools.product([-1, 1], repeat=2)]
+        self.assertEqual(len(set(jumps)), 4)
+        for j in jumps:
+            self.assertEqual(j, jump(db1, db2, j.c1, j.c2))
+            self.assertNotEqual(j, -j)
+            self.assertEqual(-(-j), j)
+
+    def test_state_table(self):
+        Rlist = [np.array(R) for R in itertools.product([-1, 0, 1], repeat=3)]
+        states = [SdPair(i_s, np.zeros(3, dtype=int), dumbbell(iorind, R))
+                  for i_s, iorind, R in itertools.product(range(2), range(3), Rlist)]
+        table = StateTable(states)
+        self.assertEqual(len(table), len(states))
+        self.assertTrue(np.array_equal(table.iorind, [st.db.iorind for st in states]))
+        self.assertTrue(np.array_equal(table.R, [st.db.R for st in states]))
+
+        # lookups and lazily built objects must agree with the original list
+        for idx, st in enumerate(states):
+            self.assertEqual(table.index(st), idx)
+            self.assertTrue(st in table)
+            self.assertEqual(table[idx], st)
+            self.assertTrue(table[idx] is table[idx])
+        self.assertEqual(list(table), states)
+        self.assertEqual(table[-1], states[-1])
+        self.assertEqual(table[2:5], states[2:5])
+
+        absent = SdPair(0, np.array([1, 0, 0]), dumbbell(0, np.zeros(3, dtype=int)))
+        self.assertFalse(absent in table)
+        with self.assertRaises(ValueError):
+            table.index(absent)
+        with self.assertRaises(ValueError):
+            StateTable(states + states[:1])
+
+        absent = SdPair(0, np.zeros(3, dtype=int), dumbbell(5, np.zeros(3, dtype=int)))
+        keys = np.array([states[4].key, absent.key, states[0].key], dtype=np.int64)
+        self.assertTrue(np.array_equal(table.getindices(keys), [4, -1, 0]))
+
+    def test_state_table_out_of_core(self):
+        # a table kept in memory-mapped files must behave just like one kept in memory
+        Rlist = [np.array(R) for R in itertools.product([-1, 0, 1], repeat=3)]
+        states = [SdPair(i_s, np.zeros(3, dtype=int), dumbbell(iorind, R))
+                  for i_s, iorind, R in itertools.product(range(2), range(3), Rlist)]
+        table = StateTable(states)
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        diskTable = StateTable.fromarrays(table.i_s, table.R_s, table.iorind, table.R, directory=tempdir.name)
+        self.assertTrue(isinstance(diskTable.keys, np.memmap))
+        self.assertEqual(list(diskTable), states)
+        for idx, st in enumerate(states):
+            self.assertEqual(diskTable.index(st), idx)
+            self.assertTrue(st in diskTable)
+        absent = SdPair(0, np.array([1, 0, 0]), dumbbell(0, np.zeros(3, dtype=int)))
+        self.assertFalse(absent in diskTable)
+        with self.assertRaises(ValueError):
+            diskTable.index(absent)
+        keys = np.array([states[4].key, absent.key, states[0].key], dtype=object)
+        self.assertTrue(np.array_equal(diskTable.getindices(keys), [4, -1, 0]))
+        with self.assertRaises(ValueError):
+            StateTable.fromarrays(np.concatenate((table.i_s, table.i_s[:1])),
+                                  np.concatenate((table.R_s, table.R_s[:1])),
+                                  np.concatenate((table.iorind, table.iorind[:1])),
+                                  np.concatenate((table.R, table.R[:1])), directory=tempdir.name)
+
+        # views of the rows of the table
+        rows = StateRows(diskTable, [5, 2, 7])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows, [states[5], states[2], states[7]])
+        self.assertEqual(rows.index(states[2]), 1)
+        self.assertTrue(states[7] in rows)
+        self.assertFalse(states[0] in rows)
+
+        # the files of a table are deleted along with it
+        path = diskTable.path
+        self.assertTrue(os.path.isdir(path))
+        del diskTable, rows
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(tempdir.name), [])
@@ -198,6 +198,93 @@ class test_statemaking(unittest.TestCase):
                 self.assertEqual(mstates1.iorlist[idx][0],state[0])
                 self.assertTrue(np.allclose(mstates1.iorlist[idx][1], state[1], atol=mstates1.crys.threshold))
 
+    def test_gop_tables(self):
+        # the tabulated group actions must reproduce g_pos and gflip, and the batched form the single state one.
+        dbstates = dbStates(self.crys, 0, self.family)
+        mstates = mStates(self.crys, 0, self.family)
+        dim = self.crys.dim
+        Rlist = [np.array(R) for R in itertools.product([-1, 0, 2], repeat=dim)]
+        for container, pure in ((dbstates, True), (mstates, False)):
+            self.assertEqual(container.Glist, list(container.G))
+            states = StateTable([SdPair(container.iorlist[idx][0], R_s, dumbbell(idx, R))
+                                 for idx in range(len(container.iorlist))
+                                 for R_s, R in itertools.product(Rlist[:2], Rlist)])
+            for gdumb in container.G:
+                g = container.G_crys[gdumb]
+                gind = container.gopindex(gdumb)
+                self.assertTrue(container.Glist[gind] is gdumb)
+                for st in states:
+                    R_s_new, (ch, i_s_new) = self.crys.g_pos(g, st.R_s, (0, st.i_s))
+                    R_new, (ch, i_new) = self.crys.g_pos(g, st.db.R, (0, container.iorlist[st.db.iorind][0]))
+                    stnew = SdPair(i_s_new, R_s_new, dumbbell(gdumb.indexmap[0][st.db.iorind], R_new))
+                    if pure:
+                        self.assertEqual(st.gop(container, gdumb)[0], stnew)
+                        self.assertEqual(st.gop(container, gdumb)[1], container.gflip(gdumb, st.db.iorind))
+                    else:
+                        self.assertEqual(st.gop(container, gdumb, complex=False), stnew)
+
+                if pure:
+                    statesnew, flip = container.gop_batch(states, gdumb)
+                    self.assertTrue(np.array_equal(flip, [st.gop(container, gdumb)[1] for st in states]))
+                    statelist = [st.gop(container, gdumb)[0] for st in states]
+                else:
+                    statesnew = container.gop_batch(states, gdumb)
+                    statelist = [st.gop(container, gdumb, complex=False) for st in states]
+                self.assertEqual(list(statesnew), statelist)
+
+    def test_disp(self):
+        # displacements from the cached site positions must match the ones from the crystal
+        dbstates = dbStates(self.crys, 0, self.family)
+        mstates = mStates(self.crys, 0, self.family)
+        dim = self.crys.dim
+        Rlist = [np.array(R) for R in itertools.product([-1, 0, 2], repeat=dim)]
+        ind1, ind2, R1, R2, dxlist, dx4list = [], [], [], [], [], []
+        for (idx1, idx2), (Ri, Rf) in itertools.product(itertools.product(range(len(dbstates.iorlist)), repeat=2),
+                                                        itertools.product(Rlist, repeat=2)):
+            db1, db2 = dumbbell(idx1, Ri), dumbbell(idx2, Rf)
+            i1, i2 = dbstates.iorlist[idx1][0], dbstates.iorlist[idx2][0]
+            dx = self.crys.unit2cart(Rf, self.crys.basis[0][i2]) - self.crys.unit2cart(Ri, self.crys.basis[0][i1])
+            self.assertTrue(np.allclose(disp(dbstates, db1, db2), dx))
+            # associative jumps - take the final state from the mixed dumbbells
+            p1 = SdPair(i1, Ri, db1)
+            p2 = SdPair(mstates.iorlist[idx2][0], Rf, dumbbell(idx2, Rf))
+            i2m = mstates.iorlist[idx2][0]
+            dx4 = self.crys.unit2cart(Rf, self.crys.basis[0][i2m]) - self.crys.unit2cart(Ri, self.crys.basis[0][i1])
+            self.assertTrue(np.allclose(disp4(dbstates, mstates, p1, p2), dx4))
+            ind1.append(idx1)
+            ind2.append(idx2)
+            R1.append(Ri)
+            R2.append(Rf)
+            dxlist.append(dx)
+            dx4list.append(dx4)
+        self.assertTrue(np.allclose(disp_array(dbstates, ind1, R1, ind2, R2), dxlist))
+        self.assertTrue(np.allclose(disp_array(dbstates, ind1, R1, ind2, R2, mstates), dx4list))
+
+    def test_getIndex(self):
+        dbstates = dbStates(self.crys, 0, self.family)
+        mstates = mStates(self.crys, 0, self.family)
+        dim = self.crys.dim
+        for idx, (i, o) in enumerate(dbstates.iorlist):
+            # pure dumbbells are found irrespective of the sign of the orientation
+            self.assertEqual(dbstates.getIndex((i, o)), idx)
+            self.assertEqual(dbstates.getIndex((i, -o)), idx)
+            self.assertEqual(dbstates.getIndex((i, o + 1e-10)), idx)
+            self.assertEqual(dbstates.db2ind(dumbbell(idx, np.ones(dim, dtype=int))), idx)
+        for idx, (i, o) in enumerate(mstates.iorlist):
+            self.assertEqual(mstates.getIndex((i, o)), idx)
+            self.assertEqual(mstates.getIndex((i, o - 1e-10)), idx)
+            self.assertEqual(mstates.db2ind(dumbbell(idx, np.ones(dim, dtype=int))), idx)
+        self.assertTrue(np.array_equal(
+            dbstates.getIndices([i for i, o in dbstates.iorlist], np.array([-o for i, o in dbstates.iorlist])),
+            np.arange(len(dbstates.iorlist))))
+        self.assertTrue(np.array_equal(
+            mstates.getIndices([i for i, o in mstates.iorlist], np.array([o for i, o in mstates.iorlist])),
+            np.arange(len(mstates.iorlist))))
+        with self.assertRaises(ValueError):
+            mstates.getIndex((len(self.crys.basis[0]), mstates.iorlist[0][1]))
+        with self.assertRaises(ValueError):
+            dbstates.getIndex((0, np.ones(dim) * 0.37))
+
     def test_mixedjumps(self):
         latt = np.array([[0., 0.5, 0.5], [0.5, 0., 0.5], [0.5, 0.5, 0.]]) * 0.55
         DC_Si = crystal.Crystal(latt, [[np.array([0., 0., 0.]), np.array([0.25, 0.25, 0.25])]], ["Si"])
@@ -188,6 +188,20 @@ class test_vecstars(unittest.TestCase):
             for tup in indToVecStars:
                 self.assertEqual(st, self.vec_stars.vecpos[tup[0]][tup[1]])
 
+        # the index arrays and the packed vectors must hold the same information
+        for states, stateToVecStar, arrays in [
+            (self.vec_stars.starset.complexStates, self.vec_stars.stateToVecStar_pure,
+             self.vec_stars.stateToVecStar_pure_arrays),
+            (self.vec_stars.starset.mixedstates, self.vec_stars.stateToVecStar_mixed,
+             self.vec_stars.stateToVecStar_mixed_arrays)]:
+            ptr, vstarinds, slotinds = arrays
+            for stind, st in enumerate(states):
+                self.assertEqual(list(zip(vstarinds[ptr[stind]:ptr[stind + 1]], slotinds[ptr[stind]:ptr[stind + 1]])),
+                                 stateToVecStar[st])
+        for vs, veclist in enumerate(self.vec_stars.vecvec):
+            self.assertTrue(np.allclose(self.vec_stars.vecvec_array[vs, :len(veclist)], veclist))
+            self.assertTrue(np.allclose(self.vec_stars.vecvec_array[vs, len(veclist):], 0.))
+
     def test_vstar2star (self):
         for vWyckInd, vWyckPos in enumerate(self.vec_stars.vecpos_bare):
             wyckInd = self.vec_stars.vwycktowyck_bare[vWyckInd]
@@ -622,43 +636,47 @@ class test_vecstars(unittest.TestCase):
         self.assertTrue(np.allclose(rate4escape, self.rateExps[4][1]))
         self.assertTrue(np.allclose(rate4expansion, self.rateExps[4][0]))
 
+        # The sparse expansions must hold one matrix per jump type, and contract like the dense tensors
+        for rateExp in self.rateExps:
+            expansion = rateExp[0]
+            dense = np.asarray(expansion)
+            self.assertEqual(len(expansion.matrices), dense.shape[2])
+            for k, mat in enumerate(expansion.matrices):
+                self.assertTrue(np.allclose(mat.toarray(), dense[:, :, k]))
+            x = np.random.rand(dense.shape[2])
+            self.assertTrue(np.allclose(expansion.dot(x), np.dot(dense, x)))
+            # elements and rows are read from the sparse matrices
+            for i, j, k in itertools.product(*[range(n) for n in dense.shape]):
+                self.assertTrue(np.isclose(expansion[i, j, k], dense[i, j, k]))
+            for i, k in itertools.product(range(dense.shape[0]), range(dense.shape[2])):
+                self.assertTrue(np.allclose(expansion[i, :, k], dense[i, :, k]))
+
     def test_tags(self):
         """
         See that the arrays tagging the jumps are produced properly
         """
-        # First let us go through the omega1 jump network.
-        for jt, jlist, jindlist in zip(itertools.count(), self.jnet_1, self.jnet_1_indexed):
-            # indDictlist = self.om1tags[jt]
-            count_dict = defaultdict(int)
-            for (i, j), dx in jindlist:
-                count_dict[i] += 1
-            for key, arr in self.om1tags[jt].items():
-                self.assertEqual(len(arr), count_dict[key])
-
-        for jt, jlist, jindlist in zip(itertools.count(), self.vec_stars.starset.jnet2,
-                                       self.vec_stars.starset.jnet2_ind):
-            # indDictlist = self.om1tags[jt]
-            count_dict = defaultdict(int)
-            for (i, j), dx in jindlist:
-                count_dict[i] += 1
-            for key, arr in self.om2tags[jt].items():
-                self.assertEqual(len(arr), count_dict[key])
-
-        for jt, jlist, jindlist in zip(itertools.count(), self.symjumplist_omega4, self.symjumplist_omega4_indexed):
-            # indDictlist = self.om1tags[jt]
-            count_dict = defaultdict(int)
-            for (i, j), dx in jindlist:
-                count_dict[i] += 1
-            for key, arr in self.om4tags[jt].items():
-                self.assertEqual(len(arr), count_dict[key])
-
-        for jt, jlist, jindlist in zip(itertools.count(), self.symjumplist_omega3, self.symjumplist_omega3_indexed):
-            # indDictlist = self.om1tags[jt]
-            count_dict = defaultdict(int)
-            for (i, j), dx in jindlist:
-                count_dict[i] += 1
-            for key, arr in self.om3tags[jt].items():
-                self.assertEqual(len(arr), count_dict[key])
+        Ncomp = len(self.crys_stars.complexStates)
+        Nstates = Ncomp + len(self.crys_stars.mixedstates)
+        # The number of jumps out of each initial state must be on the diagonal of the tags, and (jtag @ x)[IS] must
+        # be the sum of x[IS] - x[FS] over those jumps.
+        x = np.random.rand(Nstates)
+        for jnet_indexed, jtags, initoffset, finoffset in [(self.jnet_1_indexed, self.om1tags, 0, 0),
+                                                           (self.vec_stars.starset.jnet2_ind, self.om2tags, Ncomp, Ncomp),
+                                                           (self.symjumplist_omega4_indexed, self.om4tags, 0, Ncomp),
+                                                           (self.symjumplist_omega3_indexed, self.om3tags, Ncomp, 0)]:
+            for jindlist, jtag in zip(jnet_indexed, jtags):
+                count_dict = defaultdict(int)
+                sum_dict = defaultdict(float)
+                for (i, j), dx in jindlist:
+                    if i + initoffset == j + finoffset:
+                        continue
+                    count_dict[i + initoffset] += 1
+                    sum_dict[i + initoffset] += x[i + initoffset] - x[j + finoffset]
+                diag = jtag.diagonal()
+                jx = jtag.dot(x)
+                for IS in range(Nstates):
+                    self.assertEqual(diag[IS], count_dict[IS])
+                    self.assertAlmostEqual(jx[IS], sum_dict[IS])
 
     def test_GFstars(self):
         # Check that every possible pair has been considered in the gfstarsets
@@ -710,6 +728,23 @@ class test_vecstars(unittest.TestCase):
                 self.assertEqual(count, len(GFstarset_pure[listind]), msg="\n{}\n{}".format(snewlist,
                                                                                             GFstarset_pure[listind]))
 
+    def test_GFexpansion(self):
+        # The expansion from the symmetry reduced connections must be the same as the sum over all pairs of states.
+        # (The lower triangle is copied over from the upper one in GFexpansion.)
+        GFstarset_pure, GFPureStarInd, GFexpansion_pure = self.vec_stars.GFexpansion()
+        GFexpansion_test = np.zeros_like(GFexpansion_pure)
+        for i in range(self.vec_stars.Nvstars_pure):
+            for j in range(i, self.vec_stars.Nvstars_pure):
+                for si, vi in zip(self.vec_stars.vecpos[i], self.vec_stars.vecvec[i]):
+                    for sj, vj in zip(self.vec_stars.vecpos[j], self.vec_stars.vecvec[j]):
+                        try:
+                            ds = si ^ sj
+                        except ArithmeticError:
+                            continue
+                        GFexpansion_test[i, j, GFPureStarInd[ds]] += np.dot(vi, vj)
+                GFexpansion_test[j, i, :] = GFexpansion_test[i, j, :]
+        self.assertTrue(np.allclose(GFexpansion_pure, GFexpansion_test))
+
     def test_order(self):
         "test that we have the origin spectator states at the begining"
         dx_list = []
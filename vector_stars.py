@@ -10,6 +10,79 @@ from stars import *
 from functools import reduce
 import itertools
 import time
+from scipy.sparse import csr_matrix
+
+
+class SparseExpansion(object):
+    """
+    Sparse storage for the expansions of the rates and the Green's function in the vector star basis - tensors of shape
+    (N1, N2, Nk), where the last index runs over the jump types (or GF stars), and each jump type only couples a few
+    vector stars.
+    The tensor is stored as one sparse (N1 x N2) CSR matrix for every index along the last axis, in the list matrices.
+    It can still be read like the dense array - indexed, or converted with np.asarray - while dot contracts the last
+    axis without ever forming the dense tensor.
+    """
+
+    ndim = 3
+
+    def __init__(self, shape, rows, cols, inds, values, threshold=1e-8):
+        """
+        :param shape: (N1, N2, Nk) - the shape of the dense tensor
+        :param rows, cols, inds, values: the non-zero entries of the tensor - values at the same (row, col, ind) are
+        summed up.
+        :param threshold: summed up entries smaller than this in magnitude are dropped (same as zeroclean).
+        """
+        self.shape = tuple(shape)
+        rows, cols, inds = (np.asarray(arr, dtype=int) for arr in (rows, cols, inds))
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(inds, kind="stable")
+        ptr = np.searchsorted(inds[order], np.arange(self.shape[2] + 1))
+        self.matrices = []
+        for k in range(self.shape[2]):
+            entries = order[ptr[k]:ptr[k + 1]]
+            mat = csr_matrix((values[entries], (rows[entries], cols[entries])), shape=self.shape[:2])
+            mat.data[np.abs(mat.data) < threshold] = 0.
+            mat.eliminate_zeros()
+            self.matrices.append(mat)
+
+    @property
+    def nnz(self):
+        return sum(mat.nnz for mat in self.matrices)
+
+    def dot(self, x):
+        """
+        Contracts the last axis with the vector x - the same as np.dot(tensor, x) for the dense tensor.
+        """
+        total = csr_matrix(self.shape[:2])
+        for xk, mat in zip(np.asarray(x), self.matrices):
+            if xk != 0 and mat.nnz > 0:
+                total = total + xk * mat
+        return total.toarray()
+
+    def toarray(self):
+        out = np.zeros(self.shape)
+        for k, mat in enumerate(self.matrices):
+            coo = mat.tocoo()
+            out[coo.row, coo.col, k] = coo.data
+        return out
+
+    def __array__(self, dtype=None):
+        return self.toarray() if dtype is None else self.toarray().astype(dtype)
+
+    def __getitem__(self, ind):
+        """
+        Single elements and rows (ind = (i, j, k) or (i, slice, k)) are read from the sparse matrices; anything else
+        goes through the dense tensor.
+        """
+        if isinstance(ind, tuple) and len(ind) == 3 and isinstance(ind[2], (int, np.integer)):
+            mat = self.matrices[ind[2]]
+            if isinstance(ind[0], (int, np.integer)):
+                if isinstance(ind[1], (int, np.integer)):
+                    return mat[ind[0], ind[1]]
+                return mat.getrow(ind[0] % self.shape[0]).toarray()[0][ind[1]]
+            return mat.toarray()[ind[:2]]
+        return self.toarray()[ind]
+
 
 class vectorStars(VectorStarSet):
     """
@@ -164,6 +237,16 @@ class vectorStars(VectorStarSet):
             for IndOfState, state in enumerate(crStar):
                 self.stateToVecStar_mixed[state].append((IndOfStar + self.Nvstars_pure, IndOfState))
 
+        # The same information as arrays - the vectors of all the vector stars packed into a single zero-padded array,
+        # and the vector stars each state belongs to (with its position in them) in CSR form over the state indices.
+        maxlen = max([len(veclist) for veclist in self.vecvec], default=0)
+        self.vecvec_array = np.zeros((self.Nvstars, maxlen, self.crys.dim))
+        for vs, veclist in enumerate(self.vecvec):
+            self.vecvec_array[vs, :len(veclist)] = veclist
+        self.stateToVecStar_pure_arrays = self._vecstararrays(range(self.Nvstars_pure), len(starset.complexStates))
+        self.stateToVecStar_mixed_arrays = self._vecstararrays(range(self.Nvstars_pure, self.Nvstars),
+                                                               len(starset.mixedstates))
+
         self.stateToVecStar_bare = defaultdict(list)
         if len(self.vecpos_bare) > 0:
             for IndOfStar, crStar in enumerate(self.vecpos_bare):
@@ -191,6 +274,49 @@ class vectorStars(VectorStarSet):
             # The starindex is already with respect to the total number of (pure+mixed) crystal stars - see stars.py.
             self.vstar2star[vstindex + self.Nvstars_pure] = starindex
 
+    def _vecstararrays(self, vstars, Nstates):
+        """
+        Indexes the given vector stars by the states in them.
+        :param vstars: the vector stars to index - all must be pure, or all mixed.
+        :param Nstates: the number of complex or mixed states in the starset.
+        :return: ptr, vstarinds, slotinds - the vector stars that state i belongs to are vstarinds[ptr[i]:ptr[i+1]],
+        and the state is at positions slotinds[ptr[i]:ptr[i+1]] in them - in the same order as in stateToVecStar_*.
+        """
+        rows = np.array([ind for vs in vstars for ind in self.vecpos_indexed[vs]], dtype=int)
+        vstarinds = np.array([vs for vs in vstars for ind in self.vecpos_indexed[vs]], dtype=int)
+        slotinds = np.array([slot for vs in vstars for slot in range(len(self.vecpos_indexed[vs]))], dtype=int)
+        order = np.argsort(rows, kind="stable")
+        ptr = np.searchsorted(rows[order], np.arange(Nstates + 1))
+        return ptr, vstarinds[order], slotinds[order]
+
+    @staticmethod
+    def _vecstarpairs(rows1, vecstararrays1, rows2, vecstararrays2):
+        """
+        Pairs up every vector star entry of the state rows1[n] with every vector star entry of the state rows2[n], for
+        all n - in the same order as nested loops over n and then the two stateToVecStar lists would.
+        :param vecstararrays1, vecstararrays2: the vector star index arrays (stateToVecStar_*_arrays) of the states
+        that rows1 and rows2 index into.
+        :return: n, (vs1, slot1), (vs2, slot2) - for every pair, the index n it comes from, and the vector stars and
+        positions in them of the two states.
+        """
+        ptr1, vstarinds1, slotinds1 = vecstararrays1
+        ptr2, vstarinds2, slotinds2 = vecstararrays2
+        n, entries1 = StarSet._expand(ptr1, rows1)
+        pairs, entries2 = StarSet._expand(ptr2, rows2[n])
+        n, entries1 = n[pairs], entries1[pairs]
+        return n, (vstarinds1[entries1], slotinds1[entries1]), (vstarinds2[entries2], slotinds2[entries2])
+
+    @staticmethod
+    def _staterows(table, states):
+        """
+        The rows of a list of states in a StateTable - raises ValueError if any of them is not in it.
+        """
+        keys = [st.key for st in states]
+        rows = table.getindices(np.array(keys) if len(keys) > 0 else np.zeros(0, dtype=np.int64))
+        if np.any(rows < 0):
+            raise ValueError("state of a jump not found in the starset")
+        return rows
+
     def genGFstarset(self):
         """
         Makes symmetrically grouped connections between the states in the starset, to be used as GFstarset for the pure
@@ -201,60 +327,68 @@ class vectorStars(VectorStarSet):
         the iorlist
         """
         complexStates = self.starset.complexStates
-        mixedstates = self.starset.mixedstates
-        # Connect the states - major bottleneck
-        connectset= set([])
+        # Connect the states. The connections, as well as their contributions to the GF expansion, are invariant
+        # under the group operations. So we only need the connections starting from the representative state of every
+        # crystal star - the rest are obtained by symmetry.
+        # Each entry (st1, st2) of connect_ComplexPair stands for all the len(star) symmetric images of the pair,
+        # where star is the crystal star of the representative st1.
+        connectlist = []
         self.connect_ComplexPair = {}
+        rows1, rows2, weights = [], [], []
         start = time.time()
-        for i, st1 in enumerate(complexStates):
-            for j, st2 in enumerate(complexStates[:i+1]):
-                try:
-                    s = st1 ^ st2
-                except:
-                    continue
-                connectset.add(s)
-                connectset.add(-s)
-                # if i==j and not s==-s:
-                #     raise ValueError("Same state connection producing different connector")
+        for star, indstar in zip(self.starset.stars[:self.starset.mixedstartindex],
+                                 self.starset.starindexed[:self.starset.mixedstartindex]):
+            st1, i = star[0], indstar[0]
+            # Only states with the solute at the same location can be connected - find them from the state table
+            # arrays instead of trying out every pair.
+            samesolute = np.nonzero((complexStates.i_s == complexStates.i_s[i]) &
+                                    np.all(complexStates.R_s == complexStates.R_s[i], axis=1))[0]
+            for j in samesolute:
+                st2 = complexStates[j]
+                s = st1 ^ st2
+                connectlist.append(s)
                 self.connect_ComplexPair[(st1, st2)] = s
-                self.connect_ComplexPair[(st2, st1)] = -s
+                rows1.append(i)
+                rows2.append(j)
+                weights.append(len(star))
         print("\tComplex connections creation time: {}".format(time.time() - start))
 
         # Now group the connections
         GFstarset_pure=[]
         GFPureStarInd = {}
         start = time.time()
-        for s in connectset:
+        for s in connectlist:
             if s in GFPureStarInd:
                 continue
-            connectlist = []
+            connectstar = []
             for gdumb in self.starset.pdbcontainer.G:
                 snew = s.gop(self.starset.pdbcontainer, gdumb, pure=True)
                 # Bring the dumbbell of the initial state to the origin
                 # snew = snew.shift() No need for shifting. Automatically done in gop function.
                 if snew in GFPureStarInd:
                     continue
-
-                if snew not in connectset:
-                    raise TypeError("connector list is not closed under symmetry operations for the complex starset.{}"
-                                    .format(snew))
-
                 dx = disp(self.starset.pdbcontainer, snew.state1, snew.state2)
                 ind1 = self.starset.pdbcontainer.db2ind(snew.state1)
                 # db2ind does not care about which unit cell the dumbbell is at
                 ind2 = self.starset.pdbcontainer.db2ind(snew.state2)
                 tup = ((ind1, ind2), dx.copy())
-                connectlist.append(tup)
+                connectstar.append(tup)
                 GFPureStarInd[snew] = len(GFstarset_pure)
-            GFstarset_pure.append(connectlist)
+            GFstarset_pure.append(connectstar)
         print("\tComplex connections symmetry grouping time: {}".format(time.time() - start))
-        print("No. of pure dumbbell connections: {}".format(len(connectset)))
+        print("No. of pure dumbbell connections: {}".format(len(GFPureStarInd)))
+        # The connections in connect_ComplexPair as arrays - the indices of the two states, the number of symmetric
+        # images of the pair and the GF star of the connection.
+        self.connect_ComplexPair_indexed = (np.array(rows1, dtype=int), np.array(rows2, dtype=int),
+                                            np.array(weights, dtype=int),
+                                            np.array([GFPureStarInd[s] for s in connectlist], dtype=int))
 
         return GFstarset_pure, GFPureStarInd
 
     def GFexpansion(self):
         """
         carries out the expansion of the Green's function in the basis of the vector stars.
+        The expansion is returned as a SparseExpansion of shape (Nvstars_pure, Nvstars_pure, len(GFstarset_pure)).
         """
         print("building GF starsets")
         start = time.time()
@@ -264,30 +398,49 @@ class vectorStars(VectorStarSet):
         Nvstars_pure = self.Nvstars_pure
         Nvstars_mixed = self.Nvstars - self.Nvstars_pure
 
-        GFexpansion_pure = np.zeros((Nvstars_pure, Nvstars_pure, len(GFstarset_pure)))
         start = time.time()
-        for ((st1, st2), s) in self.connect_ComplexPair.items():
-            # get the vector stars in which the initial state belongs
-            i = self.stateToVecStar_pure[st1]
-            # get the vector stars in which the final state belongs
-            j = self.stateToVecStar_pure[st2]
-            k = GFPureStarInd[s]
-            for (indOfStar_i, indOfState_i) in i:
-                for (indOfStar_j, indOfState_j) in j:
-                    GFexpansion_pure[indOfStar_i, indOfStar_j, k] += \
-                        np.dot(self.vecvec[indOfStar_i][indOfState_i], self.vecvec[indOfStar_j][indOfState_j])
-
+        rows1, rows2, weights, GFstarinds = self.connect_ComplexPair_indexed
+        # Pair up every vector star entry of the initial state of each connection with every vector star entry of its
+        # final state.
+        conn, (vs1, slot1), (vs2, slot2) = self._vecstarpairs(rows1, self.stateToVecStar_pure_arrays,
+                                                              rows2, self.stateToVecStar_pure_arrays)
+        # Each pair stands for all its symmetric images, which contribute equally - one for each state in the star
+        # of its initial state.
+        vdots = weights[conn] * np.einsum("ij,ij->i", self.vecvec_array[vs1, slot1], self.vecvec_array[vs2, slot2])
+        # Only the upper triangle is kept - the lower one is made symmetric to it.
+        upper, strict = vs1 <= vs2, vs1 < vs2
+        GFexpansion_pure = SparseExpansion((Nvstars_pure, Nvstars_pure, len(GFstarset_pure)),
+                                           np.concatenate((vs1[upper], vs2[strict])),
+                                           np.concatenate((vs2[upper], vs1[strict])),
+                                           np.concatenate((GFstarinds[conn][upper], GFstarinds[conn][strict])),
+                                           np.concatenate((vdots[upper], vdots[strict])))
 
         print("Built Complex GF expansions: {}".format(time.time() - start))
 
-        # symmetrize
-        for i in range(Nvstars_pure):
-            for j in range(0, i):
-                GFexpansion_pure[i, j, :] = GFexpansion_pure[j, i, :]
-
-        return (GFstarset_pure, GFPureStarInd, zeroclean(GFexpansion_pure))
+        return (GFstarset_pure, GFPureStarInd, GFexpansion_pure)
 
     # See group meeting update slides of sept 10th to see how this works.
+    def _repbias(self, jumps, table, vecstararrays, dispfunc):
+        """
+        Finds the contributions of jumps to the bias expansions of the vector stars whose representative state is the
+        initial state of the jump.
+        :param jumps: list of (jump type, jump) tuples
+        :param table: StateTable (complexStates or mixedstates) that the initial states of the jumps are in.
+        :param vecstararrays: the vector stars of the states in table - stateToVecStar_pure_arrays or
+        stateToVecStar_mixed_arrays
+        :param dispfunc: function that gives the displacement of a jump
+        :return: vs, k, geom_bias - the vector star, jump type and bias contribution of every such (jump, vector star)
+        pair, in the order of the jumps.
+        """
+        ptr, vstarinds, slotinds = vecstararrays
+        jinds, entries = StarSet._expand(ptr, self._staterows(table, [j.state1 for k, j in jumps]))
+        isrep = slotinds[entries] == 0
+        jinds, vs = jinds[isrep], vstarinds[entries[isrep]]
+        dx = np.array([dispfunc(jumps[jind][1]) for jind in jinds], dtype=float).reshape((len(jinds), self.crys.dim))
+        starsizes = np.array([len(star) for star in self.vecpos], dtype=int)
+        geom_bias = np.einsum("ij,ij->i", self.vecvec_array[vs, 0], dx) * starsizes[vs]
+        return vs, np.array([jumps[jind][0] for jind in jinds], dtype=int), geom_bias
+
     def biasexpansion(self, jumpnetwork_omega1, jumpnetwork_omega2, jumptype, jumpnetwork_omega34):
         """
         Returns an expansion of the bias vector in terms of the displacements produced by jumps.
@@ -299,8 +452,6 @@ class vectorStars(VectorStarSet):
             bias0, bias1, bias2, bias4 and bias3 expansions, one each for solute and solvent
             Note - bias0 for solute makes no sense, so we return only for solvent.
         """
-        z = np.zeros(self.crys.dim, dtype=float)
-
         biasBareExpansion = np.zeros((len(self.vecpos_bare), len(self.starset.jnet0)))
         # Expansion of pure dumbbell initial state bias vectors and complex state bias vectors
         bias0expansion = np.zeros((self.Nvstars_pure, len(self.starset.jumpindices)))
@@ -317,110 +468,58 @@ class vectorStars(VectorStarSet):
         bias3expansion_solvent = np.zeros((self.Nvstars - self.Nvstars_pure, len(jumpnetwork_omega34)))
         bias3expansion_solute = np.zeros((self.Nvstars - self.Nvstars_pure, len(jumpnetwork_omega34)))
 
+        # Only the jumps out of the representative (first) state of a vector star contribute to its bias expansion,
+        # with the bias along its first vector scaled up by the number of states in it. So instead of comparing every
+        # jump with every vector star, we look up the vector stars that each initial state is the representative of.
+
         # First, let's build the periodic bias expansions
-        for i, star, vectors in zip(itertools.count(), self.vecpos_bare, self.vecvec_bare):
-            for k, jumplist in zip(itertools.count(), self.starset.jnet0):
-                for j in jumplist:
-                    IS = j.state1
-                    if star[0] == IS:
+        for k, jumplist in zip(itertools.count(), self.starset.jnet0):
+            for j in jumplist:
+                for i, slot in self.stateToVecStar_bare.get(j.state1, []):
+                    if slot == 0:
                         dx = disp(self.starset.pdbcontainer, j.state1, j.state2)
-                        geom_bias_solvent = np.dot(vectors[0], dx) * len(star)
-                        biasBareExpansion[i, k] += geom_bias_solvent
-
-        for i, purestar, vectors in zip(itertools.count(), self.vecpos[:self.Nvstars_pure],
-                                        self.vecvec[:self.Nvstars_pure]):
-            # iterates over the rows of the matrix
-            # First construct bias1expansion and bias0expansion
-            # This contains the expansion of omega_0 jumps and omega_1 type jumps
-            # See slides of Sept. 10 for diagram.
-            # omega_0 : pure -> pure
-            # omega_1 : complex -> complex
-            for k, jumplist, jt in zip(itertools.count(), jumpnetwork_omega1, jumptype):
-                # iterates over the columns of the matrix
-                for j in jumplist:
-                    IS = j.state1
-                    # for i, states, vectors in zip(itertools.count(),self.vecpos,self.vecvec):
-                    if purestar[0] == IS:
-                        # sees if there is a jump of the kth type with purestar[0] as the initial state.
-                        dx = disp(self.starset.pdbcontainer, j.state1, j.state2)
-                        dx_solute = z
-                        dx_solvent = dx.copy()  # just for clarity that the solvent mass transport is dx itself.
-
-                        geom_bias_solvent = np.dot(vectors[0], dx_solvent) * len(
-                            purestar)  # should this be square root? check with tests.
-                        geom_bias_solute = np.dot(vectors[0], dx_solute) * len(purestar)
-
-                        bias1expansion_solvent[
-                            i, k] += geom_bias_solvent  # this is contribution of kth_type of omega_1 jumps, to the bias
-                        bias1expansion_solute[i, k] += geom_bias_solute
-                        # vector along v_i
-                        # so to find the total bias along v_i due to omega_1 jumps, we sum over k
-                        bias0expansion[i, jt] += geom_bias_solvent  # These are the contributions of the omega_0 jumps
-                        # to the bias vector along v_i, for bare dumbbells
-                        # so to find the total bias along v_i, we sum over k.
-
-            # Next, omega_4: complex -> mixed
-            for k, jumplist in zip(itertools.count(), jumpnetwork_omega34):
-                for j in jumplist[::2]:  # Start from the first element, skip every other
-                    IS = j.state1
-                    if not j.state2.is_zero(self.starset.mdbcontainer):
-                        # check if initial state is mixed dumbbell -> then skip - it's omega_3
-                        raise TypeError ("final state not origin in mixed dbcontainer for omega4")
-                    # for i, states, vectors in zip(itertools.count(),self.vecpos,self.vecvec):
-                    if purestar[0] == IS:
-                        dx = disp4(self.starset.pdbcontainer, self.starset.mdbcontainer, j.state1, j.state2)
-                        dx_solute = z  # self.starset.mdbcontainer.iorlist[j.state2.db.iorind][1] / 2.
-                        dx_solvent = dx  # - self.starset.mdbcontainer.iorlist[j.state2.db.iorind][1] / 2.
-                        geom_bias_solute = np.dot(vectors[0], dx_solute) * len(purestar)
-                        geom_bias_solvent = np.dot(vectors[0], dx_solvent) * len(purestar)
-                        bias4expansion_solute[i, k] += geom_bias_solute
-                        # this is contribution of omega_4 jumps, to the bias
-                        bias4expansion_solvent[i, k] += geom_bias_solvent
-                        # vector along v_i
-                        # So, to find the total bias along v_i due to omega_4 jumps, we sum over k.
+                        biasBareExpansion[i, k] += np.dot(self.vecvec_bare[i][0], dx) * len(self.vecpos_bare[i])
+
+        # omega_0 : pure -> pure and omega_1 : complex -> complex (See slides of Sept. 10 for diagram.)
+        # The solute does not move in these jumps, so their solute bias expansions stay zero.
+        vs, k, geom_bias = self._repbias([(k, j) for k, jumplist in enumerate(jumpnetwork_omega1) for j in jumplist],
+                                         self.starset.complexStates, self.stateToVecStar_pure_arrays,
+                                         lambda j: disp(self.starset.pdbcontainer, j.state1, j.state2))
+        np.add.at(bias1expansion_solvent, (vs, k), geom_bias)
+        # These are the contributions of the omega_0 jumps to the bias vector along v_i, for bare dumbbells
+        np.add.at(bias0expansion, (vs, np.asarray(jumptype, dtype=int)[k]), geom_bias)
+
+        # Next, omega_4: complex -> mixed
+        for jumplist in jumpnetwork_omega34:
+            for j in jumplist[::2]:  # Start from the first element, skip every other
+                if not j.state2.is_zero(self.starset.mdbcontainer):
+                    raise TypeError("final state not origin in mixed dbcontainer for omega4")
+        vs, k, geom_bias = self._repbias([(k, j) for k, jumplist in enumerate(jumpnetwork_omega34)
+                                          for j in jumplist[::2]],
+                                         self.starset.complexStates, self.stateToVecStar_pure_arrays,
+                                         lambda j: disp4(self.starset.pdbcontainer, self.starset.mdbcontainer,
+                                                         j.state1, j.state2))
+        np.add.at(bias4expansion_solvent, (vs, k), geom_bias)
 
         # Now, construct the bias2expansion and bias3expansion
-        for i, mixedstar, vectors in zip(itertools.count(), self.vecpos[self.Nvstars_pure:],
-                                         self.vecvec[self.Nvstars_pure:]):
-            # First construct bias2expansion
-            # omega_2 : mixed -> mixed
-            for k, jumplist in zip(itertools.count(), jumpnetwork_omega2):
-                for j in jumplist:
-                    IS = j.state1
-                    # for i, states, vectors in zip(itertools.count(),self.vecpos,self.vecvec):
-                    if mixedstar[0] == IS:
-                        dx = disp(self.starset.mdbcontainer, j.state1, j.state2)
-                        dx_solute = dx  # + self.starset.mdbcontainer.iorlist[j.state2.db.iorind][1] / 2. - \
-                                    # self.starset.mdbcontainer.iorlist[j.state1.db.iorind][1] / 2.
-                        dx_solvent = dx  #- self.starset.mdbcontainer.iorlist[j.state2.db.iorind][1] / 2. + \
-                                     #self.starset.mdbcontainer.iorlist[j.state1.db.iorind][1] / 2.
-                        geom_bias_solute = np.dot(vectors[0], dx_solute) * len(mixedstar)
-                        geom_bias_solvent = np.dot(vectors[0], dx_solvent) * len(mixedstar)
-                        bias2expansion_solute[i, k] += geom_bias_solute
-                        bias2expansion_solvent[i, k] += geom_bias_solvent
-
-            # Next, omega_3: mixed -> complex
-            for k, jumplist in zip(itertools.count(), jumpnetwork_omega34):
-                for j in jumplist[1::2]:  # start from the second element, skip every other
-                    if not j.state1.is_zero(self.starset.mdbcontainer):
-                        # check if initial state is not a mixed state -> skip if not mixed
-                        print(self.starset.mdbcontainer.iorlist)
-                        print(j.state1)
-                        raise TypeError("initial state not origin in mdbcontainer")
-                    # for i, states, vectors in zip(itertools.count(),self.vecpos,self.vecvec):
-                    if mixedstar[0] == j.state1:
-                        try:
-                            dx = -disp4(self.starset.pdbcontainer, self.starset.mdbcontainer, j.state2, j.state1)
-                        except IndexError:
-                            print(len(self.starset.pdbcontainer.iorlist), len(self.starset.mdbcontainer.iorlist))
-                            print(j.state2.db.iorind, j.state1.db.iorind)
-                            raise IndexError("list index out of range")
-                        dx_solute = z  # -self.starset.mdbcontainer.iorlist[j.state1.db.iorind][1] / 2.
-                        dx_solvent = dx  # + self.starset.mdbcontainer.iorlist[j.state1.db.iorind][1] / 2.
-                        geom_bias_solute = np.dot(vectors[0], dx_solute) * len(mixedstar)
-                        geom_bias_solvent = np.dot(vectors[0], dx_solvent) * len(mixedstar)
-                        bias3expansion_solute[i, k] += geom_bias_solute
-                        bias3expansion_solvent[i, k] += geom_bias_solvent
+        # omega_2 : mixed -> mixed - the solute moves along with the solvent.
+        vs, k, geom_bias = self._repbias([(k, j) for k, jumplist in enumerate(jumpnetwork_omega2) for j in jumplist],
+                                         self.starset.mixedstates, self.stateToVecStar_mixed_arrays,
+                                         lambda j: disp(self.starset.mdbcontainer, j.state1, j.state2))
+        np.add.at(bias2expansion_solute, (vs - self.Nvstars_pure, k), geom_bias)
+        np.add.at(bias2expansion_solvent, (vs - self.Nvstars_pure, k), geom_bias)
+
+        # Next, omega_3: mixed -> complex
+        for jumplist in jumpnetwork_omega34:
+            for j in jumplist[1::2]:  # start from the second element, skip every other
+                if not j.state1.is_zero(self.starset.mdbcontainer):
+                    raise TypeError("initial state not origin in mdbcontainer")
+        vs, k, geom_bias = self._repbias([(k, j) for k, jumplist in enumerate(jumpnetwork_omega34)
+                                          for j in jumplist[1::2]],
+                                         self.starset.mixedstates, self.stateToVecStar_mixed_arrays,
+                                         lambda j: -disp4(self.starset.pdbcontainer, self.starset.mdbcontainer,
+                                                          j.state2, j.state1))
+        np.add.at(bias3expansion_solvent, (vs - self.Nvstars_pure, k), geom_bias)
 
         if len(self.vecpos_bare) == 0:
             return zeroclean(bias0expansion), (zeroclean(bias1expansion_solute), zeroclean(bias1expansion_solvent)), \
@@ -437,81 +536,84 @@ class vectorStars(VectorStarSet):
         """
         Implements expansion of the jump rates in terms of the basis function of the vector stars.
         (Note to self) - Refer to earlier notes for details.
+        The expansions are returned as SparseExpansions, one sparse matrix per jump type, and the escapes as dense
+        (Nvstars x Njumptypes) arrays.
         """
         # See my slides of Sept. 10 for diagram
-        rate0expansion = np.zeros((self.Nvstars_pure, self.Nvstars_pure, len(self.starset.jnet0)))
-        rate1expansion = np.zeros((self.Nvstars_pure, self.Nvstars_pure, len(jumpnetwork_omega1)))
-        rate0escape = np.zeros((self.Nvstars_pure, len(self.starset.jumpindices)))
-        rate1escape = np.zeros((self.Nvstars_pure, len(jumpnetwork_omega1)))
+        Nvstars_mixed = self.Nvstars - self.Nvstars_pure
+        complexStates, mixedstates = self.starset.complexStates, self.starset.mixedstates
+        purearrays, mixedarrays = self.stateToVecStar_pure_arrays, self.stateToVecStar_mixed_arrays
+        vecs = self.vecvec_array
 
-        # First, we do the rate1 and rate0 expansions
-        for k, jumplist, jt in zip(itertools.count(), jumpnetwork_omega1, jumptype):
-            for jmp in jumplist:
-                # Get the vector star indices for the initial and final states of the jumps
-                indlist1 = self.stateToVecStar_pure[jmp.state1]
-                indlist2 = self.stateToVecStar_pure[jmp.state2]
-                # indlists contain tuples of the form (IndOfVstar, IndInVstar)
-                for tup1 in indlist1:
-                    # print(tup1)
-                    rate0escape[tup1[0], jt] -= np.dot(self.vecvec[tup1[0]][tup1[1]], self.vecvec[tup1[0]][tup1[1]])
-                    rate1escape[tup1[0], k] -= np.dot(self.vecvec[tup1[0]][tup1[1]], self.vecvec[tup1[0]][tup1[1]])
-                    for tup2 in indlist2:
-                        rate0expansion[tup1[0], tup2[0], jt] += np.dot(self.vecvec[tup1[0]][tup1[1]],
-                                                                       self.vecvec[tup2[0]][tup2[1]])
-
-                        rate1expansion[tup1[0], tup2[0], k] += np.dot(self.vecvec[tup1[0]][tup1[1]],
-                                                                      self.vecvec[tup2[0]][tup2[1]])
+        def escapes(rows, vecstararrays):
+            # every vector star entry of the given states, with the squared length of its vector
+            n, entries = StarSet._expand(vecstararrays[0], rows)
+            vs, slot = vecstararrays[1][entries], vecstararrays[2][entries]
+            return n, vs, np.einsum("ij,ij->i", vecs[vs, slot], vecs[vs, slot])
 
-        # Next, we expand the omega3 an omega4 rates
-        rate4expansion = np.zeros((self.Nvstars_pure, self.Nvstars - self.Nvstars_pure, len(jumpnetwork_omega34)))
-        rate3expansion = np.zeros((self.Nvstars - self.Nvstars_pure, self.Nvstars_pure, len(jumpnetwork_omega34)))
-        rate3escape = np.zeros((self.Nvstars - self.Nvstars_pure, len(jumpnetwork_omega34)))
-        rate4escape = np.zeros((self.Nvstars_pure, len(jumpnetwork_omega34)))
+        def vdots(rows1, vecstararrays1, rows2, vecstararrays2):
+            n, (vs1, slot1), (vs2, slot2) = self._vecstarpairs(rows1, vecstararrays1, rows2, vecstararrays2)
+            return n, vs1, vs2, np.einsum("ij,ij->i", vecs[vs1, slot1], vecs[vs2, slot2])
+
+        # The expansions are sparse, and are stored as SparseExpansions. All the (vector star, vector star, jump)
+        # entries are gathered at once from the indices of the initial and final states of the jumps.
 
-        for k, jumplist in enumerate(jumpnetwork_omega34):
-            for jmp in jumplist[::2]:  # iterate only through the omega4 jumps, the negatives are omega3
+        # First, we do the rate1 and rate0 expansions
+        jumps = [(k, jmp) for k, jumplist in enumerate(jumpnetwork_omega1) for jmp in jumplist]
+        k1 = np.array([k for k, jmp in jumps], dtype=int)
+        jt = np.asarray(jumptype, dtype=int)
+        rows1 = self._staterows(complexStates, [jmp.state1 for k, jmp in jumps])
+        rows2 = self._staterows(complexStates, [jmp.state2 for k, jmp in jumps])
 
-                indlist1 = self.stateToVecStar_pure[jmp.state1]  # The initial state is a complex in omega4
-                indlist2 = self.stateToVecStar_mixed[jmp.state2]  # The final state is a mixed dumbbell in omega4
+        rate0escape = np.zeros((self.Nvstars_pure, len(self.starset.jumpindices)))
+        rate1escape = np.zeros((self.Nvstars_pure, len(jumpnetwork_omega1)))
+        n, vs, vsq = escapes(rows1, purearrays)
+        np.add.at(rate0escape, (vs, jt[k1[n]]), -vsq)
+        np.add.at(rate1escape, (vs, k1[n]), -vsq)
 
-                for tup1 in indlist1:
-                    rate4escape[tup1[0], k] -= np.dot(self.vecvec[tup1[0]][tup1[1]], self.vecvec[tup1[0]][tup1[1]])
-                for tup2 in indlist2:
-                    rate3escape[tup2[0] - self.Nvstars_pure, k] -= np.dot(self.vecvec[tup2[0]][tup2[1]],
-                                                                          self.vecvec[tup2[0]][tup2[1]])
+        n, vs1, vs2, vd = vdots(rows1, purearrays, rows2, purearrays)
+        rate0expansion = SparseExpansion((self.Nvstars_pure, self.Nvstars_pure, len(self.starset.jnet0)),
+                                         vs1, vs2, jt[k1[n]], vd)
+        rate1expansion = SparseExpansion((self.Nvstars_pure, self.Nvstars_pure, len(jumpnetwork_omega1)),
+                                         vs1, vs2, k1[n], vd)
 
-                for tup1 in indlist1:
-                    for tup2 in indlist2:
+        # Next, we expand the omega3 an omega4 rates
+        # iterate only through the omega4 jumps, the negatives are omega3
+        jumps = [(k, jmp) for k, jumplist in enumerate(jumpnetwork_omega34) for jmp in jumplist[::2]]
+        k4 = np.array([k for k, jmp in jumps], dtype=int)
+        rows1 = self._staterows(complexStates, [jmp.state1 for k, jmp in jumps])  # The initial state is a complex
+        rows2 = self._staterows(mixedstates, [jmp.state2 for k, jmp in jumps])  # The final state is a mixed dumbbell
 
-                        rate4expansion[tup1[0], tup2[0] - self.Nvstars_pure, k] += np.dot(self.vecvec[tup1[0]][tup1[1]],
-                                                                                          self.vecvec[tup2[0]][tup2[1]])
+        rate3escape = np.zeros((Nvstars_mixed, len(jumpnetwork_omega34)))
+        rate4escape = np.zeros((self.Nvstars_pure, len(jumpnetwork_omega34)))
+        n, vs, vsq = escapes(rows1, purearrays)
+        np.add.at(rate4escape, (vs, k4[n]), -vsq)
+        n, vs, vsq = escapes(rows2, mixedarrays)
+        np.add.at(rate3escape, (vs - self.Nvstars_pure, k4[n]), -vsq)
 
-                        rate3expansion[tup2[0] - self.Nvstars_pure, tup1[0], k] += np.dot(self.vecvec[tup1[0]][tup1[1]],
-                                                                                          self.vecvec[tup2[0]][tup2[1]])
+        n, vs1, vs2, vd = vdots(rows1, purearrays, rows2, mixedarrays)
+        rate4expansion = SparseExpansion((self.Nvstars_pure, Nvstars_mixed, len(jumpnetwork_omega34)),
+                                         vs1, vs2 - self.Nvstars_pure, k4[n], vd)
+        rate3expansion = SparseExpansion((Nvstars_mixed, self.Nvstars_pure, len(jumpnetwork_omega34)),
+                                         vs2 - self.Nvstars_pure, vs1, k4[n], vd)
 
         # Next, we expand omega2
-        rate2expansion = np.zeros((self.Nvstars - self.Nvstars_pure, self.Nvstars - self.Nvstars_pure,
-                                   len(self.starset.jnet2)))
-        rate2escape = np.zeros((self.Nvstars - self.Nvstars_pure, len(self.starset.jnet2)))
-
-        for k, jumplist in zip(itertools.count(), self.starset.jnet2):
-            for jmp in jumplist:
+        jumps = [(k, jmp) for k, jumplist in enumerate(self.starset.jnet2) for jmp in jumplist]
+        k2 = np.array([k for k, jmp in jumps], dtype=int)
+        rows1 = self._staterows(mixedstates, [jmp.state1 for k, jmp in jumps])
+        rows2 = self._staterows(mixedstates, [jmp.state2 - jmp.state2.R_s for k, jmp in jumps])
 
-                indlist1 = self.stateToVecStar_mixed[jmp.state1]
-                indlist2 = self.stateToVecStar_mixed[jmp.state2 - jmp.state2.R_s]
+        rate2escape = np.zeros((Nvstars_mixed, len(self.starset.jnet2)))
+        n, vs, vsq = escapes(rows1, mixedarrays)
+        np.add.at(rate2escape, (vs - self.Nvstars_pure, k2[n]), -vsq)
 
-                for tup1 in indlist1:
-                    rate2escape[tup1[0] - self.Nvstars_pure, k] -= np.dot(self.vecvec[tup1[0]][tup1[1]],
-                                                                          self.vecvec[tup1[0]][tup1[1]])
-                    for tup2 in indlist2:
-                        rate2expansion[tup1[0] - self.Nvstars_pure, tup2[0] - self.Nvstars_pure, k] +=\
-                            np.dot(self.vecvec[tup1[0]][tup1[1]], self.vecvec[tup2[0]][tup2[1]])
+        n, vs1, vs2, vd = vdots(rows1, mixedarrays, rows2, mixedarrays)
+        rate2expansion = SparseExpansion((Nvstars_mixed, Nvstars_mixed, len(self.starset.jnet2)),
+                                         vs1 - self.Nvstars_pure, vs2 - self.Nvstars_pure, k2[n], vd)
 
-        return (zeroclean(rate0expansion), zeroclean(rate0escape)),\
-               (zeroclean(rate1expansion), zeroclean(rate1escape)),\
-               (zeroclean(rate2expansion), zeroclean(rate2escape)),\
-               (zeroclean(rate3expansion), zeroclean(rate3escape)),\
-               (zeroclean(rate4expansion), zeroclean(rate4escape))
+        return (rate0expansion, zeroclean(rate0escape)), (rate1expansion, zeroclean(rate1escape)),\
+               (rate2expansion, zeroclean(rate2escape)), (rate3expansion, zeroclean(rate3escape)),\
+               (rate4expansion, zeroclean(rate4escape))
 
     def outer(self):
         """
@@ -520,22 +622,17 @@ class vectorStars(VectorStarSet):
         :return: outerprod, dimxdimxNvstarsxNvstars outer product tensor.
         """
         # print("Building outer product tensor")
-        outerprod = np.zeros((self.crys.dim, self.crys.dim, self.Nvstars, self.Nvstars))
-
-        for st in self.starset.complexStates:
-            vecStarList = self.stateToVecStar_pure[st]
-            for (indStar1, indState1) in vecStarList:
-                for (indStar2, indState2) in vecStarList:
-                    outerprod[:, :, indStar1, indStar2] += np.outer(self.vecvec[indStar1][indState1],
-                                                                    self.vecvec[indStar2][indState2])
-
+        # Gather the vector star entries of the same state for every complex and mixed state at once, and add up the
+        # outer products of their vectors.
         # There should be no non-zero outer product tensors between the pure and mixed dumbbells.
-
-        for st in self.starset.mixedstates:
-            indlist = self.stateToVecStar_mixed[st]
-            for (IndofStar1, IndofState1) in indlist:
-                for (IndofStar2, IndofState2) in indlist:
-                    outerprod[:, :, IndofStar1, IndofStar2] += np.outer(self.vecvec[IndofStar1][IndofState1],
-                                                                      self.vecvec[IndofStar2][IndofState2])
-
-        return zeroclean(outerprod)
+        outerprod = np.zeros((self.Nvstars, self.Nvstars, self.crys.dim, self.crys.dim))
+        for states, vecstararrays in [(self.starset.complexStates, self.stateToVecStar_pure_arrays),
+                                      (self.starset.mixedstates, self.stateToVecStar_mixed_arrays)]:
+            rows = np.arange(len(states))
+            n, (vs1, slot1), (vs2, slot2) = self._vecstarpairs(rows, vecstararrays, rows, vecstararrays)
+            np.add.at(outerprod, (vs1, vs2), np.einsum("ni,nj->nij", self.vecvec_array[vs1, slot1],
+                                                       self.vecvec_array[vs2, slot2]))
+        outerprod = np.ascontiguousarray(outerprod.transpose((2, 3, 0, 1)))
+        # same as zeroclean, without going over the elements one by one
+        outerprod[np.abs(outerprod) < 1e-8] = 0.
+        return outerprod